@@ -23,8 +23,18 @@ try:
 except ImportError:
     _has_user_profiles = False
 
-from .router import PERMISSION_ACCESS_NAME, PERMISSION_READONLY_NAME
-from .internal_db import author_from_request
+from .router import (
+    PERMISSION_ACCESS_NAME,
+    PERMISSION_READONLY_NAME,
+    PERMISSION_IMPORT_NAME,
+    can_read,
+    request_allowed,
+)
+from .internal_db import (
+    CommentsDatabase,
+    author_from_request,
+    comments_database,
+)
 
 # Ensure route decorators fire
 from .routes import api, pages  # noqa: F401
@@ -59,6 +69,13 @@ def register_actions(datasette):
             name=PERMISSION_READONLY_NAME,
             description="Can read datasette-comments threads, comments and reactions.",
         ),
+        Action(
+            name=PERMISSION_IMPORT_NAME,
+            description=(
+                "Can bulk import datasette-comments threads, comments and reactions "
+                "on behalf of any actor."
+            ),
+        ),
     ]
 
 
@@ -136,20 +153,31 @@ async def startup(datasette):
         db = Database(conn)
         internal_migrations.apply(db)
 
-    await datasette.get_internal_database().execute_write_fn(migrate)
+    db = comments_database(datasette)
+    if isinstance(db, CommentsDatabase):
+        await db.enable_wal()
+    await db.execute_write_fn(migrate)
+
+
+IMPORT_PATH = "/-/datasette-comments/api/import"
+
+
+@hookimpl
+def skip_csrf(datasette, scope):
+    # like application/json, an NDJSON POST can't be sent cross-site without
+    # a CORS preflight, so the import endpoint doesn't need a CSRF token
+    if scope["type"] == "http" and scope["path"] == IMPORT_PATH:
+        content_type = dict(scope.get("headers") or []).get(b"content-type", b"")
+        return content_type.split(b";")[0].strip() == b"application/x-ndjson"
 
 
 SUPPORTED_VIEWS = ("index", "database", "table", "row")
 
 
 async def should_inject_content_script(datasette, request, view_name):
-    if not request:
+    if not request or view_name not in SUPPORTED_VIEWS:
         return False
-    if await datasette.allowed(
-        action=PERMISSION_ACCESS_NAME, actor=request.actor
-    ) or await datasette.allowed(action=PERMISSION_READONLY_NAME, actor=request.actor):
-        return view_name in SUPPORTED_VIEWS
-    return False
+    return await can_read(datasette, request)
 
 
 @hookimpl
@@ -164,8 +192,8 @@ async def extra_body_script(
                 "database": database,
                 "table": table,
                 "author": author.model_dump(),
-                "readonly_viewer": await datasette.allowed(
-                    action=PERMISSION_READONLY_NAME, actor=request.actor
+                "readonly_viewer": await request_allowed(
+                    datasette, request, PERMISSION_READONLY_NAME
                 ),
             }
         )
@@ -0,0 +1,400 @@
+from pydantic import ValidationError
+from typing import AsyncIterator, List
+from ulid import ULID
+import json
+
+from .internal_db import (
+    INSERT_COMMENT_SQL,
+    comment_params,
+    comments_database,
+    read_database,
+    resolve_target_labels,
+)
+from .page_data import (
+    ExportFilters,
+    ImportComment,
+    ImportReaction,
+    ImportRecordError,
+    ImportResponse,
+    ImportThread,
+)
+
+# Threads written per transaction during an import, with all their comments
+# and reactions
+IMPORT_CHUNK_SIZE = 500
+
+# Invalid records listed in an ImportResponse, the rest are only counted
+MAX_IMPORT_ERRORS = 100
+
+# Threads read per query during an export
+EXPORT_BATCH_SIZE = 500
+
+# Fields each target type needs, mirroring the thread/new endpoint
+IMPORT_TARGET_FIELDS = {
+    "database": ("database",),
+    "table": ("database", "table"),
+    "row": ("database", "table", "rowids"),
+}
+
+IMPORT_THREAD_SQL = """
+    INSERT OR IGNORE INTO datasette_comments_threads(
+      id,
+      created_at,
+      creator_actor_id,
+      target_type,
+      target_database,
+      target_table,
+      target_row_ids,
+      target_label,
+      resolved_at
+    )
+    VALUES (
+      :id,
+      coalesce(:created_at, CURRENT_TIMESTAMP),
+      :creator_actor_id,
+      :target_type,
+      :target_database,
+      :target_table,
+      :target_row_ids,
+      :target_label,
+      :resolved_at
+    )
+"""
+
+IMPORT_COMMENT_SQL = INSERT_COMMENT_SQL.replace(
+    "INSERT INTO", "INSERT OR IGNORE INTO", 1
+)
+
+IMPORT_REACTION_SQL = """
+    INSERT OR IGNORE INTO datasette_comments_reactions(
+      id,
+      comment_id,
+      reactor_actor_id,
+      reaction
+    )
+    VALUES (
+      :id,
+      :comment_id,
+      :reactor_actor_id,
+      :reaction
+    )
+"""
+
+
+async def request_body_lines(receive) -> AsyncIterator[bytes]:
+    """Lines of an ASGI request body, yielded as the body arrives."""
+    pending = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        chunk = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            pending.append(chunk[start:end])
+            yield b"".join(pending)
+            pending = []
+            start = end + 1
+        pending.append(chunk[start:])
+    if any(pending):
+        yield b"".join(pending)
+
+
+async def _iterate(records):
+    if hasattr(records, "__aiter__"):
+        async for record in records:
+            yield record
+    else:
+        for record in records:
+            yield record
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        (
+            "{}: {}".format(".".join(str(part) for part in e["loc"]), e["msg"])
+            if e["loc"]
+            else e["msg"]
+        )
+        for e in error.errors()
+    )
+
+
+def validate_import_record(record) -> ImportThread:
+    """An ImportThread from an NDJSON line or a dict, or raises ValueError."""
+    try:
+        if isinstance(record, (str, bytes)):
+            thread = ImportThread.model_validate_json(record)
+        else:
+            thread = ImportThread.model_validate(record)
+    except ValidationError as e:
+        raise ValueError(_validation_message(e))
+    fields = IMPORT_TARGET_FIELDS.get(thread.type)
+    if fields is None:
+        raise ValueError(f"target type '{thread.type}' not supported")
+    missing = [field for field in fields if getattr(thread, field) is None]
+    if missing:
+        raise ValueError(
+            "target type {} requires {}".format(
+                thread.type, ", ".join(f"'{field}'" for field in fields)
+            )
+        )
+    if not thread.comments:
+        raise ValueError("a thread needs at least one comment")
+    return thread
+
+
+def validate_export_filters(**filters) -> ExportFilters:
+    """ExportFilters from export_threads() keyword arguments, or raises ValueError."""
+    try:
+        return ExportFilters.model_validate(filters)
+    except ValidationError as e:
+        raise ValueError(_validation_message(e))
+
+
+async def _write_chunk(datasette, threads: List[ImportThread]):
+    row_targets = {
+        thread.id: (thread.database, thread.table, json.dumps(thread.rowids))
+        for thread in threads
+        if thread.type == "row"
+    }
+    labels = await resolve_target_labels(datasette, list(set(row_targets.values())))
+
+    # (thread row, [(comment row, [reaction row, ...]), ...]) per thread
+    records = []
+    for thread in threads:
+        target = row_targets.get(thread.id)
+        comments = []
+        for comment in thread.comments:
+            params = comment_params(
+                thread.id,
+                comment.author_actor_id,
+                comment.contents,
+                id=comment.id,
+                created_at=comment.created_at,
+            )
+            reactions = [
+                {
+                    "id": reaction.id or str(ULID()).lower(),
+                    "comment_id": params["id"],
+                    "reactor_actor_id": reaction.reactor_actor_id,
+                    "reaction": reaction.reaction,
+                }
+                for reaction in comment.reactions
+            ]
+            comments.append((params, reactions))
+        records.append(
+            (
+                {
+                    "id": thread.id,
+                    "created_at": thread.created_at,
+                    "creator_actor_id": thread.creator_actor_id,
+                    "target_type": thread.type,
+                    "target_database": thread.database,
+                    "target_table": thread.table,
+                    "target_row_ids": target[2] if target else None,
+                    "target_label": labels.get(target),
+                    "resolved_at": thread.resolved_at,
+                },
+                comments,
+            )
+        )
+
+    def write(conn):
+        # a thread or comment whose ID is already taken is skipped along with
+        # everything under it, rather than attached to the existing one
+        counts = [0, 0, 0]
+        conn.execute("begin")
+        for thread_row, comments in records:
+            if not conn.execute(IMPORT_THREAD_SQL, thread_row).rowcount:
+                continue
+            counts[0] += 1
+            for comment_row, reactions in comments:
+                if not conn.execute(IMPORT_COMMENT_SQL, comment_row).rowcount:
+                    continue
+                counts[1] += 1
+                for reaction_row in reactions:
+                    counts[2] += conn.execute(
+                        IMPORT_REACTION_SQL, reaction_row
+                    ).rowcount
+        return counts
+
+    return await comments_database(datasette).execute_write_fn(write, block=True)
+
+
+async def import_threads(
+    datasette, records, chunk_size: int = IMPORT_CHUNK_SIZE
+) -> ImportResponse:
+    """Import threads, with their comments and reactions, into the internal database.
+
+    records is an iterable or async iterable of NDJSON lines or dicts, each
+    matching ImportThread. It is consumed as it goes, with a transaction
+    every chunk_size threads, so it never needs to fit in memory. Invalid
+    records are skipped and reported by line number.
+    """
+    result = ImportResponse(
+        ok=True, threads=0, comments=0, reactions=0, failed=0, errors=[]
+    )
+    chunk = []
+
+    async def flush():
+        threads, comments, reactions = await _write_chunk(datasette, chunk)
+        result.threads += threads
+        result.comments += comments
+        result.reactions += reactions
+        chunk.clear()
+
+    line = 0
+    async for record in _iterate(records):
+        line += 1
+        if isinstance(record, (str, bytes)) and not record.strip():
+            continue
+        try:
+            thread = validate_import_record(record)
+        except ValueError as e:
+            result.failed += 1
+            if len(result.errors) < MAX_IMPORT_ERRORS:
+                result.errors.append(ImportRecordError(line=line, message=str(e)))
+            continue
+        thread.id = thread.id or str(ULID()).lower()
+        chunk.append(thread)
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+    result.ok = result.failed == 0
+    return result
+
+
+async def export_threads(
+    datasette,
+    database=None,
+    table=None,
+    since=None,
+    until=None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[ImportThread]:
+    """Every thread with its comments and reactions.
+
+    Threads are in primary key order, each thread's comments in the order they
+    were made. Optionally only threads on a database or table, and only
+    comments created in [since, until), which take the same date-times as
+    imported records. Threads with no matching comments are left out. The
+    output is the same shape import_threads() takes, so an export can be
+    imported again. Reads batch_size threads at a time, so
+    memory use doesn't grow with the size of the dataset.
+    """
+    filters = validate_export_filters(
+        database=database, table=table, since=since, until=until
+    )
+    db = read_database(datasette)
+    after = None
+    while True:
+        where = [
+            "(:database is null or target_database = :database)",
+            "(:table is null or target_table = :table)",
+        ]
+        # no lower bound on the first page: IDs have NUMERIC affinity, so
+        # there's no single value that sorts before all of them
+        if after is not None:
+            where.append("id > :after")
+        threads = (
+            await db.execute(
+                """
+                  select
+                    id,
+                    created_at,
+                    creator_actor_id,
+                    target_type,
+                    target_database,
+                    target_table,
+                    target_row_ids,
+                    resolved_at
+                  from datasette_comments_threads
+                  where {}
+                  order by id
+                  limit :limit
+                """.format(
+                    " and ".join(where)
+                ),
+                {
+                    "after": after,
+                    "database": filters.database,
+                    "table": filters.table,
+                    "limit": batch_size,
+                },
+            )
+        ).rows
+        if not threads:
+            return
+        after = threads[-1]["id"]
+
+        comments = (
+            await db.execute(
+                """
+                  select id, thread_id, author_actor_id, contents, created_at
+                  from datasette_comments_comments
+                  where thread_id in (select value from json_each(:thread_ids))
+                    and (:since is null or created_at >= :since)
+                    and (:until is null or created_at < :until)
+                  order by thread_id, created_at, id
+                """,
+                {
+                    "thread_ids": json.dumps([row["id"] for row in threads]),
+                    "since": filters.since,
+                    "until": filters.until,
+                },
+            )
+        ).rows
+        reactions = {}
+        if comments:
+            for row in await db.execute(
+                """
+                  select id, comment_id, reactor_actor_id, reaction
+                  from datasette_comments_reactions
+                  where comment_id in (select value from json_each(:comment_ids))
+                  order by comment_id, id
+                """,
+                {"comment_ids": json.dumps([row["id"] for row in comments])},
+            ):
+                reactions.setdefault(row["comment_id"], []).append(
+                    ImportReaction(
+                        id=row["id"],
+                        reactor_actor_id=row["reactor_actor_id"],
+                        reaction=row["reaction"],
+                    )
+                )
+
+        thread_comments = {}
+        for row in comments:
+            thread_comments.setdefault(row["thread_id"], []).append(
+                ImportComment(
+                    id=row["id"],
+                    author_actor_id=row["author_actor_id"],
+                    contents=row["contents"],
+                    created_at=row["created_at"],
+                    reactions=reactions.get(row["id"], []),
+                )
+            )
+        for row in threads:
+            if row["id"] not in thread_comments:
+                continue
+            yield ImportThread(
+                id=row["id"],
+                type=row["target_type"],
+                database=row["target_database"],
+                table=row["target_table"],
+                rowids=json.loads(row["target_row_ids"] or "null"),
+                creator_actor_id=row["creator_actor_id"],
+                created_at=row["created_at"],
+                resolved_at=row["resolved_at"],
+                comments=thread_comments[row["id"]],
+            )
+
+
+async def export_ndjson(datasette, **filters) -> AsyncIterator[str]:
+    """export_threads() as NDJSON lines, including the trailing newline."""
+    async for thread in export_threads(datasette, **filters):
+        yield thread.model_dump_json(exclude_none=True) + "\n"
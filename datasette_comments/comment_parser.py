@@ -1,6 +1,11 @@
-from typing import List, Union, Literal
-from dataclasses import asdict, dataclass
+from typing import Iterable, List, Union, Literal
+from dataclasses import dataclass
 from urllib.parse import urlparse
+import re
+
+# Stored alongside each comment's render nodes. Bump whenever a change here
+# would render existing comments differently, so they get re-rendered.
+PARSER_VERSION = 1
 
 
 def valid_url(s):
@@ -13,31 +18,21 @@ def valid_url(s):
 
 @dataclass
 class Token:
+    __slots__ = ("start", "end", "value")
     start: int
     end: int
     value: str
 
 
-def tokenize(source: str) -> List[Token]:
-    tokens = []
-    characters = list(source)
-    current = []
-    start = None
-    for idx, c in enumerate(characters):
-        if c.isspace():
-            if len(current) > 0:
-                tokens.append(Token(start, idx, "".join(current)))
-                current = []
-                start = None
-        else:
-            if len(current) == 0:
-                start = idx
-            current.append(c)
+# \S matches exactly the characters str.isspace() rejects
+TOKEN_PATTERN = re.compile(r"\S+")
 
-    if len(current) > 0:
-        tokens.append(Token(start, len(source), "".join(current)))
 
-    return tokens
+def tokenize(source: str) -> List[Token]:
+    return [
+        Token(match.start(), match.end(), match.group())
+        for match in TOKEN_PATTERN.finditer(source)
+    ]
 
 
 # assert tokenize("") == []
@@ -61,51 +56,24 @@ class RenderNode:
     value: str
 
 
-def split_raw_paragraphs(src: str) -> List[RenderNode]:
-    newline_idxs = [index for index, char in enumerate(src) if char == "\n"]
-    if len(newline_idxs) == 0:
-        return [RenderNode("raw", src)]
-    nodes = []
+def append_raw_paragraphs(src: str, nodes: List[dict]):
+    """Append "raw" and "linebreak" render node dicts for src to nodes."""
+    idx = src.find("\n")
+    if idx == -1:
+        nodes.append({"node_type": "raw", "value": src})
+        return
     prev = 0
-    for idx in newline_idxs:
+    while idx != -1:
+        # a leading line break leaves prev at 0, so the next raw node keeps it
         start = prev if prev == 0 else prev + 1
-        end = idx
         # happens when comment starts with a line break
-        if start == end:
-            nodes.append(RenderNode("linebreak", ""))
-        else:
-            nodes.extend(
-                [
-                    RenderNode("raw", src[start:end]),
-                    RenderNode("linebreak", ""),
-                ]
-            )
+        if start != idx:
+            nodes.append({"node_type": "raw", "value": src[start:idx]})
+        nodes.append({"node_type": "linebreak", "value": ""})
         prev = idx
+        idx = src.find("\n", idx + 1)
     if prev + 1 < len(src):
-        nodes.append(RenderNode("raw", src[prev + 1 :]))
-    return nodes
-
-
-def render_nodes(source: str, tokens: List[Token]) -> List[RenderNode]:
-    render_nodes = []
-    last_idx = 0
-    for token in tokens:
-        if token.value.startswith("@"):
-            render_nodes.extend(split_raw_paragraphs(source[last_idx : token.start]))
-            render_nodes.append(RenderNode("mention", token.value))
-            last_idx = token.end
-        elif token.value.startswith("#"):
-            render_nodes.extend(split_raw_paragraphs(source[last_idx : token.start]))
-            render_nodes.append(RenderNode("tag", token.value))
-            last_idx = token.end
-        elif token.value.startswith("http") and valid_url(token.value):
-            render_nodes.extend(split_raw_paragraphs(source[last_idx : token.start]))
-            render_nodes.append(RenderNode("url", token.value))
-            last_idx = token.end
-        else:
-            pass
-    render_nodes.extend(split_raw_paragraphs(source[last_idx : len(source)]))
-    return [asdict(node) for node in render_nodes]
+        nodes.append({"node_type": "raw", "value": src[prev + 1 :]})
 
 
 @dataclass
@@ -115,8 +83,8 @@ class ParseResult:
     tokens: List[Token]
     """all parsed tokens in the comment"""
 
-    rendered: List[RenderNode]
-    """Parsed render list of nodes that clients can use to safely render a comment"""
+    rendered: List[dict]
+    """Parsed render list of node dicts that clients can use to safely render a comment"""
 
     tags: List[Token]
     """token that start with a `#` hashtag"""
@@ -128,15 +96,35 @@ class ParseResult:
     """Tokens that are URLs"""
 
 
-def parse(source: str):
-    tokens = tokenize(source)
-    rendered = render_nodes(source, tokens)
-    tags = list(filter(lambda token: token.value.startswith("#"), tokens))
-    mentions = list(filter(lambda token: token.value.startswith("@"), tokens))
-    urls = list(
-        filter(
-            lambda token: token.value.startswith("http") and valid_url(token.value),
-            tokens,
-        )
-    )
+def parse(source: str) -> ParseResult:
+    tokens = []
+    rendered = []
+    tags = []
+    mentions = []
+    urls = []
+    last_idx = 0
+    for match in TOKEN_PATTERN.finditer(source):
+        value = match.group()
+        token = Token(match.start(), match.end(), value)
+        tokens.append(token)
+        if value[0] == "@":
+            node_type = "mention"
+            mentions.append(token)
+        elif value[0] == "#":
+            node_type = "tag"
+            tags.append(token)
+        elif value.startswith("http") and valid_url(value):
+            node_type = "url"
+            urls.append(token)
+        else:
+            continue
+        append_raw_paragraphs(source[last_idx : token.start], rendered)
+        rendered.append({"node_type": node_type, "value": value})
+        last_idx = token.end
+    append_raw_paragraphs(source[last_idx:], rendered)
     return ParseResult(tokens, rendered, tags, mentions, urls)
+
+
+def parse_many(sources: Iterable[str]) -> List[ParseResult]:
+    """parse() a batch of comments, for bulk reads and backfills."""
+    return [parse(source) for source in sources]
@@ -0,0 +1,200 @@
+from typing import Iterable, Optional, Tuple
+import asyncio
+import json
+import weakref
+
+from .internal_db import read_database
+
+# Events a subscriber may have waiting before it is told to resync. A slow
+# client never holds more than this in memory, however busy the tables are.
+QUEUE_SIZE = 64
+
+# Seconds between SSE comment lines on an idle stream, so proxies keep the
+# connection open and disconnected clients are noticed.
+KEEPALIVE_INTERVAL = 15
+
+Channel = Tuple[str, ...]
+
+
+def table_channel(database: str, table: str) -> Channel:
+    return ("table", database, table)
+
+
+def thread_channel(thread_id: str) -> Channel:
+    return ("thread", thread_id)
+
+
+class Subscription:
+    """A client's bounded queue of events from one or more channels.
+
+    When the queue fills up, everything waiting in it is replaced with a
+    single "resync" event: the client has missed events, so it should
+    refetch what it is showing instead of replaying them.
+    """
+
+    def __init__(self, channels: Iterable[Channel], queue_size: int = QUEUE_SIZE):
+        self.channels = frozenset(channels)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """The next event, or None if none arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    """In-process pub/sub of comment events, keyed by channel."""
+
+    def __init__(self):
+        self._subscriptions = {}
+
+    def __bool__(self):
+        return bool(self._subscriptions)
+
+    def subscribe(
+        self, channels: Iterable[Channel], queue_size: int = QUEUE_SIZE
+    ) -> Subscription:
+        subscription = Subscription(channels, queue_size)
+        for channel in subscription.channels:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for channel in subscription.channels:
+            subscribers = self._subscriptions.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[channel]
+
+    def publish(self, channels: Iterable[Channel], event: dict) -> int:
+        """Queue event for every subscriber of any of channels, once each."""
+        subscribers = set()
+        for channel in channels:
+            subscribers.update(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+        return len(subscribers)
+
+
+_event_buses: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def event_bus(datasette) -> EventBus:
+    bus = _event_buses.get(datasette)
+    if bus is None:
+        bus = _event_buses[datasette] = EventBus()
+    return bus
+
+
+async def _publish_to_thread(datasette, sql: str, params: tuple, event: dict):
+    bus = event_bus(datasette)
+    if not bus:
+        return
+    row = (await read_database(datasette).execute(sql, params)).first()
+    if row is None:
+        return
+    thread_id = row["id"]
+    channels = [thread_channel(thread_id)]
+    if row["target_table"] is not None:
+        channels.append(table_channel(row["target_database"], row["target_table"]))
+    bus.publish(channels, {**event, "thread_id": thread_id})
+
+
+async def publish_thread_event(datasette, thread_id: str, event: dict):
+    """Publish event to the thread's channel and, if it has one, its table's channel."""
+    await _publish_to_thread(
+        datasette,
+        """
+          select id, target_database, target_table
+          from datasette_comments_threads
+          where id = ?
+        """,
+        (thread_id,),
+        event,
+    )
+
+
+async def publish_comment_event(datasette, comment_id: str, event: dict):
+    """Like publish_thread_event(), for the thread the comment belongs to."""
+    await _publish_to_thread(
+        datasette,
+        """
+          select threads.id, threads.target_database, threads.target_table
+          from datasette_comments_comments as comments
+          join datasette_comments_threads as threads
+            on threads.id = comments.thread_id
+          where comments.id = ?
+        """,
+        (comment_id,),
+        {**event, "comment_id": comment_id},
+    )
+
+
+class EventStreamResponse:
+    """Streams a Subscription to the client as text/event-stream.
+
+    Datasette hands any object with asgi_send() the ASGI send callable, so
+    this holds the connection open until the client disconnects.
+    """
+
+    def __init__(self, bus: EventBus, subscription: Subscription, receive):
+        self.bus = bus
+        self.subscription = subscription
+        self.receive = receive
+
+    async def _disconnected(self):
+        while (await self.receive())["type"] != "http.disconnect":
+            pass
+
+    async def asgi_send(self, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    [b"content-type", b"text/event-stream; charset=utf-8"],
+                    [b"cache-control", b"no-cache"],
+                    [b"x-accel-buffering", b"no"],
+                ],
+            }
+        )
+        disconnected = asyncio.ensure_future(self._disconnected())
+        try:
+            await send(
+                {"type": "http.response.body", "body": b": ok\n\n", "more_body": True}
+            )
+            while True:
+                next_event = asyncio.ensure_future(
+                    self.subscription.get(KEEPALIVE_INTERVAL)
+                )
+                await asyncio.wait(
+                    {next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected.done():
+                    next_event.cancel()
+                    break
+                event = next_event.result()
+                if event is None:
+                    chunk = b": keepalive\n\n"
+                else:
+                    chunk = "event: {}\ndata: {}\n\n".format(
+                        event["type"], json.dumps(event)
+                    ).encode("utf-8")
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        finally:
+            disconnected.cancel()
+            self.bus.unsubscribe(self.subscription)
+        await send({"type": "http.response.body", "body": b""})
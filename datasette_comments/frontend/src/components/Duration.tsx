@@ -1,11 +1,17 @@
 import ms from "ms";
 
-export function Duration(props: { duration_ms: number; timestamp: string }) {
+// created_at values are SQLite CURRENT_TIMESTAMPs: "YYYY-MM-DD HH:MM:SS" in UTC
+export function msSince(timestamp: string): number {
+  return Date.now() - new Date(timestamp.replace(" ", "T") + "Z").getTime();
+}
+
+export function Duration(props: { timestamp: string }) {
+  const duration_ms = msSince(props.timestamp);
   return (
     <span style="font-size: .8rem" title={props.timestamp}>
-      {props.duration_ms < 1000
+      {duration_ms < 1000
         ? "Just now"
-        : `${ms(props.duration_ms, { long: true })} ago`}
+        : `${ms(duration_ms, { long: true })} ago`}
     </span>
   );
 }
@@ -11,7 +11,7 @@ import { ICONS } from "../lib/icons";
 import { Api } from "../lib/api";
 import type {
   CommentData,
-  ReactionData,
+  ReactionSummary,
   CommentTargetType,
   Author,
 } from "../lib/api";
@@ -30,17 +30,32 @@ const AuthorContext = createContext<Author>({
 
 function ReactionSection(props: {
   comment_id: string;
-  initialReactions: ReactionData[];
+  initialReactions: ReactionSummary[];
   readonly_viewer: boolean;
 }) {
-  const { actor_id } = useContext(AuthorContext);
-  const [reactions, setReactions] = useState<ReactionData[]>(
+  const [reactions, setReactions] = useState<ReactionSummary[]>(
     props.initialReactions
   );
   const [showReactionPopup, setShowReactionPopup] = useState<boolean>(false);
 
-  function refreshReactions() {
-    Api.reactions(props.comment_id).then((data) => setReactions(data));
+  // apply the viewer's own add/remove locally, instead of refetching every reactor
+  function updateReaction(reaction: string, reacted: boolean) {
+    setReactions((prev) => {
+      const delta = reacted ? 1 : -1;
+      const existing = prev.find((r) => r.reaction === reaction);
+      if (!existing) {
+        return reacted
+          ? [...prev, { reaction, count: 1, reacted_by_me: true }]
+          : prev;
+      }
+      return prev
+        .map((r) =>
+          r.reaction === reaction
+            ? { ...r, count: r.count + delta, reacted_by_me: reacted }
+            : r
+        )
+        .filter((r) => r.count > 0);
+    });
   }
   function onClickAddReaction(e: any) {
     if (props.readonly_viewer) return;
@@ -49,7 +64,9 @@ function ReactionSection(props: {
   }
   function onReact(reaction: string) {
     if (props.readonly_viewer) return;
-    Api.reactionAdd(props.comment_id, reaction).then(() => refreshReactions());
+    Api.reactionAdd(props.comment_id, reaction).then(() =>
+      updateReaction(reaction, true)
+    );
   }
 
   useEffect(() => {
@@ -73,41 +90,26 @@ function ReactionSection(props: {
     }
   }, [showReactionPopup, setShowReactionPopup]);
 
-  const reactionStats = new Map<string, string[]>();
-  for (const reaction of reactions) {
-    if (reactionStats.has(reaction.reaction)) {
-      reactionStats.set(reaction.reaction, [
-        ...reactionStats.get(reaction.reaction)!,
-        reaction.reactor_actor_id,
-      ]);
-    } else {
-      reactionStats.set(reaction.reaction, [reaction.reactor_actor_id]);
-    }
-  }
-
   return (
     <div class="datasette-comments-reactions">
-      {Array.from(reactionStats).map(([reaction, reactors], i) => (
+      {reactions.map(({ reaction, count, reacted_by_me }, i) => (
         <div>
           <button
             disabled={props.readonly_viewer}
             key={i}
-            class={
-              "other-reactions" +
-              (reactors.indexOf(actor_id) >= 0 ? " viewer-reacted" : "")
-            }
+            class={"other-reactions" + (reacted_by_me ? " viewer-reacted" : "")}
             onClick={() => {
               if (props.readonly_viewer) return;
-              if (reactionStats.get(reaction)?.find((id) => id === actor_id)) {
+              if (reacted_by_me) {
                 Api.reactionRemove(props.comment_id, reaction).then(() =>
-                  refreshReactions()
+                  updateReaction(reaction, false)
                 );
               } else {
                 onReact(reaction);
               }
             }}
           >
-            {reaction} {reactors.length}
+            {reaction} {count}
           </button>
         </div>
       ))}
@@ -126,10 +128,12 @@ function ReactionSection(props: {
         {showReactionPopup && (
           <div className="popup">
             {["👍", "👎", "😀", "😕", "🎉", "❤️", "🚀", "👀"]
-              .filter((reaction) => {
-                const stats = reactionStats.get(reaction);
-                return !stats ? true : stats.indexOf(actor_id) < 0;
-              })
+              .filter(
+                (reaction) =>
+                  !reactions.find(
+                    (r) => r.reaction === reaction && r.reacted_by_me
+                  )
+              )
               .map((d) => (
                 <button
                   key={d}
@@ -166,10 +170,7 @@ function Comment(props: { comment: CommentData; readonly_viewer: boolean }) {
         <div style="line-height: .9rem;">
           <strong>{comment.author.name}</strong>
           <div>
-            <Duration
-              duration_ms={comment.created_duration_seconds * 1000}
-              timestamp={comment.created_at}
-            />
+            <Duration timestamp={comment.created_at} />
           </div>
         </div>
       </div>
@@ -374,6 +375,9 @@ export interface ThreadProps {
   onNewThread?: (thread_id: string) => void;
   onResolvedThread?: () => void;
   readonly_viewer: boolean;
+  // comments of initialId already fetched by the parent, with
+  // Api.threadsComments(), so the thread doesn't fetch them itself
+  initialComments?: CommentData[];
 }
 
 export function Thread(props: ThreadProps) {
@@ -403,6 +407,10 @@ export function Thread(props: ThreadProps) {
   }, [props.initialId, setId]);
 
   useEffect(() => {
+    if (id !== null && id === props.initialId && props.initialComments) {
+      dispatch({ type: "success", data: props.initialComments });
+      return;
+    }
     refreshComments();
   }, [id]);
 
@@ -1,11 +1,12 @@
 import { render } from "preact";
 import { Thread } from "../components/Thread";
 import { Api } from "../lib/api";
-import type { Author } from "../lib/api";
+import type { Author, CommentData } from "../lib/api";
 import { useState } from "preact/hooks";
 
 function RowViewComments(props: {
   row_threads: string[];
+  comments: Record<string, CommentData[]>;
   author: Author;
   database: string;
   table: string;
@@ -21,6 +22,7 @@ function RowViewComments(props: {
       {row_threads.map((d) => (
         <Thread
           initialId={d}
+          initialComments={props.comments[d]}
           author={author}
           target={{ type: "row", database, table, rowids }}
           readonly_viewer={props.readonly_viewer}
@@ -52,6 +54,8 @@ export async function attachRowView(
 ) {
   const rowids = window.location.pathname.split("/").pop()!;
   const threads = await Api.rowViewThreads(database, table, rowids);
+  // every thread's comments in one request, rather than one per thread
+  const comments = await Api.threadsComments(threads.data.row_threads);
   const target = document
     .querySelector("section.content")!
     .appendChild(document.createElement("div"));
@@ -59,6 +63,7 @@ export async function attachRowView(
   render(
     <RowViewComments
       row_threads={threads.data.row_threads}
+      comments={comments}
       author={author}
       database={database}
       table={table}
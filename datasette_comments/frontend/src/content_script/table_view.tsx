@@ -168,6 +168,10 @@ export async function attachTableView(
     ])
   );
 
+  // for live updates: set a row's thread, by row or by its current thread
+  const setRowThread = new Map<string, (id: string | null) => void>();
+  const threadRows = new Map<string, string>();
+
   for (const { tdElement, pkEncoded } of rowids) {
     let thread_id: string | null = rowThreadLookup.get(pkEncoded) ?? null;
 
@@ -190,13 +194,22 @@ export async function attachTableView(
     });
     button.classList.add("datasette-comments-thread-button");
 
-    if (thread_id) {
-      button.classList.add("show");
+    function setThread(id: string | null) {
+      if (thread_id) {
+        threadRows.delete(thread_id);
+      }
+      thread_id = id;
+      if (thread_id) {
+        threadRows.set(thread_id, pkEncoded);
+      }
+      button.innerHTML = thread_id ? ICONS.COMMENT : ICONS.COMMENT_ADD;
+      button.querySelector("svg")!.setAttribute("width", "16");
+      button.querySelector("svg")!.setAttribute("height", "16");
+      button.classList.toggle("show", thread_id !== null);
+      span.style.display = !thread_id && readonly_viewer ? "none" : "";
     }
-
-    button.innerHTML = thread_id ? ICONS.COMMENT : ICONS.COMMENT_ADD;
-    button.querySelector("svg")!.setAttribute("width", "16");
-    button.querySelector("svg")!.setAttribute("height", "16");
+    setThread(thread_id);
+    setRowThread.set(pkEncoded, setThread);
 
     button.addEventListener("click", () => {
       render(null, THREAD_ROOT);
@@ -212,27 +225,42 @@ export async function attachTableView(
           initialId={thread_id}
           marked_resolved={false}
           author={author}
-          onNewThread={(id) => {
-            thread_id = id;
-            button.innerHTML = ICONS.COMMENT;
-            button.classList.add("show");
-          }}
-          onResolvedThread={() => {
-            thread_id = null;
-            button.innerHTML = ICONS.COMMENT_ADD;
-            button.classList.remove("show");
-          }}
+          onNewThread={(id) => setThread(id)}
+          onResolvedThread={() => setThread(null)}
           readonly_viewer={readonly_viewer}
         />,
         THREAD_ROOT
       );
     });
 
-    if (!thread_id && readonly_viewer) {
-      continue;
-    }
     span.appendChild(button);
     div.appendChild(span);
     tdElement.appendChild(div);
   }
+
+  Api.stream({ database, table }, async (event) => {
+    if (event.type === "thread_created" && event.rowids) {
+      setRowThread.get(event.rowids)?.(event.thread_id!);
+    } else if (event.type === "thread_resolved") {
+      const pkEncoded = threadRows.get(event.thread_id!);
+      if (pkEncoded !== undefined) {
+        setRowThread.get(pkEncoded)?.(null);
+      }
+    } else if (event.type === "resync") {
+      const response = await Api.tableViewThreads(
+        database,
+        table,
+        rowids.map((d) => d.pkEncoded)
+      );
+      const lookup = new Map(
+        response.data.row_threads.map((row_thread) => [
+          row_thread.rowids,
+          row_thread.id,
+        ])
+      );
+      for (const [pkEncoded, setThread] of setRowThread) {
+        setThread(lookup.get(pkEncoded) ?? null);
+      }
+    }
+  });
 }
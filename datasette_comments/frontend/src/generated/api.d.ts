@@ -46,6 +46,55 @@ export interface paths {
         patch?: never;
         trace?: never;
     };
+    "/-/datasette-comments/api/threads/comments": {
+        parameters: {
+            query?: never;
+            header?: never;
+            path?: never;
+            cookie?: never;
+        };
+        get?: never;
+        put?: never;
+        post: {
+            parameters: {
+                query?: never;
+                header?: never;
+                path?: never;
+                cookie?: never;
+            };
+            requestBody: {
+                content: {
+                    "application/json": {
+                        /** Thread Ids */
+                        thread_ids: string[];
+                    };
+                };
+            };
+            responses: {
+                /** @description OK */
+                200: {
+                    headers: {
+                        [name: string]: unknown;
+                    };
+                    content: {
+                        "application/json": {
+                            /** Ok */
+                            ok: boolean;
+                            /** Data */
+                            data: {
+                                [key: string]: components["schemas"]["CommentData"][];
+                            };
+                        };
+                    };
+                };
+            };
+        };
+        delete?: never;
+        options?: never;
+        head?: never;
+        patch?: never;
+        trace?: never;
+    };
     "/-/datasette-comments/api/thread/new": {
         parameters: {
             query?: never;
@@ -502,6 +551,11 @@ export interface paths {
                         "application/json": {
                             /** Data */
                             data: components["schemas"]["ActivitySearchResult"][];
+                            /**
+                             * Next Cursor
+                             * @default null
+                             */
+                            next_cursor: string | null;
                         };
                     };
                 };
@@ -581,19 +635,19 @@ export interface components {
             contents: string;
             /** Created At */
             created_at: string;
-            /** Created Duration Seconds */
-            created_duration_seconds: number;
             /** Render Nodes */
             render_nodes: components["schemas"]["RenderNode"][];
             /** Reactions */
-            reactions: components["schemas"]["ReactionData"][];
+            reactions: components["schemas"]["ReactionSummary"][];
         };
-        /** ReactionData */
-        ReactionData: {
-            /** Reactor Actor Id */
-            reactor_actor_id: string;
+        /** ReactionSummary */
+        ReactionSummary: {
             /** Reaction */
             reaction: string;
+            /** Count */
+            count: number;
+            /** Reacted By Me */
+            reacted_by_me: boolean;
         };
         /** RenderNode */
         RenderNode: {
@@ -608,11 +662,30 @@ export interface components {
             id: string;
             /** Rowids */
             rowids: string;
+            stats: components["schemas"]["ThreadStats"];
         };
         /** TableThreadItem */
         TableThreadItem: {
             /** Id */
             id: string;
+            stats: components["schemas"]["ThreadStats"];
+        };
+        /** ThreadStats */
+        ThreadStats: {
+            /** Comment Count */
+            comment_count: number;
+            /**
+             * Last Comment At
+             * @default null
+             */
+            last_comment_at: string | null;
+            /**
+             * Last Author Actor Id
+             * @default null
+             */
+            last_author_actor_id: string | null;
+            /** Participant Actor Ids */
+            participant_actor_ids: string[];
         };
         /** TableViewThreadsData */
         TableViewThreadsData: {
@@ -638,6 +711,8 @@ export interface components {
         };
         /** ActivitySearchResult */
         ActivitySearchResult: {
+            /** Id */
+            id: string;
             /** Author Actor Id */
             author_actor_id: string;
             author: components["schemas"]["Author"];
@@ -645,8 +720,6 @@ export interface components {
             contents: string;
             /** Created At */
             created_at: string;
-            /** Created Duration Seconds */
-            created_duration_seconds: number;
             /** Target Type */
             target_type: string;
             /**
@@ -674,6 +747,21 @@ export interface components {
              * @default null
              */
             target_label: string | null;
+            /** Thread Id */
+            thread_id: string;
+            thread_stats: components["schemas"]["ThreadStats"];
+            /**
+             * Snippet
+             * @default null
+             */
+            snippet: components["schemas"]["SnippetPart"][] | null;
+        };
+        /** SnippetPart */
+        SnippetPart: {
+            /** Value */
+            value: string;
+            /** Highlight */
+            highlight: boolean;
         };
     };
     responses: never;
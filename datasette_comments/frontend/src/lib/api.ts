@@ -5,10 +5,46 @@ const client = createClient<paths>({ baseUrl: "" });
 
 export type Author = components["schemas"]["Author"];
 export type CommentData = components["schemas"]["CommentData"];
-export type ReactionData = components["schemas"]["ReactionData"];
+export type ReactionSummary = components["schemas"]["ReactionSummary"];
 export type RenderNode = components["schemas"]["RenderNode"];
 export type ActivitySearchResult = components["schemas"]["ActivitySearchResult"];
 
+export interface TableViewThreadsResponse {
+  ok: boolean;
+  data: components["schemas"]["TableViewThreadsData"];
+}
+
+// Mirrors MAX_BATCH_THREADS in routes/api.py
+const MAX_BATCH_THREADS = 100;
+
+const STREAM_EVENT_TYPES = [
+  "thread_created",
+  "comment_added",
+  "thread_resolved",
+  "reaction_added",
+  "reaction_removed",
+  "resync",
+] as const;
+
+// Events from Api.stream(). They only carry IDs, refetch to see what changed.
+export interface StreamEvent {
+  type: (typeof STREAM_EVENT_TYPES)[number];
+  thread_id?: string;
+  comment_id?: string;
+  reaction?: string;
+  // thread_created only
+  target_type?: string;
+  database?: string;
+  table?: string;
+  rowids?: string | null;
+}
+
+// Every individual reaction on a comment, as returned by Api.reactions()
+export interface ReactionData {
+  reactor_actor_id: string;
+  reaction: string;
+}
+
 export type CommentTargetType =
   | { type: "database"; database: string }
   | { type: "table"; database: string; table: string }
@@ -21,6 +57,7 @@ export interface ActivitySearchParams {
   author: string | null;
   database: string | null;
   table: string | null;
+  cursor?: string | null;
 }
 
 // Thin wrapper that maintains the same call signatures as the old Api class
@@ -34,16 +71,58 @@ export class Api {
     return data!;
   }
 
+  // table_view is a POST, so unlike the GET endpoints the browser won't
+  // revalidate it with its ETag. Keep the last response for each page in
+  // sessionStorage and send its ETag, so an unchanged page gets a 304.
   static async tableViewThreads(
     database: string,
     table: string,
     rowids: string[]
-  ) {
-    const { data } = await client.POST(
+  ): Promise<TableViewThreadsResponse> {
+    const body = JSON.stringify({ database, table, rowids });
+    const key = `datasette-comments:table_view:${body}`;
+    const cached = JSON.parse(sessionStorage.getItem(key) ?? "null");
+    const response = await fetch(
       "/-/datasette-comments/api/threads/table_view",
-      { body: { database, table, rowids } }
+      {
+        method: "POST",
+        credentials: "include",
+        headers: {
+          "Content-Type": "application/json",
+          ...(cached ? { "If-None-Match": cached.etag } : {}),
+        },
+        body,
+      }
     );
-    return data!;
+    if (response.status === 304 && cached) {
+      return cached.data;
+    }
+    const data: TableViewThreadsResponse = await response.json();
+    const etag = response.headers.get("ETag");
+    if (etag) {
+      try {
+        sessionStorage.setItem(key, JSON.stringify({ etag, data }));
+      } catch {
+        // storage full or disabled, just skip caching
+      }
+    }
+    return data;
+  }
+
+  static stream(
+    params: { database: string; table: string } | { thread_id: string },
+    onEvent: (event: StreamEvent) => void
+  ): EventSource {
+    const source = new EventSource(
+      `/-/datasette-comments/api/stream?${new URLSearchParams(params)}`,
+      { withCredentials: true }
+    );
+    for (const type of STREAM_EVENT_TYPES) {
+      source.addEventListener(type, (e) =>
+        onEvent(JSON.parse((e as MessageEvent).data))
+      );
+    }
+    return source;
   }
 
   static async rowViewThreads(
@@ -74,6 +153,22 @@ export class Api {
     return data!;
   }
 
+  // comments for many threads at once, keyed by thread ID. One request per
+  // MAX_BATCH_THREADS threads, the most the endpoint accepts.
+  static async threadsComments(
+    thread_ids: string[]
+  ): Promise<Record<string, CommentData[]>> {
+    const comments: Record<string, CommentData[]> = {};
+    for (let i = 0; i < thread_ids.length; i += MAX_BATCH_THREADS) {
+      const { data } = await client.POST(
+        "/-/datasette-comments/api/threads/comments",
+        { body: { thread_ids: thread_ids.slice(i, i + MAX_BATCH_THREADS) } }
+      );
+      Object.assign(comments, data!.data);
+    }
+    return comments;
+  }
+
   static async commentAdd(thread_id: string, contents: string) {
     const { data } = await client.POST(
       "/-/datasette-comments/api/thread/comment/add",
@@ -129,12 +224,16 @@ export class Api {
     if (params.author) searchParams.set("author", params.author);
     if (params.database) searchParams.set("database", params.database);
     if (params.table) searchParams.set("table", params.table);
+    if (params.cursor) searchParams.set("cursor", params.cursor);
 
     // activity_search uses query params, not request body
     const resp = await fetch(
       `/-/datasette-comments/api/activity_search?${searchParams}`,
       { credentials: "include" }
     );
-    return (await resp.json()) as { data: ActivitySearchResult[] };
+    return (await resp.json()) as {
+      data: ActivitySearchResult[];
+      next_cursor: string | null;
+    };
   }
 }
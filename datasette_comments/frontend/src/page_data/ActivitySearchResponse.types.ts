@@ -5,6 +5,7 @@
  * and run json-schema-to-typescript to regenerate this file.
  */
 
+export type Id = string;
 export type AuthorActorId = string;
 export type ActorId = string;
 export type Name = string | null;
@@ -12,31 +13,43 @@ export type ProfilePhotoUrl = string | null;
 export type Username = string | null;
 export type Contents = string;
 export type CreatedAt = string;
-export type CreatedDurationSeconds = number;
 export type TargetType = string;
 export type TargetDatabase = string | null;
 export type TargetTable = string | null;
 export type TargetRowIds = string | null;
 export type TargetColumn = string | null;
 export type TargetLabel = string | null;
+export type ThreadId = string;
+export type CommentCount = number;
+export type LastCommentAt = string | null;
+export type LastAuthorActorId = string | null;
+export type ParticipantActorIds = string[];
+export type Snippet = SnippetPart[] | null;
+export type Value = string;
+export type Highlight = boolean;
 export type Data = ActivitySearchResult[];
+export type NextCursor = string | null;
 
 export interface ActivitySearchResponse {
   data: Data;
+  next_cursor?: NextCursor;
   [k: string]: unknown;
 }
 export interface ActivitySearchResult {
+  id: Id;
   author_actor_id: AuthorActorId;
   author: Author;
   contents: Contents;
   created_at: CreatedAt;
-  created_duration_seconds: CreatedDurationSeconds;
   target_type: TargetType;
   target_database?: TargetDatabase;
   target_table?: TargetTable;
   target_row_ids?: TargetRowIds;
   target_column?: TargetColumn;
   target_label?: TargetLabel;
+  thread_id: ThreadId;
+  thread_stats: ThreadStats;
+  snippet?: Snippet;
   [k: string]: unknown;
 }
 export interface Author {
@@ -46,3 +59,15 @@ export interface Author {
   username?: Username;
   [k: string]: unknown;
 }
+export interface ThreadStats {
+  comment_count: CommentCount;
+  last_comment_at?: LastCommentAt;
+  last_author_actor_id?: LastAuthorActorId;
+  participant_actor_ids: ParticipantActorIds;
+  [k: string]: unknown;
+}
+export interface SnippetPart {
+  value: Value;
+  highlight: Highlight;
+  [k: string]: unknown;
+}
@@ -12,20 +12,19 @@ export type ProfilePhotoUrl = string | null;
 export type Username = string | null;
 export type Contents = string;
 export type CreatedAt = string;
-export type CreatedDurationSeconds = number;
 export type NodeType = string;
 export type Value = string;
 export type RenderNodes = RenderNode[];
-export type ReactorActorId = string;
 export type Reaction = string;
-export type Reactions = ReactionData[];
+export type Count = number;
+export type ReactedByMe = boolean;
+export type Reactions = ReactionSummary[];
 
 export interface CommentData {
   id: Id;
   author: Author;
   contents: Contents;
   created_at: CreatedAt;
-  created_duration_seconds: CreatedDurationSeconds;
   render_nodes: RenderNodes;
   reactions: Reactions;
   [k: string]: unknown;
@@ -42,8 +41,9 @@ export interface RenderNode {
   value: Value;
   [k: string]: unknown;
 }
-export interface ReactionData {
-  reactor_actor_id: ReactorActorId;
+export interface ReactionSummary {
   reaction: Reaction;
+  count: Count;
+  reacted_by_me: ReactedByMe;
   [k: string]: unknown;
 }
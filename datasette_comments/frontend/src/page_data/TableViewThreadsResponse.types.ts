@@ -7,6 +7,10 @@
 
 export type Ok = boolean;
 export type Id = string;
+export type CommentCount = number;
+export type LastCommentAt = string | null;
+export type LastAuthorActorId = string | null;
+export type ParticipantActorIds = string[];
 export type TableThreads = TableThreadItem[];
 export type ColumnThreads = unknown[];
 export type Id1 = string;
@@ -28,10 +32,19 @@ export interface TableViewThreadsData {
 }
 export interface TableThreadItem {
   id: Id;
+  stats: ThreadStats;
+  [k: string]: unknown;
+}
+export interface ThreadStats {
+  comment_count: CommentCount;
+  last_comment_at?: LastCommentAt;
+  last_author_actor_id?: LastAuthorActorId;
+  participant_actor_ids: ParticipantActorIds;
   [k: string]: unknown;
 }
 export interface RowThreadItem {
   id: Id1;
   rowids: Rowids;
+  stats: ThreadStats;
   [k: string]: unknown;
 }
@@ -0,0 +1,13 @@
+/* eslint-disable */
+/**
+ * This file was automatically generated by json-schema-to-typescript.
+ * DO NOT MODIFY IT BY HAND. Instead, modify the source JSONSchema file,
+ * and run json-schema-to-typescript to regenerate this file.
+ */
+
+export type ThreadIds = string[];
+
+export interface ThreadsCommentsRequest {
+  thread_ids: ThreadIds;
+  [k: string]: unknown;
+}
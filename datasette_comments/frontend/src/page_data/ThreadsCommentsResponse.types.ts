@@ -0,0 +1,58 @@
+/* eslint-disable */
+/**
+ * This file was automatically generated by json-schema-to-typescript.
+ * DO NOT MODIFY IT BY HAND. Instead, modify the source JSONSchema file,
+ * and run json-schema-to-typescript to regenerate this file.
+ */
+
+export type Ok = boolean;
+export type Id = string;
+export type ActorId = string;
+export type Name = string | null;
+export type ProfilePhotoUrl = string | null;
+export type Username = string | null;
+export type Contents = string;
+export type CreatedAt = string;
+export type NodeType = string;
+export type Value = string;
+export type RenderNodes = RenderNode[];
+export type Reaction = string;
+export type Count = number;
+export type ReactedByMe = boolean;
+export type Reactions = ReactionSummary[];
+
+export interface ThreadsCommentsResponse {
+  ok: Ok;
+  data: Data;
+  [k: string]: unknown;
+}
+export interface Data {
+  [k: string]: CommentData[];
+}
+export interface CommentData {
+  id: Id;
+  author: Author;
+  contents: Contents;
+  created_at: CreatedAt;
+  render_nodes: RenderNodes;
+  reactions: Reactions;
+  [k: string]: unknown;
+}
+export interface Author {
+  actor_id: ActorId;
+  name?: Name;
+  profile_photo_url?: ProfilePhotoUrl;
+  username?: Username;
+  [k: string]: unknown;
+}
+export interface RenderNode {
+  node_type: NodeType;
+  value: Value;
+  [k: string]: unknown;
+}
+export interface ReactionSummary {
+  reaction: Reaction;
+  count: Count;
+  reacted_by_me: ReactedByMe;
+  [k: string]: unknown;
+}
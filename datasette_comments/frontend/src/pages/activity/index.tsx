@@ -40,7 +40,7 @@ function targetPath({
 }
 
 function ResultRow(props: { data: ActivitySearchResult; isLastRead: boolean }) {
-  const { author, contents, created_at, created_duration_seconds } = props.data;
+  const { author, contents, snippet, created_at } = props.data;
   const target = targetPath(props.data);
   return (
     <div
@@ -71,13 +71,16 @@ function ResultRow(props: { data: ActivitySearchResult; isLastRead: boolean }) {
           <b style="font-weight: 600;">
             <a href={"/" + target}>{props.data.target_label ?? target}</a>
           </b>{" "}
-          <Duration
-            duration_ms={created_duration_seconds * 1000}
-            timestamp={created_at}
-          />
+          <Duration timestamp={created_at} />
         </div>
         <div style="padding-left: 1rem;">
-          <i style="font-style: italic">{contents}</i>
+          <i style="font-style: italic">
+            {snippet
+              ? snippet.map((part) =>
+                  part.highlight ? <mark>{part.value}</mark> : part.value
+                )
+              : contents}
+          </i>
         </div>
       </span>
       {props.isLastRead && (
@@ -250,18 +253,25 @@ function ActivityView() {
     State<ActivitySearchResult[], string>,
     Action<ActivitySearchResult[], string>
   >(apiReducer, { isLoading: true });
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
-  useSignalEffect(() => {
-    dispatch({ type: "init" });
-    Api.activitySearch({
+  function search(cursor: string | null) {
+    return Api.activitySearch({
       searchComments: STATE.searchComments.value,
       containsTags: STATE.containsTag.value,
       isResolved: STATE.isResolved.value,
       author: STATE.author.value,
       database: STATE.database.value,
       table: STATE.table.value,
-    })
+      cursor,
+    });
+  }
+
+  useSignalEffect(() => {
+    dispatch({ type: "init" });
+    search(null)
       .then((data) => {
+        setNextCursor(data.next_cursor);
         dispatch({ type: "success", data: data.data });
       })
       .catch((error) => {
@@ -269,6 +279,17 @@ function ActivityView() {
       });
   });
 
+  function loadMore() {
+    search(nextCursor)
+      .then((more) => {
+        setNextCursor(more.next_cursor);
+        dispatch({ type: "success", data: [...data.data!, ...more.data] });
+      })
+      .catch((error) => {
+        dispatch({ type: "failure", error: error.toString() });
+      });
+  }
+
   return (
     <div className="datasette-comments-activity-view">
       <div className="header">
@@ -292,6 +313,9 @@ function ActivityView() {
         ) : (
           <p>No comments yet</p>
         )}
+        {!data.isLoading && nextCursor ? (
+          <button onClick={loadMore}>Load more</button>
+        ) : null}
       </div>
     </div>
   );
@@ -1,8 +1,10 @@
 import { h, render } from "preact";
 import { useState, useEffect } from "preact/hooks";
 import register from "preact-custom-element";
+import { msSince } from "../../components/Duration";
 
-function timeAgo(seconds: number): string {
+function timeAgo(timestamp: string): string {
+  const seconds = msSince(timestamp) / 1000;
   if (seconds < 60) return "just now";
   if (seconds < 3600) return Math.floor(seconds / 60) + "m ago";
   if (seconds < 86400) return Math.floor(seconds / 3600) + "h ago";
@@ -12,7 +14,6 @@ function timeAgo(seconds: number): string {
 interface ActivityItem {
   type: "comment" | "reaction";
   created_at: string;
-  created_duration_seconds: number;
   target_type: string;
   target_database?: string;
   target_table?: string;
@@ -59,7 +60,7 @@ function CommentItem({ item }: { item: ActivityItem }) {
           {item.target_label || targetPath(item)}
         </a>{" "}
         <span style="color: #999;">
-          {timeAgo(item.created_duration_seconds)}
+          {timeAgo(item.created_at)}
         </span>
       </div>
       <div style="font-size: 0.9rem; font-style: italic; padding-left: 8px;">
@@ -81,7 +82,7 @@ function ReactionItem({ item }: { item: ActivityItem }) {
           {item.target_label || targetPath(item)}
         </a>{" "}
         <span style="color: #999;">
-          {timeAgo(item.created_duration_seconds)}
+          {timeAgo(item.created_at)}
         </span>
       </div>
       <div style="font-size: 0.9rem; color: #888; padding-left: 8px;">
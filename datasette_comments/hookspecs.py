@@ -30,3 +30,21 @@ def datasette_comments_users(datasette):
       - profile_photo_url: Optional URL to the user's profile pic.
       - email: Optional email used for gravatar profile photo, if enabled.
     """
+
+
+@hookspec
+def datasette_comments_users_search(datasette, prefix, username, limit):
+    """
+    Search users that can be authors or mentioned in comments, for plugins
+    with too many users to list from datasette_comments_users().
+
+    Called with either:
+
+      - prefix: return up to limit users whose username or name starts with
+        prefix, case-insensitively. prefix may be an empty string.
+      - username: return the user with exactly that username, if any.
+
+    The other argument is None. Returns a list, or an awaitable returning a
+    list, of dicts with the same keys as datasette_comments_users(). Users
+    from datasette_comments_users() are still searched as well.
+    """
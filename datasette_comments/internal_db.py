@@ -2,69 +2,665 @@ from typing import List
 from ulid import ULID
 from . import comment_parser
 from .page_data import Author
+from .user_index import invalidate_user_index
+from datasette.database import Database, Results
+from datasette.tracer import trace, trace_child_tasks
+from datasette.utils import escape_fts, sqlite_timelimit
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from pathlib import Path
+import asyncio
+import base64
+import contextvars
 import json
+import logging
+import sqlite3
+import threading
+import time
+import weakref
 
 from datasette_user_profiles.routes.pages import get_profile
 
+logger = logging.getLogger(__name__)
+
+
+# Default for the "database_cache_size_kb" plugin config option, the SQLite
+# page cache of each connection to a dedicated comments database
+COMMENTS_DATABASE_CACHE_SIZE_KB = 16384
+
+
+def _file_uri(path, mode=None) -> str:
+    uri = Path(path).resolve().as_uri()
+    return f"{uri}?mode={mode}" if mode else uri
+
+
+class CommentsDatabase(Database):
+    """A SQLite file of its own for the comments tables.
+
+    Uses WAL, so reads don't wait on writes, with synchronous=NORMAL, which in
+    WAL mode can only lose the last commits on power loss and never corrupts.
+    """
+
+    def __init__(self, ds, path, cache_size_kb=COMMENTS_DATABASE_CACHE_SIZE_KB):
+        super().__init__(ds, path=path, is_mutable=True)
+        self.name = "datasette_comments"
+        self.cache_size_kb = cache_size_kb
+
+    def connect(self, write=False):
+        # Database.connect() puts the path into a file: URI as it is, which
+        # breaks on paths containing "?", "#" or "%"
+        conn = sqlite3.connect(
+            _file_uri(self.path, None if write else "ro"),
+            uri=True,
+            check_same_thread=False,
+            **({"isolation_level": "IMMEDIATE"} if write else {}),
+        )
+        self._all_file_connections.append(conn)
+        # per connection settings, journal_mode=wal is stored in the file
+        conn.execute("pragma synchronous = normal")
+        conn.execute(f"pragma cache_size = -{int(self.cache_size_kb)}")
+        return conn
+
+    def close(self):
+        pool = _read_pools.pop(self, None)
+        if pool is not None:
+            pool.close()
+        super().close()
+
+    async def enable_wal(self):
+        # can't change journal mode inside a transaction
+        await self.execute_write_fn(
+            lambda conn: conn.execute("pragma journal_mode = wal").fetchone(),
+            transaction=False,
+        )
+
+
+_comments_databases: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def comments_database(datasette) -> Database:
+    """The database holding the comments tables.
+
+    That's the "database_path" plugin config option if set, otherwise
+    Datasette's internal database.
+    """
+    db = _comments_databases.get(datasette)
+    if db is None:
+        config = datasette.plugin_config("datasette-comments") or {}
+        path = config.get("database_path")
+        if not path:
+            return datasette.get_internal_database()
+        db = _comments_databases[datasette] = CommentsDatabase(
+            # a proxy, so the cached database doesn't keep its Datasette alive
+            weakref.proxy(datasette),
+            path,
+            config.get("database_cache_size_kb", COMMENTS_DATABASE_CACHE_SIZE_KB),
+        )
+    return db
 
-def insert_comment(thread_id: str, author_actor_id: str, contents: str):
-    id = str(ULID()).lower()
-    parsed = comment_parser.parse(contents)
-    mentions = list(set(mention.value[1:] for mention in parsed.mentions))
-    hashtags = list(set(mention.value[1:] for mention in parsed.tags))
 
-    SQL = """
-        INSERT INTO datasette_comments_comments(
-          id,
-          thread_id,
-          author_actor_id,
-          contents,
-          mentions,
-          hashtags,
-          past_revisions
+# Default for the "read_pool_size" plugin config option. 0 runs comment reads
+# on Datasette's own query threads instead.
+READ_POOL_SIZE = 4
+
+# Prepared statements each pooled connection keeps, looked up by SQL text
+READ_STATEMENT_CACHE_SIZE = 256
+
+
+class ReadPool:
+    """Read-only connections to the comments database, on threads of their own.
+
+    Datasette runs reads for every database on one small executor, shared
+    with users' own SQL queries. Comment reads get a pool here instead, so
+    they neither wait behind slow queries nor hold them up. Writes stay on
+    the database's single write thread.
+    """
+
+    def __init__(self, name, uri, size, time_limit_ms, cache_size_kb=None):
+        self.name = name
+        self.uri = uri
+        self.size = size
+        self.time_limit_ms = time_limit_ms
+        self.cache_size_kb = cache_size_kb
+        self._executor = ThreadPoolExecutor(
+            size, thread_name_prefix="datasette-comments-read"
         )
-        VALUES (
-          :id,
-          :thread_id,
-          :author_actor_id,
-          :contents,
-          :mentions,
-          :hashtags,
-          json_array()
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # closes the connections if the pool is dropped without close()
+        self._finalizer = weakref.finalize(
+            self, ReadPool._close, self._executor, self._connections, self._lock
         )
+
+    @staticmethod
+    def _close(executor, connections, lock):
+        executor.shutdown(wait=False)
+        with lock:
+            for conn in connections:
+                conn.close()
+            connections.clear()
+
+    def close(self):
+        """Wait for running reads, then close every pooled connection."""
+        self._executor.shutdown(wait=True)
+        self._finalizer()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.uri,
+                uri=True,
+                check_same_thread=False,
+                cached_statements=READ_STATEMENT_CACHE_SIZE,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.text_factory = lambda x: str(x, "utf-8", "replace")
+            conn.execute("pragma query_only = 1")
+            if self.cache_size_kb:
+                conn.execute(f"pragma cache_size = -{int(self.cache_size_kb)}")
+            with self._lock:
+                self._connections.append(conn)
+            self._local.conn = conn
+        return conn
+
+    async def execute(self, sql: str, params=None) -> Results:
+        def run():
+            conn = self._connection()
+            with sqlite_timelimit(conn, self.time_limit_ms):
+                cursor = conn.execute(sql, params if params is not None else {})
+                return Results(cursor.fetchall(), False, cursor.description)
+
+        with trace("sql", database=self.name, sql=sql.strip(), params=params):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+
+# Database -> ReadPool
+_read_pools: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def read_database(datasette):
+    """Where to run read-only queries against the comments tables.
+
+    A ReadPool of "read_pool_size" connections for a dedicated comments
+    database, which uses WAL so its readers never wait on the writer.
+    Otherwise comments_database() itself: Datasette's internal database is
+    in memory with a shared cache, where a second connection would be
+    refused with "database table is locked" during every write. Either has
+    execute(sql, params).
     """
-    params = {
-        "id": id,
+    db = comments_database(datasette)
+    pool = _read_pools.get(db)
+    if pool is None:
+        config = datasette.plugin_config("datasette-comments") or {}
+        size = config.get("read_pool_size", READ_POOL_SIZE)
+        if (
+            not size
+            or not isinstance(db, CommentsDatabase)
+            or datasette.executor is None
+        ):
+            return db
+        pool = _read_pools[db] = ReadPool(
+            db.name,
+            _file_uri(db.path, "ro"),
+            size,
+            datasette.setting("sql_time_limit_ms"),
+            cache_size_kb=getattr(db, "cache_size_kb", None),
+        )
+    return pool
+
+
+INSERT_COMMENT_SQL = """
+    INSERT INTO datasette_comments_comments(
+      id,
+      thread_id,
+      created_at,
+      updated_at,
+      author_actor_id,
+      contents,
+      mentions,
+      hashtags,
+      render_nodes,
+      render_version,
+      past_revisions
+    )
+    VALUES (
+      :id,
+      :thread_id,
+      coalesce(:created_at, CURRENT_TIMESTAMP),
+      coalesce(:created_at, CURRENT_TIMESTAMP),
+      :author_actor_id,
+      :contents,
+      :mentions,
+      :hashtags,
+      :render_nodes,
+      :render_version,
+      json_array()
+    )
+"""
+
+
+def comment_params(
+    thread_id: str, author_actor_id: str, contents: str, id=None, created_at=None
+) -> dict:
+    """INSERT_COMMENT_SQL parameters for a comment, parsed and rendered."""
+    parsed = comment_parser.parse(contents)
+    mentions = list(set(mention.value[1:] for mention in parsed.mentions))
+    hashtags = list(set(mention.value[1:] for mention in parsed.tags))
+    return {
+        "id": id or str(ULID()).lower(),
         "thread_id": thread_id,
+        "created_at": created_at,
         "author_actor_id": author_actor_id,
         "contents": contents,
         "mentions": json.dumps(mentions),
         "hashtags": json.dumps(hashtags),
+        "render_nodes": json.dumps(parsed.rendered),
+        "render_version": comment_parser.PARSER_VERSION,
     }
 
-    return (SQL, params)
 
+def insert_comment(thread_id: str, author_actor_id: str, contents: str):
+    return (INSERT_COMMENT_SQL, comment_params(thread_id, author_actor_id, contents))
 
-async def author_from_profile(datasette, actor_id) -> Author:
-    """Build an Author from datasette-user-profiles data."""
-    profile = await get_profile(datasette, actor_id)
-    photo_url = f"/-/profile/pic/{actor_id}" if profile.has_photo else None
+
+# Markers passed to FTS5's snippet(), split back out by snippet_parts().
+# Control characters, so they can't be confused with anything in a comment.
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+
+def fts_query(search: str) -> str:
+    """Escape free text typed into the activity search for an FTS5 MATCH.
+
+    The final term is made a prefix query, so partially-typed words still match.
+    """
+    query = escape_fts(search)
+    if query and not search[-1].isspace():
+        query += " *"
+    return query
+
+
+def snippet_parts(snippet: str) -> List[dict]:
+    """Split an FTS5 snippet into {"value", "highlight"} parts."""
+    parts = []
+    for i, chunk in enumerate(snippet.split(SNIPPET_START)):
+        if i == 0:
+            head, tail = None, chunk
+        else:
+            head, _, tail = chunk.partition(SNIPPET_END)
+        if head:
+            parts.append({"value": head, "highlight": True})
+        if tail:
+            parts.append({"value": tail, "highlight": False})
+    return parts
+
+
+def encode_cursor(created_at: str, id: str) -> str:
+    """Opaque keyset pagination cursor for the (created_at, id) of the last row on a page."""
+    return base64.urlsafe_b64encode(json.dumps([created_at, id]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor(), raises ValueError on a malformed cursor."""
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    if not isinstance(created_at, str) or not isinstance(id, str):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return created_at, id
+
+
+def _author(actor_id: str, display_name, has_photo) -> Author:
+    photo_url = f"/-/profile/pic/{actor_id}" if has_photo else None
     return Author(
         actor_id=actor_id,
-        name=profile.display_name or actor_id,
+        name=display_name or actor_id,
         profile_photo_url=photo_url,
         username=actor_id,
     )
 
 
+# Max concurrent get_profile() calls when profiles can't be loaded in bulk
+PROFILE_LOOKUP_CONCURRENCY = 8
+
+# (id(datasette), actor_id) -> Task loading that actor's Author, for lookups
+# currently running, so concurrent requests for the same actor share one query.
+_pending_authors: dict = {}
+
+
+# Defaults for the "author_cache_ttl" (seconds) and "author_cache_size" plugin
+# config options. A TTL of 0 disables the cache.
+AUTHOR_CACHE_TTL = 60
+AUTHOR_CACHE_SIZE = 1000
+
+
+class AuthorCache:
+    """Bounded LRU of Author objects keyed by actor ID, each kept for ttl seconds.
+
+    Entries expire together at the end of each ttl-long period(), so a
+    response that embeds cached authors can be cached until then.
+    """
+
+    def __init__(
+        self, ttl: float = AUTHOR_CACHE_TTL, max_size: int = AUTHOR_CACHE_SIZE
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # bumped by invalidate(), so lookups that started before an
+        # invalidation don't store what they loaded
+        self.generation = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, actor_id: str):
+        entry = self._entries.get(actor_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(actor_id)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[actor_id]
+        self.misses += 1
+        return None
+
+    def period(self) -> int:
+        """Number of the current ttl-long period.
+
+        With the cache disabled periods are AUTHOR_CACHE_TTL long, so a
+        response embedding authors is still revalidated now and then.
+        """
+        ttl = self.ttl if self.ttl > 0 else AUTHOR_CACHE_TTL
+        return int(time.monotonic() // ttl)
+
+    def set_many(self, authors: dict[str, Author], generation: int):
+        if self.ttl <= 0 or self.max_size <= 0 or generation != self.generation:
+            return
+        expires = (self.period() + 1) * self.ttl
+        for actor_id, author in authors.items():
+            self._entries[actor_id] = (expires, author)
+            self._entries.move_to_end(actor_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, actor_ids=None):
+        """Forget the given actors, or every actor if actor_ids is None."""
+        self.generation += 1
+        if actor_ids is None:
+            self._entries.clear()
+        else:
+            for actor_id in actor_ids:
+                self._entries.pop(actor_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+        }
+
+
+_author_caches: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def author_cache(datasette) -> AuthorCache:
+    """The AuthorCache for this Datasette instance, created from plugin config."""
+    cache = _author_caches.get(datasette)
+    if cache is None:
+        config = datasette.plugin_config("datasette-comments") or {}
+        cache = AuthorCache(
+            ttl=config.get("author_cache_ttl", AUTHOR_CACHE_TTL),
+            max_size=config.get("author_cache_size", AUTHOR_CACHE_SIZE),
+        )
+        _author_caches[datasette] = cache
+    return cache
+
+
+def invalidate_authors(datasette, actor_ids=None):
+    """Drop cached Authors, call when a profile changes.
+
+    Pass actor_ids to forget just those actors, or nothing to clear the cache.
+    The @mention user index is rebuilt on next use too, since usernames and
+    names come from the same profiles.
+    """
+    author_cache(datasette).invalidate(actor_ids)
+    invalidate_user_index(datasette)
+    for key in list(_pending_authors):
+        if key[0] == id(datasette) and (actor_ids is None or key[1] in actor_ids):
+            del _pending_authors[key]
+
+
+async def _load_authors(datasette, actor_ids: List[str]) -> dict[str, Author]:
+    try:
+        results = await datasette.get_internal_database().execute(
+            """
+              select
+                profiles.actor_id,
+                profiles.display_name,
+                exists(
+                  select 1
+                  from datasette_user_profile_photos as photos
+                  where photos.actor_id = profiles.actor_id
+                ) as has_photo
+              from datasette_user_profiles as profiles
+              where profiles.actor_id in (select value from json_each(?))
+            """,
+            [json.dumps(actor_ids)],
+            log_sql_errors=False,
+        )
+    except sqlite3.OperationalError:
+        # datasette-user-profiles tables aren't in the shape we expect,
+        # so go through its own API one actor at a time instead.
+        semaphore = asyncio.Semaphore(PROFILE_LOOKUP_CONCURRENCY)
+
+        async def load(actor_id):
+            async with semaphore:
+                profile = await get_profile(datasette, actor_id)
+            return _author(actor_id, profile.display_name, profile.has_photo)
+
+        authors = await asyncio.gather(*(load(actor_id) for actor_id in actor_ids))
+        return {author.actor_id: author for author in authors}
+
+    authors = {
+        row["actor_id"]: _author(row["actor_id"], row["display_name"], row["has_photo"])
+        for row in results.rows
+    }
+    # actors without a profile row get the same defaults get_profile() gives them
+    for actor_id in actor_ids:
+        if actor_id not in authors:
+            authors[actor_id] = _author(actor_id, None, False)
+    return authors
+
+
+async def _load_and_cache_authors(datasette, actor_ids: List[str]) -> dict[str, Author]:
+    cache = author_cache(datasette)
+    generation = cache.generation
+    authors = await _load_authors(datasette, actor_ids)
+    cache.set_many(authors, generation)
+    return authors
+
+
+async def author_from_profile(datasette, actor_id) -> Author:
+    """Build an Author from datasette-user-profiles data."""
+    return (await authors_from_actor_ids(datasette, [actor_id]))[actor_id]
+
+
 async def authors_from_actor_ids(datasette, actor_ids) -> dict[str, Author]:
-    """Build Author objects for multiple actor IDs."""
+    """Build Author objects for multiple actor IDs.
+
+    Recently seen actors come from the AuthorCache. The rest are loaded with
+    one query, and actors already being looked up by another in-flight
+    request wait on that lookup rather than repeating it.
+    """
+    cache = author_cache(datasette)
     result = {}
-    for actor_id in actor_ids:
-        result[actor_id] = await author_from_profile(datasette, actor_id)
+    tasks = {}
+    to_load = []
+    for actor_id in dict.fromkeys(actor_ids):
+        if not actor_id:
+            continue
+        author = cache.get(actor_id)
+        if author is not None:
+            result[actor_id] = author
+            continue
+        pending = _pending_authors.get((id(datasette), actor_id))
+        if pending is not None:
+            tasks[actor_id] = pending
+        else:
+            to_load.append(actor_id)
+
+    if to_load:
+        # a separate task, so one request being cancelled doesn't fail the
+        # other requests waiting on the same lookup
+        task = asyncio.ensure_future(_load_and_cache_authors(datasette, to_load))
+        keys = [(id(datasette), actor_id) for actor_id in to_load]
+        for key in keys:
+            _pending_authors[key] = task
+
+        def done(task):
+            for key in keys:
+                if _pending_authors.get(key) is task:
+                    del _pending_authors[key]
+            if not task.cancelled():
+                # retrieved here so an unawaited failure isn't logged
+                task.exception()
+
+        task.add_done_callback(done)
+        for actor_id in to_load:
+            tasks[actor_id] = task
+
+    for actor_id, task in tasks.items():
+        result[actor_id] = (await asyncio.shield(task))[actor_id]
     return result
 
 
+def build_thread_comments(rows, authors, reactions, thread_ids):
+    """Turn comment rows into CommentData dicts grouped by thread ID.
+
+    Returns (threads, rerendered), where rerendered holds (render_nodes,
+    render_version, id) updates for comments whose stored render nodes
+    came from an older parser.
+    """
+    stale = []
+    for row in rows:
+        if row.pop("render_version") == comment_parser.PARSER_VERSION:
+            row["render_nodes"] = json.loads(row["render_nodes"])
+        else:
+            stale.append(row)
+    parsed = comment_parser.parse_many(row["contents"] for row in stale)
+    rerendered = []
+    for row, result in zip(stale, parsed):
+        row["render_nodes"] = result.rendered
+        rerendered.append(
+            (json.dumps(result.rendered), comment_parser.PARSER_VERSION, row["id"])
+        )
+
+    threads = {thread_id: [] for thread_id in thread_ids}
+    for row in rows:
+        author = authors.get(row["author_actor_id"])
+        row["author"] = author.model_dump() if author else {}
+        row["reactions"] = reactions.get(row["id"], [])
+        threads[row.pop("thread_id")].append(row)
+    return threads, rerendered
+
+
+async def comments_for_threads(
+    datasette, thread_ids: List[str], actor_id
+) -> dict[str, List[dict]]:
+    """CommentData dicts for every comment in the given threads, keyed by thread ID.
+
+    Runs the same two queries and a single author lookup however many threads
+    are requested. reacted_by_me is relative to actor_id.
+    """
+    db = read_database(datasette)
+    thread_ids_json = json.dumps(list(thread_ids))
+    results = await db.execute(
+        """
+          select
+            id,
+            thread_id,
+            author_actor_id,
+            created_at,
+            contents,
+            render_nodes,
+            render_version
+          from datasette_comments_comments
+          where thread_id in (select value from json_each(:thread_ids))
+          order by thread_id, created_at
+        """,
+        {"thread_ids": thread_ids_json},
+    )
+    reaction_results = await db.execute(
+        """
+          select
+            counts.comment_id,
+            counts.reaction,
+            counts.count,
+            exists(
+              select 1
+              from datasette_comments_reactions as reactions
+              where reactions.comment_id = counts.comment_id
+                and reactions.reactor_actor_id = :actor_id
+                and reactions.reaction = counts.reaction
+            ) as reacted_by_me
+          from datasette_comments_reaction_counts as counts
+          where counts.comment_id in (
+            select cast(id as text)
+            from datasette_comments_comments
+            where thread_id in (select value from json_each(:thread_ids))
+          )
+          order by counts.rowid
+        """,
+        {"thread_ids": thread_ids_json, "actor_id": actor_id},
+    )
+    reactions = {}
+    for row in reaction_results.rows:
+        reactions.setdefault(row["comment_id"], []).append(
+            {
+                "reaction": row["reaction"],
+                "count": row["count"],
+                "reacted_by_me": bool(row["reacted_by_me"]),
+            }
+        )
+
+    rows = [dict(row) for row in results.rows]
+    authors = await authors_from_actor_ids(
+        datasette, set(row["author_actor_id"] for row in rows)
+    )
+
+    threads, rerendered = build_thread_comments(rows, authors, reactions, thread_ids)
+
+    if rerendered:
+        # store what was just rendered, without holding up this response
+        def update(conn):
+            conn.executemany(
+                """
+                  update datasette_comments_comments
+                  set render_nodes = ?, render_version = ?
+                  where id = ?
+                """,
+                rerendered,
+            )
+
+        await comments_database(datasette).execute_write_fn(update, block=False)
+    return threads
+
+
+async def change_version(datasette) -> int:
+    """Counter bumped by every write to threads, comments or reactions."""
+    results = await read_database(datasette).execute(
+        "select version from datasette_comments_version where id = 1"
+    )
+    return results.first()[0]
+
+
 async def author_from_request(datasette, request) -> Author:
     actor_id = (request.actor or {}).get("id")
     if not actor_id:
@@ -72,40 +668,310 @@ async def author_from_request(datasette, request) -> Author:
     return await author_from_profile(datasette, actor_id)
 
 
-# figured this would help with performance, to not hit label_column_for_table all the time?
-cached_label_columns = {}
+# Default for the "label_cache_size" plugin config option
+LABEL_CACHE_SIZE = 512
+
+
+class TableMetadataCache:
+    """Bounded LRU of (label_column, primary_keys) per table.
 
+    Keys include the database's PRAGMA schema_version, so entries from before
+    an ALTER or DROP are never returned and just age out. Tables without a
+    label column, and tables or databases that no longer exist, are cached too.
+    """
+
+    def __init__(self, max_size: int = LABEL_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
 
-# wanted to use lru_cache here, but doesn't work with async
-async def get_label_column(datasette, db: str, table: str):
-    key = f"{db}/{table}"
-    lookup = cached_label_columns.get(key)
-    if lookup:
-        return lookup
-    if db not in datasette.databases:
+    def get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+
+_table_metadata_caches: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def table_metadata_cache(datasette) -> TableMetadataCache:
+    """The TableMetadataCache for this Datasette instance, created from plugin config."""
+    cache = _table_metadata_caches.get(datasette)
+    if cache is None:
+        config = datasette.plugin_config("datasette-comments") or {}
+        cache = TableMetadataCache(config.get("label_cache_size", LABEL_CACHE_SIZE))
+        _table_metadata_caches[datasette] = cache
+    return cache
+
+
+async def get_schema_version(datasette, database: str):
+    """PRAGMA schema_version of a database, None if it isn't attached."""
+    db = datasette.databases.get(database)
+    if db is None:
         return None
     try:
-        result = await datasette.databases[db].label_column_for_table(table)
+        return (await db.execute("PRAGMA schema_version")).first()[0]
     except Exception:
         return None
-    cached_label_columns[key] = result
-    return result
+
+
+async def get_table_metadata(datasette, database: str, table: str, schema_version):
+    """(label_column, primary_keys) for a table, (None, []) if it can't be labelled.
+
+    schema_version should come from get_schema_version(), fetched once for
+    all the tables looked up in that database.
+    """
+    cache = table_metadata_cache(datasette)
+    key = (database, schema_version, table)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    label_column, pks = None, []
+    if schema_version is not None:
+        db = datasette.databases[database]
+        try:
+            label_column = await db.label_column_for_table(table)
+            if label_column:
+                pks = await db.primary_keys(table)
+        except Exception:
+            label_column, pks = None, []
+    cache.set(key, (label_column, pks))
+    return label_column, pks
 
 
 # Based on https://github.com/simonw/datasette/blob/452a587e236ef642cbc6ae345b58767ea8420cb5/datasette/utils/__init__.py#L1209
-async def get_label_for_row(db, table: str, label_column: str, rowids: List[str]):
-    if len(rowids) == 0:
-        return None
-    pks = await db.primary_keys(table)
-    if len(pks) == 0:
-        return None
-    wheres = [f'"{pk}"=:p{i}' for i, pk in enumerate(pks)]
-    sql = f"select [{label_column}] from [{table}] where {' AND '.join(wheres)} limit 1"
-    params = {}
-    for i, pk_value in enumerate(rowids):
-        params[f"p{i}"] = pk_value
-    results = await db.execute(sql, params)
-    row = results.first()
-    if row is None:
-        return None
-    return row[label_column]
+async def get_labels_for_rows(
+    db, table: str, label_column: str, pks: List[str], rowids: List[List[str]]
+) -> dict[str, object]:
+    """Label column values for many rows of one table, in a single query.
+
+    rowids are primary key value lists as stored in target_row_ids, compound
+    keys included. Returns a dict keyed by the JSON encoding of each rowids
+    list, rows that don't exist are left out.
+    """
+    keys = [json.dumps(ids) for ids in rowids if len(ids) == len(pks)]
+    if len(pks) == 0 or len(keys) == 0:
+        return {}
+    # Each key is joined against the table's primary key, so this is one
+    # index lookup per row. Comparing against json_extract() keeps the pk
+    # columns' affinity, the same as binding each value as a parameter.
+    wheres = [
+        f"t.[{pk}] = json_extract(keys.value, '$[{i}]')" for i, pk in enumerate(pks)
+    ]
+    sql = f"""
+      select keys.value as key, t.[{label_column}] as label
+      from json_each(:keys) as keys
+      join [{table}] as t on {' and '.join(wheres)}
+    """
+    results = await db.execute(sql, {"keys": json.dumps(keys)})
+    return {row["key"]: row["label"] for row in results.rows}
+
+
+async def resolve_target_labels(datasette, targets) -> dict[tuple, object]:
+    """Look up the current label of many row targets.
+
+    targets are (target_database, target_table, target_row_ids) tuples. Returns
+    their labels keyed by those tuples, leaving out targets that can't be
+    labelled right now: no label column, deleted rows, detached databases.
+
+    Targets are grouped by table and each table is queried once. Databases are
+    queried concurrently, the tables within one database one after another.
+    """
+    by_database = {}
+    for database, table, target_row_ids in targets:
+        try:
+            rowids = json.loads(target_row_ids)
+        except Exception:
+            continue
+        if not isinstance(rowids, list) or len(rowids) == 0:
+            continue
+        tables = by_database.setdefault(database, {})
+        tables.setdefault(table, {})[target_row_ids] = rowids
+
+    async def labels_for_database(database, tables):
+        labels = {}
+        schema_version = await get_schema_version(datasette, database)
+        for table, rowids in tables.items():
+            label_column, pks = await get_table_metadata(
+                datasette, database, table, schema_version
+            )
+            if not label_column:
+                continue
+            try:
+                found = await get_labels_for_rows(
+                    datasette.databases[database],
+                    table,
+                    label_column,
+                    pks,
+                    list(rowids.values()),
+                )
+            except Exception:
+                continue
+            for target_row_ids, ids in rowids.items():
+                key = json.dumps(ids)
+                if key in found:
+                    labels[(database, table, target_row_ids)] = found[key]
+        return labels
+
+    labels = {}
+    with trace_child_tasks():
+        for database_labels in await asyncio.gather(
+            *(
+                labels_for_database(database, tables)
+                for database, tables in by_database.items()
+            )
+        ):
+            labels.update(database_labels)
+    return labels
+
+
+# Default for the "label_refresh_interval" plugin config option, in seconds.
+# 0 disables refreshing stored labels.
+LABEL_REFRESH_INTERVAL = 300
+
+# Threads refresh_target_labels() looks at per pass, for each of its passes
+LABEL_REFRESH_BATCH_SIZE = 500
+
+_label_refreshes: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _label_refresh_state(datasette) -> dict:
+    # "unlabeled_after" and "after" are the thread IDs the keyset passes over
+    # unlabelled and all row threads got up to
+    return _label_refreshes.setdefault(
+        datasette,
+        {"last": None, "task": None, "unlabeled_after": None, "after": None},
+    )
+
+
+async def _next_label_batch(db, state: dict, cursor: str, where: str, limit: int):
+    # no lower bound on the first page: IDs have NUMERIC affinity, so there's
+    # no single value that sorts before all of them
+    after_clause = "" if state[cursor] is None else "and id > :after"
+    results = await db.execute(
+        f"""
+          select id, target_database, target_table, target_row_ids, target_label
+          from datasette_comments_threads
+          where {where} {after_clause}
+          order by id
+          limit :limit
+        """,
+        {"after": state[cursor], "limit": limit},
+    )
+    # wrap around once the end is reached
+    state[cursor] = results.rows[-1]["id"] if len(results.rows) == limit else None
+    return results.rows
+
+
+async def refresh_target_labels(
+    datasette, batch_size: int = LABEL_REFRESH_BATCH_SIZE
+) -> int:
+    """Update the target_label stored on row threads.
+
+    Each call looks up the next batch_size threads that have no label yet,
+    and the next batch_size row threads in ID order. Both passes carry on
+    from where the previous call stopped and wrap around at the end, so a
+    call does a bounded amount of work, threads whose label can't be found
+    don't hold up newer ones, and every stored label is revisited eventually.
+
+    Labels that can't be looked up right now are left as they are, so threads
+    on deleted rows or detached databases keep their last known label. Returns
+    how many threads were updated.
+    """
+    state = _label_refresh_state(datasette)
+    db = read_database(datasette)
+    unlabeled = await _next_label_batch(
+        db,
+        state,
+        "unlabeled_after",
+        "target_label is null and target_type in ('row', 'value')",
+        batch_size,
+    )
+    labelled = await _next_label_batch(
+        db, state, "after", "target_type in ('row', 'value')", batch_size
+    )
+
+    # threads on the same row share a target, and may not all be labelled yet
+    stored = {}
+    for row in unlabeled + labelled:
+        target = (row["target_database"], row["target_table"], row["target_row_ids"])
+        stored.setdefault(target, set()).add(row["target_label"])
+    labels = await resolve_target_labels(datasette, stored.keys())
+    changed = [
+        (label, *target)
+        for target, label in labels.items()
+        if {None if label is None else str(label)} != stored[target]
+    ]
+    if not changed:
+        return 0
+
+    def update(conn):
+        conn.executemany(
+            """
+              update datasette_comments_threads
+              set target_label = ?
+              where target_type in ('row', 'value')
+                and target_database = ?
+                and target_table = ?
+                and target_row_ids = ?
+            """,
+            changed,
+        )
+
+    await comments_database(datasette).execute_write_fn(update)
+    return len(changed)
+
+
+def schedule_target_label_refresh(datasette):
+    """Start refresh_target_labels() in the background, at most once per interval.
+
+    Called by the endpoints that read stored labels, so refreshing only
+    happens while someone is looking at them. The first call refreshes
+    straight away, so threads created before labels were stored get one.
+    """
+    config = datasette.plugin_config("datasette-comments") or {}
+    interval = config.get("label_refresh_interval", LABEL_REFRESH_INTERVAL)
+    if not interval:
+        return
+    now = time.monotonic()
+    state = _label_refresh_state(datasette)
+    if state["last"] is not None and now - state["last"] < interval:
+        return
+    if state["task"] is not None and not state["task"].done():
+        return
+    state["last"] = now
+    # started in an empty context, so the refresh isn't traced as part of
+    # whichever request happened to trigger it
+    state["task"] = contextvars.Context().run(
+        asyncio.ensure_future, refresh_target_labels(datasette)
+    )
+    state["task"].add_done_callback(_log_refresh_failure)
+
+
+def _log_refresh_failure(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(
+            "datasette-comments label refresh failed", exc_info=task.exception()
+        )
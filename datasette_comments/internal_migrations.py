@@ -10,3 +10,444 @@ SCHEMA = (Path(__file__).parent / "schema.sql").read_text()
 @internal_migrations()
 def m001_initial(db: Database):
     db.executescript(SCHEMA)
+
+
+@internal_migrations()
+def m002_target_lookup_indexes(db: Database):
+    db.executescript(
+        """
+        --- Covers the thread lookups made by the table and row views. Filters on
+        --- resolved_at rather than the generated marked_resolved column, so
+        --- those lookups never have to touch the table itself.
+        CREATE INDEX IF NOT EXISTS idx_datasette_comments_threads_target
+          ON datasette_comments_threads(
+            target_type,
+            target_database,
+            target_table,
+            target_row_ids,
+            resolved_at,
+            id
+          );
+
+        --- Fetch all comments in a thread, in order.
+        CREATE INDEX IF NOT EXISTS idx_datasette_comments_comments_thread_id
+          ON datasette_comments_comments(thread_id, created_at);
+        """
+    )
+
+
+@internal_migrations()
+def m003_comments_fts(db: Database):
+    db.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS datasette_comments_comments_fts_ids(
+          --! Stable integer key of each comment in the full-text index, the
+          --! rowid of its row in datasette_comments_comments_fts. Comments
+          --! only have an implicit rowid, which VACUUM may renumber.
+          id INTEGER PRIMARY KEY,
+          comment_id TEXT NOT NULL UNIQUE
+            REFERENCES datasette_comments_comments(id)
+        );
+
+        --- Full-text index over comment contents, used by the activity search.
+        CREATE VIRTUAL TABLE IF NOT EXISTS datasette_comments_comments_fts
+          USING fts5(contents);
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_comments_fts_ai
+          AFTER INSERT ON datasette_comments_comments
+        BEGIN
+          INSERT INTO datasette_comments_comments_fts_ids(comment_id)
+            VALUES (new.id);
+          INSERT INTO datasette_comments_comments_fts(rowid, contents)
+            SELECT id, new.contents
+            FROM datasette_comments_comments_fts_ids
+            WHERE comment_id = new.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_comments_fts_ad
+          AFTER DELETE ON datasette_comments_comments
+        BEGIN
+          DELETE FROM datasette_comments_comments_fts
+            WHERE rowid = (
+              SELECT id FROM datasette_comments_comments_fts_ids
+              WHERE comment_id = old.id
+            );
+          DELETE FROM datasette_comments_comments_fts_ids
+            WHERE comment_id = old.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_comments_fts_au
+          AFTER UPDATE OF contents ON datasette_comments_comments
+        BEGIN
+          UPDATE datasette_comments_comments_fts
+            SET contents = new.contents
+            WHERE rowid = (
+              SELECT id FROM datasette_comments_comments_fts_ids
+              WHERE comment_id = new.id
+            );
+        END;
+
+        --- Index any comments written before this migration
+        INSERT OR IGNORE INTO datasette_comments_comments_fts_ids(comment_id)
+          SELECT id FROM datasette_comments_comments ORDER BY rowid;
+        INSERT INTO datasette_comments_comments_fts(rowid, contents)
+          SELECT ids.id, comments.contents
+          FROM datasette_comments_comments_fts_ids AS ids
+          JOIN datasette_comments_comments AS comments
+            ON comments.id = ids.comment_id;
+        """
+    )
+
+
+@internal_migrations()
+def m004_comment_tags(db: Database):
+    db.executescript(
+        """
+        --- One row per #hashtag in a comment, kept in sync with comments.hashtags
+        CREATE TABLE IF NOT EXISTS datasette_comments_comment_tags(
+          --- The hashtag, without the leading "#"
+          tag TEXT NOT NULL,
+          --- Foreign key to the comment the hashtag appears in
+          comment_id TEXT NOT NULL REFERENCES datasette_comments_comments(id),
+          PRIMARY KEY (tag, comment_id)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_datasette_comments_comment_tags_comment_id
+          ON datasette_comments_comment_tags(comment_id);
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_comment_tags_ai
+          AFTER INSERT ON datasette_comments_comments
+        BEGIN
+          INSERT OR IGNORE INTO datasette_comments_comment_tags(tag, comment_id)
+            SELECT value, new.id FROM json_each(new.hashtags);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_comment_tags_ad
+          AFTER DELETE ON datasette_comments_comments
+        BEGIN
+          DELETE FROM datasette_comments_comment_tags WHERE comment_id = old.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_comment_tags_au
+          AFTER UPDATE OF hashtags ON datasette_comments_comments
+        BEGIN
+          DELETE FROM datasette_comments_comment_tags WHERE comment_id = old.id;
+          INSERT OR IGNORE INTO datasette_comments_comment_tags(tag, comment_id)
+            SELECT value, new.id FROM json_each(new.hashtags);
+        END;
+
+        --- Backfill from comments written before this migration
+        INSERT OR IGNORE INTO datasette_comments_comment_tags(tag, comment_id)
+          SELECT hashtags.value, comments.id
+          FROM datasette_comments_comments AS comments, json_each(comments.hashtags) AS hashtags;
+        """
+    )
+
+
+@internal_migrations()
+def m005_keyset_pagination_indexes(db: Database):
+    db.executescript(
+        """
+        --- Keyset pagination over all comments, newest first
+        CREATE INDEX IF NOT EXISTS idx_datasette_comments_comments_created_at_id
+          ON datasette_comments_comments(created_at, id);
+
+        --- Keyset pagination over a single author's comments, newest first
+        CREATE INDEX IF NOT EXISTS idx_datasette_comments_comments_author_created_at_id
+          ON datasette_comments_comments(author_actor_id, created_at, id);
+        """
+    )
+
+
+@internal_migrations()
+def m006_thread_stats(db: Database):
+    db.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS datasette_comments_thread_stats(
+          --! Summary of the comments in each thread, maintained by triggers
+          --! on datasette_comments_comments so readers never need to aggregate.
+
+          --- Foreign key to the thread being summarized
+          thread_id TEXT PRIMARY KEY REFERENCES datasette_comments_threads(id),
+
+          --- Number of comments in the thread
+          comment_count INTEGER NOT NULL DEFAULT 0,
+
+          --- created_at of the most recent comment in the thread
+          last_comment_at DATETIME,
+
+          --- Datasette actor ID for the author of the most recent comment
+          last_author_actor_id TEXT,
+
+          --- Distinct actor IDs of everyone who has commented, in order of
+          --- their first comment. Schema: string[]
+          participant_actor_ids JSON NOT NULL DEFAULT '[]'
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_thread_stats_ai
+          AFTER INSERT ON datasette_comments_comments
+        BEGIN
+          INSERT INTO datasette_comments_thread_stats(
+            thread_id,
+            comment_count,
+            last_comment_at,
+            last_author_actor_id,
+            participant_actor_ids
+          )
+          VALUES (
+            new.thread_id,
+            1,
+            new.created_at,
+            new.author_actor_id,
+            json_array(new.author_actor_id)
+          )
+          ON CONFLICT(thread_id) DO UPDATE SET
+            comment_count = comment_count + 1,
+            last_author_actor_id = CASE
+              WHEN new.created_at >= coalesce(last_comment_at, '') THEN new.author_actor_id
+              ELSE last_author_actor_id
+            END,
+            last_comment_at = max(coalesce(last_comment_at, ''), new.created_at),
+            participant_actor_ids = CASE
+              WHEN EXISTS (
+                SELECT 1 FROM json_each(participant_actor_ids)
+                WHERE value = new.author_actor_id
+              ) THEN participant_actor_ids
+              ELSE json_insert(participant_actor_ids, '$[#]', new.author_actor_id)
+            END;
+        END;
+
+        --- Deletes are rare, so just recompute the thread's summary
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_thread_stats_ad
+          AFTER DELETE ON datasette_comments_comments
+        BEGIN
+          UPDATE datasette_comments_thread_stats
+          SET
+            comment_count = (
+              SELECT count(*) FROM datasette_comments_comments
+              WHERE thread_id = old.thread_id
+            ),
+            last_comment_at = (
+              SELECT max(created_at) FROM datasette_comments_comments
+              WHERE thread_id = old.thread_id
+            ),
+            last_author_actor_id = (
+              SELECT author_actor_id FROM datasette_comments_comments
+              WHERE thread_id = old.thread_id
+              ORDER BY created_at DESC, id DESC
+              LIMIT 1
+            ),
+            participant_actor_ids = (
+              SELECT json_group_array(author_actor_id) FROM (
+                SELECT author_actor_id FROM datasette_comments_comments
+                WHERE thread_id = old.thread_id
+                GROUP BY author_actor_id
+                ORDER BY min(created_at), min(id)
+              )
+            )
+          WHERE thread_id = old.thread_id;
+        END;
+
+        --- Backfill threads commented on before this migration
+        INSERT OR REPLACE INTO datasette_comments_thread_stats(
+          thread_id,
+          comment_count,
+          last_comment_at,
+          last_author_actor_id,
+          participant_actor_ids
+        )
+        SELECT
+          threads.thread_id,
+          (
+            SELECT count(*) FROM datasette_comments_comments
+            WHERE thread_id = threads.thread_id
+          ),
+          (
+            SELECT max(created_at) FROM datasette_comments_comments
+            WHERE thread_id = threads.thread_id
+          ),
+          (
+            SELECT author_actor_id FROM datasette_comments_comments
+            WHERE thread_id = threads.thread_id
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+          ),
+          (
+            SELECT json_group_array(author_actor_id) FROM (
+              SELECT author_actor_id FROM datasette_comments_comments
+              WHERE thread_id = threads.thread_id
+              GROUP BY author_actor_id
+              ORDER BY min(created_at), min(id)
+            )
+          )
+        FROM (SELECT DISTINCT thread_id FROM datasette_comments_comments) AS threads;
+        """
+    )
+
+
+@internal_migrations()
+def m007_reaction_counts(db: Database):
+    db.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS datasette_comments_reaction_counts(
+          --! Number of actors who left each reaction on a comment, maintained by
+          --! triggers on datasette_comments_reactions. Rows are removed once
+          --! their count drops to 0, and rowid order is first-reacted order.
+
+          --- Foreign key to the comment the reactions are on.
+          comment_id TEXT NOT NULL REFERENCES datasette_comments_comments(id),
+
+          --- The reaction, usually an emoji.
+          reaction TEXT NOT NULL,
+
+          --- How many actors left this reaction on the comment.
+          count INTEGER NOT NULL,
+
+          PRIMARY KEY (comment_id, reaction)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_reaction_counts_ai
+          AFTER INSERT ON datasette_comments_reactions
+        BEGIN
+          INSERT INTO datasette_comments_reaction_counts(comment_id, reaction, count)
+            VALUES (new.comment_id, new.reaction, 1)
+            ON CONFLICT(comment_id, reaction) DO UPDATE SET count = count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_reaction_counts_ad
+          AFTER DELETE ON datasette_comments_reactions
+        BEGIN
+          UPDATE datasette_comments_reaction_counts
+            SET count = count - 1
+            WHERE comment_id = old.comment_id AND reaction = old.reaction;
+          DELETE FROM datasette_comments_reaction_counts
+            WHERE comment_id = old.comment_id
+              AND reaction = old.reaction
+              AND count <= 0;
+        END;
+
+        --- Backfill reactions made before this migration
+        INSERT OR REPLACE INTO datasette_comments_reaction_counts(comment_id, reaction, count)
+          SELECT comment_id, reaction, count(*)
+          FROM datasette_comments_reactions
+          GROUP BY comment_id, reaction
+          ORDER BY min(rowid);
+        """
+    )
+
+
+@internal_migrations()
+def m008_thread_target_labels(db: Database):
+    db.executescript(
+        """
+        --- Label of the row the thread targets, looked up when the thread is
+        --- created and kept up to date by refresh_target_labels(). Only when
+        --- target_type == "row" | "value"
+        ALTER TABLE datasette_comments_threads ADD COLUMN target_label TEXT;
+        """
+    )
+
+
+@internal_migrations()
+def m009_comment_render_nodes(db: Database):
+    db.executescript(
+        """
+        --- JSON array of render nodes parsed from contents when the comment
+        --- was written, served as-is to clients.
+        ALTER TABLE datasette_comments_comments ADD COLUMN render_nodes JSON;
+
+        --- comment_parser.PARSER_VERSION that produced render_nodes. Comments
+        --- rendered by an older parser, or before this migration (NULL), are
+        --- re-rendered the next time they're read.
+        ALTER TABLE datasette_comments_comments ADD COLUMN render_version INTEGER;
+        """
+    )
+
+
+@internal_migrations()
+def m010_change_version(db: Database):
+    triggers = []
+    for table, update in (
+        ("threads", "UPDATE"),
+        ("comments", "UPDATE OF thread_id, author_actor_id, contents, created_at"),
+        ("reactions", "UPDATE"),
+    ):
+        for suffix, event in (("ai", "INSERT"), ("au", update), ("ad", "DELETE")):
+            triggers.append(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS datasette_comments_version_{table}_{suffix}
+                  AFTER {event} ON datasette_comments_{table}
+                BEGIN
+                  UPDATE datasette_comments_version SET version = version + 1;
+                END;
+                """
+            )
+    db.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS datasette_comments_version(
+          --! Single row counter, bumped by triggers on every change to threads,
+          --! comments or reactions. Used to build ETags for API responses.
+          id INTEGER PRIMARY KEY CHECK (id = 1),
+          version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO datasette_comments_version(id, version) VALUES (1, 0);
+        """
+        + "".join(triggers)
+    )
+
+
+@internal_migrations()
+def m011_unlabeled_threads(db: Database):
+    db.executescript(
+        """
+        --- Row threads that don't have a label yet, which refresh_target_labels()
+        --- looks up first.
+        CREATE INDEX IF NOT EXISTS idx_datasette_comments_threads_unlabeled
+          ON datasette_comments_threads(id)
+          WHERE target_label IS NULL AND target_type IN ('row', 'value');
+        """
+    )
+
+
+@internal_migrations()
+def m012_reaction_comment_created_at(db: Database):
+    db.executescript(
+        """
+        --- created_at of the comment a reaction is on, copied by the triggers
+        --- below, so an actor's reactions can be paged in the order of the
+        --- comments they reacted to straight from an index.
+        ALTER TABLE datasette_comments_reactions
+          ADD COLUMN comment_created_at TEXT;
+
+        UPDATE datasette_comments_reactions
+          SET comment_created_at = (
+            SELECT created_at
+            FROM datasette_comments_comments
+            WHERE id = datasette_comments_reactions.comment_id
+          );
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_reactions_comment_created_at_ai
+          AFTER INSERT ON datasette_comments_reactions
+        BEGIN
+          UPDATE datasette_comments_reactions
+            SET comment_created_at = (
+              SELECT created_at
+              FROM datasette_comments_comments
+              WHERE id = new.comment_id
+            )
+            WHERE id = new.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS datasette_comments_reactions_comment_created_at_au
+          AFTER UPDATE OF created_at ON datasette_comments_comments
+        BEGIN
+          UPDATE datasette_comments_reactions
+            SET comment_created_at = new.created_at
+            WHERE comment_id = new.id;
+        END;
+
+        --- Page through the reactions an actor made, for their profile.
+        CREATE INDEX IF NOT EXISTS idx_datasette_comments_reactions_reactor_comment_created_at
+          ON datasette_comments_reactions(reactor_actor_id, comment_created_at, id);
+        """
+    )
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from datetime import datetime, timezone
+from pydantic import BaseModel, BeforeValidator, TypeAdapter
+from typing import Annotated, Dict, List, Optional
 
 
 class Author(BaseModel):
@@ -29,6 +30,10 @@ class ThreadNewRequest(BaseModel):
     comment: str
 
 
+class ThreadsCommentsRequest(BaseModel):
+    thread_ids: List[str]
+
+
 class CommentAddRequest(BaseModel):
     thread_id: str
     contents: str
@@ -55,6 +60,62 @@ class ReactionRequest(BaseModel):
     reaction: str
 
 
+# Bulk import records, one ImportThread per NDJSON line. IDs are generated
+# when missing, and records whose ID already exists are skipped.
+def _sqlite_timestamp(value):
+    # stored the way CURRENT_TIMESTAMP writes them, so imported rows sort and
+    # display like the rest. Times without an offset are taken to be UTC.
+    if value is None:
+        return None
+    try:
+        parsed = TypeAdapter(datetime).validate_python(value)
+    except ValueError:
+        raise ValueError(f"'{value}' is not a valid date and time")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# A datetime, normalized to a UTC "YYYY-MM-DD HH:MM:SS" string
+SqliteTimestamp = Annotated[Optional[str], BeforeValidator(_sqlite_timestamp)]
+
+
+class ImportReaction(BaseModel):
+    id: Optional[str] = None
+    reactor_actor_id: str
+    reaction: str
+
+
+class ImportComment(BaseModel):
+    id: Optional[str] = None
+    author_actor_id: str
+    contents: str
+    created_at: SqliteTimestamp = None
+    reactions: List[ImportReaction] = []
+
+
+class ImportThread(BaseModel):
+    id: Optional[str] = None
+    type: str
+    database: Optional[str] = None
+    table: Optional[str] = None
+    # primary key values of the target row, not tilde-encoded
+    rowids: Optional[List[str]] = None
+    creator_actor_id: str
+    created_at: SqliteTimestamp = None
+    resolved_at: SqliteTimestamp = None
+    comments: List[ImportComment]
+
+
+# Filters of an export, the ?since= and ?until= bounds normalized like
+# imported timestamps so they compare correctly with stored ones
+class ExportFilters(BaseModel):
+    database: Optional[str] = None
+    table: Optional[str] = None
+    since: SqliteTimestamp = None
+    until: SqliteTimestamp = None
+
+
 # Response models
 
 
@@ -68,14 +129,19 @@ class ReactionData(BaseModel):
     reaction: str
 
 
+class ReactionSummary(BaseModel):
+    reaction: str
+    count: int
+    reacted_by_me: bool
+
+
 class CommentData(BaseModel):
     id: str
     author: Author
     contents: str
     created_at: str
-    created_duration_seconds: int
     render_nodes: List[RenderNode]
-    reactions: List[ReactionData]
+    reactions: List[ReactionSummary]
 
 
 class ThreadNewResponse(BaseModel):
@@ -92,13 +158,28 @@ class ThreadCommentsResponse(BaseModel):
     data: List[CommentData]
 
 
+class ThreadStats(BaseModel):
+    comment_count: int
+    last_comment_at: Optional[str] = None
+    last_author_actor_id: Optional[str] = None
+    participant_actor_ids: List[str]
+
+
+class ThreadsCommentsResponse(BaseModel):
+    ok: bool
+    # thread ID -> comments in that thread, oldest first
+    data: Dict[str, List[CommentData]]
+
+
 class TableThreadItem(BaseModel):
     id: str
+    stats: ThreadStats
 
 
 class RowThreadItem(BaseModel):
     id: str
     rowids: str
+    stats: ThreadStats
 
 
 class TableViewThreadsData(BaseModel):
@@ -131,28 +212,39 @@ class AutocompleteMentionsResponse(BaseModel):
     suggestions: List[MentionSuggestion]
 
 
+class SnippetPart(BaseModel):
+    value: str
+    highlight: bool
+
+
 class ActivitySearchResult(BaseModel):
+    id: str
     author_actor_id: str
     author: Author
     contents: str
     created_at: str
-    created_duration_seconds: int
     target_type: str
     target_database: Optional[str] = None
     target_table: Optional[str] = None
     target_row_ids: Optional[str] = None
     target_column: Optional[str] = None
     target_label: Optional[str] = None
+    thread_id: str
+    thread_stats: ThreadStats
+    # only set when searching comments, the matching excerpt with highlights
+    snippet: Optional[List[SnippetPart]] = None
 
 
 class ActivitySearchResponse(BaseModel):
     data: List[ActivitySearchResult]
+    # pass as ?cursor= to fetch the next page, None on the last page
+    next_cursor: Optional[str] = None
 
 
 class ProfileActivityItem(BaseModel):
     type: str  # "comment" or "reaction"
+    id: str  # comment or reaction ID
     created_at: str
-    created_duration_seconds: int
     target_type: str
     target_database: Optional[str] = None
     target_table: Optional[str] = None
@@ -172,6 +264,24 @@ class ProfileActivityItem(BaseModel):
 
 class ProfileActivityResponse(BaseModel):
     data: List[ProfileActivityItem]
+    # pass as ?cursor= to fetch the next page, None on the last page
+    next_cursor: Optional[str] = None
+
+
+class ImportRecordError(BaseModel):
+    line: int
+    message: str
+
+
+class ImportResponse(BaseModel):
+    ok: bool
+    # rows inserted, not counting records skipped as already imported
+    threads: int
+    comments: int
+    reactions: int
+    # number of invalid records, the first of which are listed in errors
+    failed: int
+    errors: List[ImportRecordError]
 
 
 __exports__ = [
@@ -187,6 +297,8 @@ __exports__ = [
     ThreadNewResponse,
     OkResponse,
     ThreadCommentsResponse,
+    ThreadsCommentsRequest,
+    ThreadsCommentsResponse,
     TableViewThreadsResponse,
     RowViewThreadsResponse,
     AutocompleteMentionsResponse,
@@ -6,26 +6,46 @@ router = Router(title="datasette-comments", version="0.2.0")
 
 PERMISSION_ACCESS_NAME = "datasette-comments-access"
 PERMISSION_READONLY_NAME = "datasette-comments-readonly"
+PERMISSION_IMPORT_NAME = "datasette-comments-import"
 
 
-def check_permission(write=False):
-    """Decorator for router handlers to enforce permission checks."""
+async def request_allowed(datasette, request, action: str) -> bool:
+    """datasette.allowed() for request.actor, remembered for the rest of the request.
+
+    Decisions are kept in the ASGI scope, which every plugin hook and route
+    handling the same request shares.
+    """
+    decisions = request.scope.setdefault("datasette_comments_allowed", {})
+    if action not in decisions:
+        decisions[action] = await datasette.allowed(action=action, actor=request.actor)
+    return decisions[action]
+
+
+async def can_read(datasette, request) -> bool:
+    return await request_allowed(
+        datasette, request, PERMISSION_ACCESS_NAME
+    ) or await request_allowed(datasette, request, PERMISSION_READONLY_NAME)
+
+
+def check_permission(write=False, action=None):
+    """Decorator for router handlers to enforce permission checks.
+
+    action requires that specific action instead of read or write access.
+    """
 
     def decorator(func):
         @wraps(func)
         async def wrapper(**kwargs):
             datasette = kwargs.get("datasette")
             request = kwargs.get("request")
-            if write:
-                result = await datasette.allowed(
-                    action=PERMISSION_ACCESS_NAME, actor=request.actor
+            if action is not None:
+                result = await request_allowed(datasette, request, action)
+            elif write:
+                result = await request_allowed(
+                    datasette, request, PERMISSION_ACCESS_NAME
                 )
             else:
-                result = await datasette.allowed(
-                    action=PERMISSION_ACCESS_NAME, actor=request.actor
-                ) or await datasette.allowed(
-                    action=PERMISSION_READONLY_NAME, actor=request.actor
-                )
+                result = await can_read(datasette, request)
             if not result:
                 raise Forbidden("Permission denied for datasette-comments")
             return await func(**kwargs)
@@ -1,25 +1,54 @@
 from typing import Annotated, List
 from datasette import Response
 from datasette.utils import tilde_decode, tilde_encode
-from datasette.utils import await_me_maybe
-from datasette.plugins import pm
+from datasette.utils.asgi import AsgiStream
 from ulid import ULID
+import asyncio
+import hashlib
 import json
+import secrets
 
 from datasette_plugin_router import Body
 
-from ..router import router, check_permission
+from ..router import router, check_permission, PERMISSION_IMPORT_NAME
+from ..bulk import (
+    export_ndjson,
+    import_threads,
+    request_body_lines,
+    validate_export_filters,
+)
+from ..events import (
+    EventStreamResponse,
+    event_bus,
+    publish_comment_event,
+    publish_thread_event,
+    table_channel,
+    thread_channel,
+)
+from ..write_queue import batched_write, batched_write_nowait
+from ..user_index import actor_id_for_username, search_users
 from ..internal_db import (
     insert_comment,
-    author_from_profile,
+    author_cache,
     authors_from_actor_ids,
-    get_label_column,
-    get_label_for_row,
+    change_version,
+    comments_database,
+    read_database,
+    comments_for_threads,
+    resolve_target_labels,
+    schedule_target_label_refresh,
+    table_metadata_cache,
+    fts_query,
+    snippet_parts,
+    encode_cursor,
+    decode_cursor,
 )
 from ..page_data import (
     ThreadNewRequest,
     ThreadNewResponse,
     ThreadCommentsResponse,
+    ThreadsCommentsRequest,
+    ThreadsCommentsResponse,
     CommentAddRequest,
     OkResponse,
     ThreadMarkResolvedRequest,
@@ -31,8 +60,65 @@ from ..page_data import (
     AutocompleteMentionsResponse,
     ActivitySearchResponse,
     ProfileActivityResponse,
+    ImportResponse,
 )
-from .. import comment_parser
+
+# Number of rows per page for the activity endpoints
+PAGE_SIZE = 100
+
+# A ThreadStats object built from a "stats" alias of datasette_comments_thread_stats
+THREAD_STATS_JSON = """
+    json_object(
+      'comment_count', coalesce(stats.comment_count, 0),
+      'last_comment_at', stats.last_comment_at,
+      'last_author_actor_id', stats.last_author_actor_id,
+      'participant_actor_ids', json(coalesce(stats.participant_actor_ids, '[]'))
+    )
+"""
+
+# Part of every ETag, so they don't outlive the process that made them
+ETAG_SALT = secrets.token_hex(8)
+
+
+async def response_etag(datasette, request, body=None) -> str:
+    """ETag for the response to a read-only API request.
+
+    Stays the same until threads, comments or reactions change, cached
+    authors are invalidated or expire, or the server restarts. The actor is
+    included because responses contain per-actor fields like reacted_by_me.
+    """
+    cache = author_cache(datasette)
+    key = [
+        ETAG_SALT,
+        await change_version(datasette),
+        cache.generation,
+        # names and photos are reloaded when the cache's entries expire
+        cache.period(),
+        (request.actor or {}).get("id"),
+        request.path,
+        request.query_string,
+        body.model_dump(mode="json") if body is not None else None,
+    ]
+    digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def not_modified(request, etag: str):
+    """A 304 response if the request's If-None-Match matches etag, otherwise None."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in tags or "*" in tags:
+        return Response("", status=304, headers={"ETag": etag})
+    return None
+
+
+def cacheable_json(data, etag: str) -> Response:
+    # no-cache: the browser may keep it, but must revalidate with the ETag
+    return Response.json(
+        data, headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+    )
 
 
 @router.GET(
@@ -41,45 +127,40 @@ from .. import comment_parser
 )
 @check_permission()
 async def thread_comments(thread_id: str, datasette=None, request=None):
-    results = await datasette.get_internal_database().execute(
-        """
-          select
-            id,
-            author_actor_id,
-            created_at,
-            (strftime('%s', 'now') - strftime('%s', created_at)) as created_duration_seconds,
-            contents,
-            (
-              select json_group_array(
-                json_object(
-                  'reactor_actor_id', reactor_actor_id,
-                  'reaction', reaction
-                )
-              )
-              from datasette_comments_reactions
-              where comment_id == datasette_comments_comments.id
-            ) as reactions
-          from datasette_comments_comments
-          where thread_id = ?
-          order by created_at
-        """,
-        (thread_id,),
+    etag = await response_etag(datasette, request)
+    if cached := not_modified(request, etag):
+        return cached
+    threads = await comments_for_threads(
+        datasette, [thread_id], (request.actor or {}).get("id")
     )
+    return cacheable_json({"ok": True, "data": threads[thread_id]}, etag)
 
-    actor_ids = set()
-    rows = []
-    for row in results:
-        actor_ids.add(row["author_actor_id"])
-        rows.append(dict(row))
-    authors = await authors_from_actor_ids(datasette, actor_ids)
-    for row in rows:
-        author = authors.get(row["author_actor_id"])
-        row["author"] = author.model_dump() if author else {}
 
-        results = comment_parser.parse(row["contents"])
-        row["render_nodes"] = results.rendered
-        row["reactions"] = json.loads(row["reactions"]) if row["reactions"] else []
-    return Response.json({"ok": True, "data": rows})
+# Upper bound on thread IDs per threads/comments request
+MAX_BATCH_THREADS = 100
+
+
+@router.POST(
+    r"^/-/datasette-comments/api/threads/comments$",
+    output=ThreadsCommentsResponse,
+)
+@check_permission()
+async def threads_comments(
+    body: Annotated[ThreadsCommentsRequest, Body()], datasette=None, request=None
+):
+    thread_ids = list(dict.fromkeys(body.thread_ids))
+    if len(thread_ids) > MAX_BATCH_THREADS:
+        return Response.json(
+            {"message": f"at most {MAX_BATCH_THREADS} thread_ids per request"},
+            status=400,
+        )
+    etag = await response_etag(datasette, request, body)
+    if cached := not_modified(request, etag):
+        return cached
+    threads = await comments_for_threads(
+        datasette, thread_ids, (request.actor or {}).get("id")
+    )
+    return cacheable_json({"ok": True, "data": threads}, etag)
 
 
 @router.POST(
@@ -142,6 +223,13 @@ async def thread_new(
     rowids_decoded = None
     if rowids is not None:
         rowids_decoded = [tilde_decode(b) for b in rowids.split(",")]
+    target_row_ids = json.dumps(rowids_decoded) if type in ("row", "value") else None
+
+    # snapshot the row's label now, so reads never need the user's database
+    target_label = None
+    if target_row_ids is not None:
+        target = (database, table, target_row_ids)
+        target_label = (await resolve_target_labels(datasette, [target])).get(target)
 
     id = str(ULID()).lower()
 
@@ -155,9 +243,8 @@ async def thread_new(
             "target_database": database,
             "target_table": table if type != "database" else None,
             "target_column": column if type in ("column", "row", "value") else None,
-            "target_row_ids": (
-                json.dumps(rowids_decoded) if type in ("row", "value") else None
-            ),
+            "target_row_ids": target_row_ids,
+            "target_label": target_label,
         }
 
         cursor.execute(
@@ -169,7 +256,8 @@ async def thread_new(
                 target_database,
                 target_table,
                 target_column,
-                target_row_ids
+                target_row_ids,
+                target_label
               )
               values (
                 :id,
@@ -178,7 +266,8 @@ async def thread_new(
                 :target_database,
                 :target_table,
                 :target_column,
-                :target_row_ids
+                :target_row_ids,
+                :target_label
               );
             """,
             params,
@@ -193,10 +282,22 @@ async def thread_new(
         return thread_id
 
     try:
-        thread_id = await datasette.get_internal_database().execute_write_fn(
+        thread_id = await comments_database(datasette).execute_write_fn(
             db_thread_new,
             block=True,
         )
+        if table is not None and type != "database":
+            event_bus(datasette).publish(
+                [table_channel(database, table)],
+                {
+                    "type": "thread_created",
+                    "thread_id": thread_id,
+                    "target_type": type,
+                    "database": database,
+                    "table": table,
+                    "rowids": rowids,
+                },
+            )
         return Response.json({"ok": True, "thread_id": thread_id})
     except Exception as e:
         raise e
@@ -212,10 +313,10 @@ async def comment_add(
 ):
     actor_id = request.actor.get("id")
 
-    await datasette.get_internal_database().execute_write(
-        *(insert_comment(body.thread_id, actor_id, body.contents)),
-        block=True,
+    await batched_write(
+        datasette, *insert_comment(body.thread_id, actor_id, body.contents)
     )
+    await publish_thread_event(datasette, body.thread_id, {"type": "comment_added"})
 
     return Response.json({"ok": True})
 
@@ -228,15 +329,16 @@ async def comment_add(
 async def thread_mark_resolved(
     body: Annotated[ThreadMarkResolvedRequest, Body()], datasette=None, request=None
 ):
-    await datasette.get_internal_database().execute_write(
+    await batched_write(
+        datasette,
         """
             UPDATE datasette_comments_threads
             SET resolved_at = datetime('now')
             WHERE id = ?
         """,
         (body.thread_id,),
-        block=True,
     )
+    await publish_thread_event(datasette, body.thread_id, {"type": "thread_resolved"})
 
     return Response.json({"ok": True})
 
@@ -257,33 +359,45 @@ async def table_view_threads(
         parts = [tilde_decode(b) for b in rowid_encoded.split(",")]
         rowids.append(parts)
 
-    response = await datasette.get_internal_database().execute(
-        """
-          select id
-          from datasette_comments_threads
-          where target_type == 'table'
-            and target_database == ?1
-            and target_table == ?2
-            and not marked_resolved
+    etag = await response_etag(datasette, request, body)
+    if cached := not_modified(request, etag):
+        return cached
+    response = await read_database(datasette).execute(
+        f"""
+          select
+            threads.id,
+            {THREAD_STATS_JSON} as stats
+          from datasette_comments_threads as threads
+          left join datasette_comments_thread_stats as stats
+            on stats.thread_id = cast(threads.id as text)
+          where threads.target_type == 'table'
+            and threads.target_database == ?1
+            and threads.target_table == ?2
+            and threads.resolved_at is null
        """,
         (database, table),
     )
-    table_threads = [dict(row) for row in response.rows]
+    table_threads = [
+        {"id": row["id"], "stats": json.loads(row["stats"])} for row in response.rows
+    ]
 
-    response = await datasette.get_internal_database().execute(
-        """
+    response = await read_database(datasette).execute(
+        f"""
           select
-            id,
-            target_row_ids
-          from datasette_comments_threads
-          where target_type == 'row'
-            and target_database == ?1
-            and target_table == ?2
-            and target_row_ids in (
+            threads.id,
+            threads.target_row_ids,
+            {THREAD_STATS_JSON} as stats
+          from datasette_comments_threads as threads
+          left join datasette_comments_thread_stats as stats
+            on stats.thread_id = cast(threads.id as text)
+          where threads.target_type == 'row'
+            and threads.target_database == ?1
+            and threads.target_table == ?2
+            and threads.target_row_ids in (
               select value
               from json_each(?3)
             )
-            and not marked_resolved
+            and threads.resolved_at is null
        """,
         (database, table, json.dumps(rowids)),
     )
@@ -293,11 +407,12 @@ async def table_view_threads(
             "rowids": "/".join(
                 map(lambda x: tilde_encode(x), json.loads(row["target_row_ids"]))
             ),
+            "stats": json.loads(row["stats"]),
         }
         for row in response.rows
     ]
 
-    return Response.json(
+    return cacheable_json(
         {
             "ok": True,
             "data": {
@@ -306,7 +421,8 @@ async def table_view_threads(
                 "row_threads": row_threads,
                 "value_threads": [],
             },
-        }
+        },
+        etag,
     )
 
 
@@ -323,7 +439,10 @@ async def row_view_threads(
     rowids_encoded: str = body.rowids
     rowids = [tilde_decode(b) for b in rowids_encoded.split(",")]
 
-    response = await datasette.get_internal_database().execute(
+    etag = await response_etag(datasette, request, body)
+    if cached := not_modified(request, etag):
+        return cached
+    response = await read_database(datasette).execute(
         """
           select
             id
@@ -332,19 +451,20 @@ async def row_view_threads(
             and target_database == ?1
             and target_table == ?2
             and target_row_ids = ?3
-            and not marked_resolved
+            and resolved_at is null
        """,
         (database, table, json.dumps(rowids)),
     )
     row_threads = [row["id"] for row in response.rows]
 
-    return Response.json(
+    return cacheable_json(
         {
             "ok": True,
             "data": {
                 "row_threads": row_threads,
             },
-        }
+        },
+        etag,
     )
 
 
@@ -354,7 +474,7 @@ async def row_view_threads(
 )
 @check_permission()
 async def reactions(comment_id: str, datasette=None, request=None):
-    results = await datasette.get_internal_database().execute(
+    results = await read_database(datasette).execute(
         """
           SELECT
             reactor_actor_id,
@@ -367,6 +487,25 @@ async def reactions(comment_id: str, datasette=None, request=None):
     return Response.json([dict(row) for row in results.rows])
 
 
+async def write_reaction(datasette, comment_id: str, event: dict, sql: str, params):
+    """Write a reaction change and publish it.
+
+    With the "nonblocking_reactions" plugin config option this returns before
+    the write is committed, and the event is published once it is.
+    """
+    config = datasette.plugin_config("datasette-comments") or {}
+    if not config.get("nonblocking_reactions"):
+        await batched_write(datasette, sql, params)
+        await publish_comment_event(datasette, comment_id, event)
+        return
+
+    def committed(future):
+        if not future.cancelled() and future.exception() is None:
+            asyncio.ensure_future(publish_comment_event(datasette, comment_id, event))
+
+    batched_write_nowait(datasette, sql, params).add_done_callback(committed)
+
+
 @router.POST(
     r"^/-/datasette-comments/api/reaction/add$",
     output=OkResponse,
@@ -378,7 +517,10 @@ async def reaction_add(
     id = str(ULID()).lower()
     reactor_actor_id = request.actor.get("id")
 
-    await datasette.get_internal_database().execute_write(
+    await write_reaction(
+        datasette,
+        body.comment_id,
+        {"type": "reaction_added", "reaction": body.reaction},
         """
           INSERT INTO datasette_comments_reactions(
             id,
@@ -399,7 +541,6 @@ async def reaction_add(
             "reactor_actor_id": reactor_actor_id,
             "reaction": body.reaction,
         },
-        block=True,
     )
     return Response.json({"ok": True})
 
@@ -414,7 +555,10 @@ async def reaction_remove(
 ):
     reactor_actor_id = request.actor.get("id")
 
-    await datasette.get_internal_database().execute_write(
+    await write_reaction(
+        datasette,
+        body.comment_id,
+        {"type": "reaction_removed", "reaction": body.reaction},
         """
           DELETE FROM datasette_comments_reactions
           WHERE comment_id = :comment_id
@@ -426,11 +570,47 @@ async def reaction_remove(
             "reactor_actor_id": reactor_actor_id,
             "reaction": body.reaction,
         },
-        block=True,
     )
     return Response.json({"ok": True})
 
 
+@router.GET(
+    r"^/-/datasette-comments/api/stream$",
+    output=None,
+)
+@check_permission()
+async def stream(datasette=None, request=None, receive=None):
+    """Server-sent events for a table's threads, or for specific threads.
+
+    Subscribe with ?database=&table= and/or one or more ?thread_id=. Events
+    carry IDs only, clients refetch what changed from the other endpoints.
+    """
+    database = request.args.get("database")
+    table = request.args.get("table")
+    if (database is None) != (table is None):
+        return Response.json(
+            {"message": "'database' and 'table' must be given together"},
+            status=400,
+        )
+    channels = [
+        thread_channel(thread_id) for thread_id in request.args.getlist("thread_id")
+    ]
+    if database is not None:
+        channels.append(table_channel(database, table))
+    if not channels:
+        return Response.json(
+            {"message": "subscribe to a 'database' and 'table', or a 'thread_id'"},
+            status=400,
+        )
+    bus = event_bus(datasette)
+    return EventStreamResponse(bus, bus.subscribe(channels), receive)
+
+
+# Default and maximum number of mention autocomplete suggestions
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 100
+
+
 @router.GET(
     r"^/-/datasette-comments/api/autocomplete/mentions$",
     output=AutocompleteMentionsResponse,
@@ -438,18 +618,20 @@ async def reaction_remove(
 @check_permission(write=True)
 async def autocomplete_mentions(datasette=None, request=None):
     prefix = request.args.get("prefix")
-    suggestions = []
-    for users in pm.hook.datasette_comments_users(datasette=datasette):
-        for user in await await_me_maybe(users):
-            username = user.get("username")
-            if username and username.startswith(prefix):
-                author = await author_from_profile(datasette, user.get("id"))
-                suggestions.append(
-                    {
-                        "username": user.get("username"),
-                        "author": author.model_dump(),
-                    }
-                )
+    try:
+        limit = min(
+            int(request.args.get("limit", AUTOCOMPLETE_LIMIT)), MAX_AUTOCOMPLETE_LIMIT
+        )
+    except ValueError:
+        return Response.json({"message": "limit must be an integer"}, status=400)
+    matches = await search_users(datasette, prefix, limit)
+    authors = await authors_from_actor_ids(
+        datasette, [actor_id for actor_id, _ in matches]
+    )
+    suggestions = [
+        {"username": username, "author": authors[actor_id].model_dump()}
+        for actor_id, username in matches
+    ]
     return Response.json({"suggestions": suggestions})
 
 
@@ -466,24 +648,58 @@ async def activity_search(datasette=None, request=None):
     table = request.args.get("table")
     is_resolved = request.args.get("isResolved") == "1"
     contains_tag = request.args.getlist("containsTag")
-
+    # "relevance" ranks search matches with bm25, otherwise newest first
+    sort = request.args.get("sort")
+    cursor = request.args.get("cursor")
+
+    schedule_target_label_refresh(datasette)
+    etag = await response_etag(datasette, request)
+    if cached := not_modified(request, etag):
+        return cached
+
+    FROM = "datasette_comments_comments AS comments"
+    SNIPPET = "NULL"
+    ORDER_BY = "comments.created_at DESC, comments.id DESC"
     WHERE = "1"
     params = []
-
-    if search_comments:
-        WHERE += " AND comments.contents LIKE printf('%%%s%%', ?)"
-        params.append(search_comments)
+    paginated = True
+
+    search = fts_query(search_comments) if search_comments else None
+    if search:
+        FROM = """
+            datasette_comments_comments_fts
+            JOIN datasette_comments_comments_fts_ids AS fts_ids
+              ON fts_ids.id = datasette_comments_comments_fts.rowid
+            JOIN datasette_comments_comments AS comments
+              ON comments.id = fts_ids.comment_id
+        """
+        # char(2)/char(3) are the SNIPPET_START/SNIPPET_END markers
+        SNIPPET = (
+            "snippet(datasette_comments_comments_fts, 0, char(2), char(3), '…', 24)"
+        )
+        WHERE += " AND datasette_comments_comments_fts MATCH ?"
+        params.append(search)
+        if sort == "relevance":
+            # bm25 scores aren't stable keys, so ranked results are a single page
+            ORDER_BY = "datasette_comments_comments_fts.rank"
+            paginated = False
+
+    if cursor and paginated:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            return Response.json({"message": str(e)}, status=400)
+        WHERE += " AND (comments.created_at, comments.id) < (?, ?)"
+        params.extend([cursor_created_at, cursor_id])
 
     if author_actor_id:
         WHERE += " AND comments.author_actor_id = ?"
         params.append(author_actor_id)
     elif author:
-        for users in pm.hook.datasette_comments_users(datasette=datasette):
-            for user in await await_me_maybe(users):
-                if user.get("username") == author:
-                    WHERE += " AND comments.author_actor_id = ?"
-                    params.append(user.get("id"))
-                    break
+        author_id = await actor_id_for_username(datasette, author)
+        if author_id:
+            WHERE += " AND comments.author_actor_id = ?"
+            params.append(author_id)
 
     if database:
         WHERE += " AND threads.target_database = ?"
@@ -495,60 +711,62 @@ async def activity_search(datasette=None, request=None):
 
     WHERE += f" AND {'' if is_resolved else 'NOT'} threads.marked_resolved"
 
-    for tag in contains_tag:
-        if not tag:
-            continue
-        WHERE += " AND ? in (select value from json_each(comments.hashtags))"
-        params.append(tag)
+    tags = sorted(set(tag for tag in contains_tag if tag))
+    if tags:
+        # comments that have every one of the requested tags
+        WHERE += f"""
+          AND comments.id IN (
+            SELECT comment_id
+            FROM datasette_comments_comment_tags
+            WHERE tag IN ({", ".join("?" for _ in tags)})
+            GROUP BY comment_id
+            HAVING count(*) = {len(tags)}
+          )
+        """
+        params.extend(tags)
 
     sql = f"""
           SELECT
+            comments.id,
             comments.author_actor_id,
             comments.contents,
             comments.created_at,
-            (strftime('%s', 'now') - strftime('%s', comments.created_at)) as created_duration_seconds,
             threads.target_type,
             threads.target_database,
             threads.target_table,
             threads.target_row_ids,
-            threads.target_column
-          FROM datasette_comments_comments AS comments
+            threads.target_column,
+            threads.target_label,
+            comments.thread_id,
+            {THREAD_STATS_JSON} AS thread_stats,
+            {SNIPPET} AS snippet
+          FROM {FROM}
           LEFT JOIN datasette_comments_threads AS threads ON threads.id = comments.thread_id
+          LEFT JOIN datasette_comments_thread_stats AS stats ON stats.thread_id = comments.thread_id
           WHERE {WHERE}
-          ORDER BY comments.created_at DESC
-          LIMIT 100;
+          ORDER BY {ORDER_BY}
+          LIMIT {PAGE_SIZE + 1};
     """
-    results = await datasette.get_internal_database().execute(sql, params)
+    results = await read_database(datasette).execute(sql, params)
     data = [dict(row) for row in results.rows]
 
+    next_cursor = None
+    if len(data) > PAGE_SIZE:
+        data = data[:PAGE_SIZE]
+        if paginated:
+            next_cursor = encode_cursor(data[-1]["created_at"], data[-1]["id"])
+    for row in data:
+        row["thread_stats"] = json.loads(row["thread_stats"])
+        if row["snippet"] is not None:
+            row["snippet"] = snippet_parts(row["snippet"])
+
     actor_ids = set(row["author_actor_id"] for row in data)
     authors = await authors_from_actor_ids(datasette, actor_ids)
 
     for row in data:
         row_author = authors.get(row["author_actor_id"])
         row["author"] = row_author.model_dump() if row_author else {}
-
-        label_column = await get_label_column(
-            datasette, row["target_database"], row["target_table"]
-        )
-        if label_column:
-            try:
-                rowids = json.loads(row["target_row_ids"])
-            except Exception:
-                row["target_label"] = None
-                continue
-
-            target_label = await get_label_for_row(
-                datasette.databases[row["target_database"]],
-                row["target_table"],
-                label_column,
-                rowids,
-            )
-            row["target_label"] = target_label
-        else:
-            row["target_label"] = None
-
-    return Response.json({"data": data})
+    return cacheable_json({"data": data, "next_cursor": next_cursor}, etag)
 
 
 @router.GET(
@@ -559,61 +777,88 @@ async def activity_search(datasette=None, request=None):
 async def profile_activity(datasette=None, request=None):
     actor_id = request.args.get("actorId")
     if not actor_id:
-        return Response.json({"data": []})
+        return Response.json({"data": [], "next_cursor": None})
+
+    # Comments and reactions are paged together, keyed on (created_at, id)
+    # where id is the comment or reaction ID respectively. For reactions
+    # created_at is the comment's, copied onto the reaction so the
+    # (reactor_actor_id, comment_created_at, id) index serves the order.
+    params = {"actor_id": actor_id}
+    comments_keyset = reactions_keyset = ""
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            params["cursor_created_at"], params["cursor_id"] = decode_cursor(cursor)
+        except ValueError as e:
+            return Response.json({"message": str(e)}, status=400)
+        comments_keyset = (
+            "AND (comments.created_at, comments.id) < (:cursor_created_at, :cursor_id)"
+        )
+        reactions_keyset = (
+            "AND (reactions.comment_created_at, reactions.id)"
+            " < (:cursor_created_at, :cursor_id)"
+        )
 
-    db = datasette.get_internal_database()
+    db = read_database(datasette)
 
     comments_results = await db.execute(
-        """
+        f"""
         SELECT
           'comment' as type,
+          comments.id,
           comments.author_actor_id,
           comments.contents,
           comments.created_at,
-          (strftime('%s', 'now') - strftime('%s', comments.created_at)) as created_duration_seconds,
           threads.target_type,
           threads.target_database,
           threads.target_table,
           threads.target_row_ids,
-          threads.target_column
+          threads.target_column,
+          threads.target_label
         FROM datasette_comments_comments AS comments
         LEFT JOIN datasette_comments_threads AS threads ON threads.id = comments.thread_id
         WHERE comments.author_actor_id = :actor_id
-        ORDER BY comments.created_at DESC
-        LIMIT 100
+          {comments_keyset}
+        ORDER BY comments.created_at DESC, comments.id DESC
+        LIMIT {PAGE_SIZE + 1}
         """,
-        {"actor_id": actor_id},
+        params,
     )
 
     reactions_results = await db.execute(
-        """
+        f"""
         SELECT
           'reaction' as type,
+          reactions.id,
           reactions.reaction,
           comments.author_actor_id as comment_author_actor_id,
           comments.contents as comment_contents,
           comments.created_at,
-          (strftime('%s', 'now') - strftime('%s', comments.created_at)) as created_duration_seconds,
           threads.target_type,
           threads.target_database,
           threads.target_table,
           threads.target_row_ids,
-          threads.target_column
+          threads.target_column,
+          threads.target_label
         FROM datasette_comments_reactions AS reactions
         JOIN datasette_comments_comments AS comments ON comments.id = reactions.comment_id
         JOIN datasette_comments_threads AS threads ON threads.id = comments.thread_id
         WHERE reactions.reactor_actor_id = :actor_id
-        ORDER BY comments.created_at DESC
-        LIMIT 100
+          {reactions_keyset}
+        ORDER BY reactions.comment_created_at DESC, reactions.id DESC
+        LIMIT {PAGE_SIZE + 1}
         """,
-        {"actor_id": actor_id},
+        params,
     )
 
     data = [dict(row) for row in comments_results.rows] + [
         dict(row) for row in reactions_results.rows
     ]
-    data.sort(key=lambda r: r["created_at"], reverse=True)
-    data = data[:100]
+    data.sort(key=lambda r: (r["created_at"], r["id"]), reverse=True)
+    next_cursor = None
+    if len(data) > PAGE_SIZE:
+        data = data[:PAGE_SIZE]
+        next_cursor = encode_cursor(data[-1]["created_at"], data[-1]["id"])
 
     actor_ids = set()
     for row in data:
@@ -632,23 +877,59 @@ async def profile_activity(datasette=None, request=None):
             row["comment_author"] = (
                 comment_author.model_dump() if comment_author else {}
             )
+    schedule_target_label_refresh(datasette)
+
+    return Response.json({"data": data, "next_cursor": next_cursor})
+
+
+@router.POST(
+    r"^/-/datasette-comments/api/import$",
+    output=ImportResponse,
+)
+@check_permission(action=PERMISSION_IMPORT_NAME)
+async def bulk_import(datasette=None, request=None, receive=None):
+    """Import NDJSON threads, one ImportThread per line, read as the body streams in."""
+    result = await import_threads(datasette, request_body_lines(receive))
+    return Response.json(result.model_dump())
+
+
+@router.GET(
+    r"^/-/datasette-comments/api/export$",
+    output=None,
+)
+@check_permission()
+async def bulk_export(datasette=None, request=None):
+    """Stream every thread as NDJSON, in the format the import endpoint takes.
+
+    Optionally filtered with ?database=, ?table=, and ?since= / ?until=
+    timestamps bounding when comments were created.
+    """
+    filters = {
+        name: request.args.get(name) for name in ("database", "table", "since", "until")
+    }
+    # checked up front, since errors can't be reported once streaming starts
+    try:
+        validate_export_filters(**filters)
+    except ValueError as e:
+        return Response.json({"message": str(e)}, status=400)
+
+    async def stream(writer):
+        async for line in export_ndjson(datasette, **filters):
+            await writer.write(line)
+
+    return AsgiStream(stream, content_type="application/x-ndjson; charset=utf-8")
 
-        label_column = await get_label_column(
-            datasette, row["target_database"], row["target_table"]
-        )
-        if label_column:
-            try:
-                rowids = json.loads(row["target_row_ids"])
-            except Exception:
-                row["target_label"] = None
-                continue
-            row["target_label"] = await get_label_for_row(
-                datasette.databases[row["target_database"]],
-                row["target_table"],
-                label_column,
-                rowids,
-            )
-        else:
-            row["target_label"] = None
 
-    return Response.json({"data": data})
+@router.GET(
+    r"^/-/datasette-comments/api/cache_stats$",
+    output=None,
+)
+@check_permission(action="debug-menu")
+async def cache_stats(datasette=None, request=None):
+    """Hits, misses and size of the author and table label caches."""
+    return Response.json(
+        {
+            "authors": author_cache(datasette).stats(),
+            "labels": table_metadata_cache(datasette).stats(),
+        }
+    )
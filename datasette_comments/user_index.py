@@ -0,0 +1,137 @@
+from bisect import bisect_left
+from datasette.plugins import pm
+from datasette.utils import await_me_maybe
+from typing import List, Tuple
+import asyncio
+import time
+import weakref
+
+# Default for the "user_index_refresh_interval" plugin config option, in
+# seconds. The index is rebuilt in the background once it is this old.
+USER_INDEX_REFRESH_INTERVAL = 300
+
+
+class UserIndex:
+    """Sorted index of datasette_comments_users() for mention autocomplete.
+
+    Each user is findable by a case-insensitive prefix of their username or of
+    any word in their name. Lookups bisect into the sorted keys, so a search
+    costs O(log n) plus the number of results read.
+    """
+
+    def __init__(self, users):
+        usernames = {}
+        entries = []
+        for user in users:
+            actor_id = user.get("id")
+            username = user.get("username")
+            # the first plugin to list a user wins, same as the hook order
+            if not actor_id or not username or actor_id in usernames:
+                continue
+            usernames[actor_id] = username
+            keys = {username.casefold()}
+            keys.update(word.casefold() for word in (user.get("name") or "").split())
+            entries.extend((key, username, actor_id) for key in keys)
+        entries.sort()
+        self._keys = [entry[0] for entry in entries]
+        self._entries = entries
+        self._actor_ids = {}
+        for actor_id, username in usernames.items():
+            self._actor_ids.setdefault(username, actor_id)
+        self.size = len(usernames)
+
+    def actor_id_for_username(self, username: str):
+        return self._actor_ids.get(username)
+
+    def search(self, prefix: str, limit: int) -> List[Tuple[str, str]]:
+        """Up to limit (actor_id, username) pairs matching prefix, in key order."""
+        prefix = (prefix or "").casefold()
+        results = []
+        seen = set()
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and len(results) < limit:
+            if not self._keys[i].startswith(prefix):
+                break
+            _, username, actor_id = self._entries[i]
+            if actor_id not in seen:
+                seen.add(actor_id)
+                results.append((actor_id, username))
+            i += 1
+        return results
+
+
+async def _load_users(datasette) -> list:
+    users = []
+    for hook_users in pm.hook.datasette_comments_users(datasette=datasette):
+        users.extend(await await_me_maybe(hook_users))
+    return users
+
+
+# Datasette -> {"index", "built_at", "task"}
+_user_indexes: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+async def _build(datasette, state):
+    state["index"] = UserIndex(await _load_users(datasette))
+    state["built_at"] = time.monotonic()
+
+
+async def user_index(datasette) -> UserIndex:
+    """The UserIndex for this Datasette instance.
+
+    The first call builds it. After that a stale index keeps being served
+    while a rebuild runs in the background.
+    """
+    config = datasette.plugin_config("datasette-comments") or {}
+    interval = config.get("user_index_refresh_interval", USER_INDEX_REFRESH_INTERVAL)
+    state = _user_indexes.setdefault(
+        datasette, {"index": None, "built_at": None, "task": None}
+    )
+    stale = state["index"] is None or time.monotonic() - state["built_at"] >= interval
+    if stale and (state["task"] is None or state["task"].done()):
+        state["task"] = asyncio.ensure_future(_build(datasette, state))
+    if state["index"] is None:
+        await asyncio.shield(state["task"])
+    return state["index"]
+
+
+def invalidate_user_index(datasette):
+    """Rebuild the index on next use, call when the set of users changes."""
+    _user_indexes.pop(datasette, None)
+
+
+async def _hook_search(datasette, prefix=None, username=None, limit=1) -> list:
+    users = []
+    for hook_users in pm.hook.datasette_comments_users_search(
+        datasette=datasette, prefix=prefix, username=username, limit=limit
+    ):
+        users.extend(await await_me_maybe(hook_users) or [])
+    return users
+
+
+async def search_users(datasette, prefix: str, limit: int) -> List[Tuple[str, str]]:
+    """Up to limit (actor_id, username) pairs whose username or name starts with prefix.
+
+    Users from datasette_comments_users_search() come first, then users from
+    datasette_comments_users() found in the UserIndex.
+    """
+    results = []
+    seen = set()
+    hook_users = await _hook_search(datasette, prefix=prefix or "", limit=limit)
+    indexed = (await user_index(datasette)).search(prefix, limit)
+    candidates = [(user.get("id"), user.get("username")) for user in hook_users]
+    for actor_id, username in candidates + indexed:
+        if len(results) >= limit:
+            break
+        if actor_id and username and actor_id not in seen:
+            seen.add(actor_id)
+            results.append((actor_id, username))
+    return results
+
+
+async def actor_id_for_username(datasette, username: str):
+    """Actor ID of the user with this exact username, or None."""
+    for user in await _hook_search(datasette, username=username, limit=1):
+        if user.get("username") == username and user.get("id"):
+            return user["id"]
+    return (await user_index(datasette)).actor_id_for_username(username)
@@ -0,0 +1,106 @@
+from typing import Optional
+import asyncio
+import logging
+import weakref
+
+from .internal_db import comments_database
+
+logger = logging.getLogger(__name__)
+
+# Default for the "write_batch_delay" plugin config option, in seconds. Writes
+# that arrive within this long of each other share one transaction.
+WRITE_BATCH_DELAY = 0.005
+
+
+def _run_batch(writes, conn):
+    # each write gets a savepoint, so a failing one is rolled back on its own
+    # and the rest of the batch still commits
+    results = []
+    conn.execute("begin")
+    for sql, params in writes:
+        conn.execute("savepoint batched_write")
+        try:
+            cursor = conn.execute(sql, params or ())
+        except Exception as e:
+            conn.execute("rollback to batched_write")
+            results.append((False, e))
+        else:
+            results.append((True, cursor.rowcount))
+        conn.execute("release batched_write")
+    return results
+
+
+class WriteBatcher:
+    """Coalesces writes to one database into a transaction per short window.
+
+    The first write to arrive starts a timer, and every write submitted
+    before it fires is committed together on the database's write thread.
+    Each write still gets its own future, with its own result or error.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._flush_task: Optional[asyncio.Future] = None
+
+    def submit(self, db, sql: str, params=None, delay=WRITE_BATCH_DELAY):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((sql, params, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush(db, delay))
+        return future
+
+    async def _flush(self, db, delay):
+        await asyncio.sleep(delay)
+        batch, self._pending = self._pending, []
+        # writes submitted from here on start the next window
+        self._flush_task = None
+        try:
+            results = await db.execute_write_fn(
+                lambda conn: _run_batch(
+                    [(sql, params) for sql, params, _ in batch], conn
+                ),
+                block=True,
+            )
+        except Exception as e:
+            results = [(False, e)] * len(batch)
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+# Database -> WriteBatcher
+_write_batchers: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _submit(datasette, sql, params):
+    db = comments_database(datasette)
+    config = datasette.plugin_config("datasette-comments") or {}
+    delay = config.get("write_batch_delay", WRITE_BATCH_DELAY)
+    batcher = _write_batchers.get(db)
+    if batcher is None:
+        batcher = _write_batchers[db] = WriteBatcher()
+    return batcher.submit(db, sql, params, delay)
+
+
+async def batched_write(datasette, sql: str, params=None) -> int:
+    """execute_write() on comments_database(), sharing a transaction with
+    other writes made around the same time. Returns the number of rows changed.
+    """
+    # shielded, so a cancelled request doesn't lose its result for the batch
+    return await asyncio.shield(_submit(datasette, sql, params))
+
+
+def batched_write_nowait(datasette, sql: str, params=None) -> asyncio.Future:
+    """Like batched_write(), without waiting for the commit. Failures are logged."""
+    future = _submit(datasette, sql, params)
+
+    def done(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("datasette-comments write failed", exc_info=future.exception())
+
+    future.add_done_callback(done)
+    return future
@@ -0,0 +1,135 @@
+"""Microbenchmarks for comment parsing and response assembly.
+
+    python tests/benchmarks.py          # compare against the stored baseline
+    python tests/benchmarks.py --save   # record a new baseline
+
+Timings are stored as multiples of a fixed pure-Python calibration loop
+rather than seconds, so a baseline recorded on one machine still means
+something on another. `just bench-check` runs test_benchmarks.py with
+DATASETTE_COMMENTS_BENCHMARKS=1, which fails when a benchmark gets more than
+TOLERANCE times slower than its baseline.
+"""
+
+from datasette_comments import comment_parser
+from datasette_comments.internal_db import build_thread_comments, insert_comment
+from datasette_comments.page_data import Author
+from pathlib import Path
+import json
+import sys
+import timeit
+
+BASELINE_PATH = Path(__file__).parent / "benchmark-baseline.json"
+TOLERANCE = 2.5
+
+INPUTS = {
+    "tiny": "lgtm",
+    "typical": "Looks off @simonw, see https://example.com/x #urgent\nWill fix.\n" * 3,
+    "mention_dense": " ".join(f"@user{i} #tag{i}" for i in range(500)),
+    "paste_100kb": (
+        "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do\n" * 1600
+    ),
+}
+
+
+def _thread_rows(count=100):
+    rendered = json.dumps(comment_parser.parse(INPUTS["typical"]).rendered)
+    return [
+        {
+            "id": f"comment-{i}",
+            "thread_id": f"thread-{i % 10}",
+            "author_actor_id": f"user{i % 7}",
+            "created_at": "2024-01-01 00:00:00",
+            "contents": INPUTS["typical"],
+            "render_nodes": rendered,
+            "render_version": comment_parser.PARSER_VERSION,
+        }
+        for i in range(count)
+    ]
+
+
+def _thread_comments_response():
+    rows = _thread_rows()
+    authors = {
+        f"user{i}": Author(
+            actor_id=f"user{i}",
+            name=f"User {i}",
+            profile_photo_url=None,
+            username=f"user{i}",
+        )
+        for i in range(7)
+    }
+    reactions = {
+        f"comment-{i}": [{"reaction": "👍", "count": 2, "reacted_by_me": True}]
+        for i in range(0, 100, 3)
+    }
+    thread_ids = [f"thread-{i}" for i in range(10)]
+
+    def run():
+        threads, _ = build_thread_comments(
+            [dict(row) for row in rows], authors, reactions, thread_ids
+        )
+        return json.dumps({"ok": True, "data": threads})
+
+    return run
+
+
+def benchmarks():
+    """Benchmark name -> zero argument callable."""
+    cases = {}
+    for name, source in INPUTS.items():
+        cases[f"tokenize/{name}"] = lambda source=source: comment_parser.tokenize(
+            source
+        )
+        cases[f"parse/{name}"] = lambda source=source: comment_parser.parse(source)
+    cases["render_nodes/paste_100kb"] = lambda: comment_parser.append_raw_paragraphs(
+        INPUTS["paste_100kb"], []
+    )
+    cases["parse_many/typical_x100"] = lambda: comment_parser.parse_many(
+        [INPUTS["typical"]] * 100
+    )
+    cases["insert_comment/typical"] = lambda: insert_comment(
+        "thread", "alex", INPUTS["typical"]
+    )
+    cases["thread_comments_response/100"] = _thread_comments_response()
+    return cases
+
+
+def _calibration():
+    total = 0
+    for i in range(2000):
+        total += len(str(i) * 3)
+    return total
+
+
+def seconds_per_call(fn, min_time=0.01, repeat=5):
+    number = 1
+    while timeit.timeit(fn, number=number) < min_time:
+        number *= 2
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def measure(names=None):
+    """Timings as multiples of the calibration loop, keyed by benchmark name."""
+    unit = seconds_per_call(_calibration)
+    return {
+        name: round(seconds_per_call(fn) / unit, 4)
+        for name, fn in benchmarks().items()
+        if names is None or name in names
+    }
+
+
+def load_baseline():
+    return json.loads(BASELINE_PATH.read_text())
+
+
+if __name__ == "__main__":
+    results = measure()
+    if "--save" in sys.argv:
+        BASELINE_PATH.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved {len(results)} benchmarks to {BASELINE_PATH}")
+    baseline = load_baseline() if BASELINE_PATH.exists() else {}
+    for name, value in results.items():
+        change = ""
+        if name in baseline:
+            change = f"{value / baseline[name]:.2f}x baseline"
+        print(f"{name:40} {value:12.4f} {change}")
@@ -0,0 +1,33 @@
+from benchmarks import TOLERANCE, benchmarks, load_baseline, measure
+import os
+import pytest
+
+
+def test_baseline_covers_every_benchmark():
+    # run `python tests/benchmarks.py --save` after adding a benchmark
+    assert set(load_baseline()) == set(benchmarks())
+
+
+# Timings depend on the machine, so they're only compared when asked for, with
+# `just bench-check`, rather than on every test run
+@pytest.mark.skipif(
+    not os.environ.get("DATASETTE_COMMENTS_BENCHMARKS"),
+    reason="set DATASETTE_COMMENTS_BENCHMARKS=1 to compare timings to the baseline",
+)
+def test_no_benchmark_regressions():
+    baseline = load_baseline()
+    results = measure()
+    regressions = {
+        name: f"{results[name] / baseline[name]:.2f}x baseline"
+        for name in baseline
+        if name in results and results[name] > baseline[name] * TOLERANCE
+    }
+    if regressions:
+        # retry the slow ones once, so a noisy neighbour doesn't fail the build
+        results = measure(regressions)
+        regressions = {
+            name: f"{results[name] / baseline[name]:.2f}x baseline"
+            for name in regressions
+            if results[name] > baseline[name] * TOLERANCE
+        }
+    assert regressions == {}
@@ -0,0 +1,257 @@
+from datasette.database import Database
+from datasette_comments import bulk
+import json
+import pytest
+
+from test_comments import cookie_for_actor, make_datasette
+
+
+def thread_record(i, **extra):
+    return {
+        "id": f"thread-{i}",
+        "type": "row",
+        "database": "data",
+        "table": "people",
+        "rowids": [str(i)],
+        "creator_actor_id": "alex",
+        "created_at": f"2023-01-0{i} 00:00:00",
+        "comments": [
+            {
+                "id": f"comment-{i}",
+                "author_actor_id": "alex",
+                "contents": f"imported @simon #note{i}",
+                "created_at": f"2023-01-0{i} 00:00:00",
+                "reactions": [{"reactor_actor_id": "simon", "reaction": "👍"}],
+            },
+            {"author_actor_id": "simon", "contents": "reply"},
+        ],
+        **extra,
+    }
+
+
+@pytest.mark.asyncio
+async def test_import_threads():
+    datasette = make_datasette()
+    await datasette.invoke_startup()
+    db = datasette.add_database(Database(datasette, memory_name="import"), "data")
+    await db.execute_write_script(
+        """
+        create table people(id integer primary key, name text);
+        insert into people values (1, 'Alex'), (2, 'Simon');
+        """
+    )
+
+    async def records():
+        yield json.dumps(thread_record(1))
+        yield ""
+        # timestamps are stored in UTC, the way SQLite writes them
+        yield thread_record(2, resolved_at="2023-02-01T02:00:00+02:00")
+        yield "{not json"
+        yield {**thread_record(3), "type": "column"}
+        yield json.dumps(thread_record(4, comments=[]))
+        yield {"type": "database", "database": "data", "comments": []}
+        yield thread_record(5, created_at="yesterday")
+
+    result = await bulk.import_threads(datasette, records(), chunk_size=1)
+    assert result.model_dump(exclude={"errors"}) == {
+        "ok": False,
+        "threads": 2,
+        "comments": 4,
+        "reactions": 2,
+        "failed": 5,
+    }
+    assert [(error.line, error.message.split(" ")[0]) for error in result.errors] == [
+        (4, "Invalid"),
+        (5, "target"),
+        (6, "a"),
+        (7, "creator_actor_id:"),
+        (8, "created_at:"),
+    ]
+
+    internal = datasette.get_internal_database()
+    rows = await internal.execute(
+        """
+        select threads.id, target_label, resolved_at, comments.created_at, hashtags
+        from datasette_comments_threads as threads
+        join datasette_comments_comments as comments
+          on comments.id = 'comment-' || substr(threads.id, 8)
+        order by threads.id
+        """
+    )
+    assert [dict(row) for row in rows] == [
+        {
+            "id": "thread-1",
+            "target_label": "Alex",
+            "resolved_at": None,
+            "created_at": "2023-01-01 00:00:00",
+            "hashtags": '["note1"]',
+        },
+        {
+            "id": "thread-2",
+            "target_label": "Simon",
+            "resolved_at": "2023-02-01 00:00:00",
+            "created_at": "2023-01-02 00:00:00",
+            "hashtags": '["note2"]',
+        },
+    ]
+
+    # records that keep their IDs can be imported again without duplicates,
+    # including their comments without IDs
+    result = await bulk.import_threads(datasette, [thread_record(1)])
+    assert (result.ok, result.threads, result.comments, result.reactions) == (
+        True,
+        0,
+        0,
+        0,
+    )
+
+    # a comment whose ID is taken by another thread's comment is skipped,
+    # with its reactions, instead of reacting to the other comment
+    record = thread_record(5)
+    record["comments"][0]["id"] = "comment-1"
+    result = await bulk.import_threads(datasette, [record])
+    assert (result.threads, result.comments, result.reactions) == (1, 1, 0)
+    rows = await internal.execute(
+        """
+        select count(*) from datasette_comments_reactions
+        where comment_id = 'comment-1'
+        """
+    )
+    assert rows.single_value() == 1
+
+
+@pytest.mark.asyncio
+async def test_import_endpoint():
+    datasette = make_datasette(**{"datasette-comments-import": {"id": ["root"]}})
+    await datasette.invoke_startup()
+    body = "\n".join(
+        json.dumps({**thread_record(i), "type": "table", "rowids": None})
+        for i in range(1, 4)
+    )
+    headers = {"content-type": "application/x-ndjson"}
+
+    # write access alone isn't enough, records can be authored by anyone
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/import",
+        content=body,
+        headers=headers,
+        cookies=cookie_for_actor(datasette, "alex"),
+    )
+    assert response.status_code == 403
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/import",
+        content=body,
+        headers=headers,
+        cookies=cookie_for_actor(datasette, "root"),
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "ok": True,
+        "threads": 3,
+        "comments": 6,
+        "reactions": 3,
+        "failed": 0,
+        "errors": [],
+    }
+
+
+@pytest.mark.asyncio
+async def test_request_body_lines():
+    messages = [
+        {"type": "http.request", "body": b'{"a": 1}\n{"b"', "more_body": True},
+        {"type": "http.request", "body": b": 2}\n\n", "more_body": True},
+        {"type": "http.request", "body": b'{"c": 3}', "more_body": False},
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    lines = [line async for line in bulk.request_body_lines(receive)]
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b"", b'{"c": 3}']
+
+
+@pytest.mark.asyncio
+async def test_export_round_trip():
+    datasette = make_datasette()
+    await datasette.invoke_startup()
+    cookies = cookie_for_actor(datasette, "alex")
+    records = [
+        thread_record(1),
+        thread_record(2, table="places", resolved_at="2023-02-01 00:00:00"),
+        {**thread_record(3), "type": "table", "rowids": None},
+        {**thread_record(4), "type": "database", "table": None, "rowids": None},
+    ]
+    assert (await bulk.import_threads(datasette, records)).ok
+
+    exported = [
+        json.loads(line) async for line in bulk.export_ndjson(datasette, batch_size=3)
+    ]
+    assert [thread["id"] for thread in exported] == [
+        "thread-1",
+        "thread-2",
+        "thread-3",
+        "thread-4",
+    ]
+    assert exported[0]["comments"][0] == {
+        "id": "comment-1",
+        "author_actor_id": "alex",
+        "contents": "imported @simon #note1",
+        "created_at": "2023-01-01 00:00:00",
+        "reactions": [
+            {
+                "id": exported[0]["comments"][0]["reactions"][0]["id"],
+                "reactor_actor_id": "simon",
+                "reaction": "👍",
+            }
+        ],
+    }
+    assert exported[1]["resolved_at"] == "2023-02-01 00:00:00"
+    assert "rowids" not in exported[3] and "table" not in exported[3]
+
+    # the export can be imported elsewhere, and exports the same again
+    other = make_datasette()
+    await other.invoke_startup()
+    assert (await bulk.import_threads(other, exported)).ok
+    assert [json.loads(line) async for line in bulk.export_ndjson(other)] == exported
+
+    async def export(**filters):
+        return [
+            (thread.id, [comment.contents for comment in thread.comments])
+            async for thread in bulk.export_threads(datasette, **filters)
+        ]
+
+    assert [thread_id for thread_id, _ in await export(table="people")] == [
+        "thread-1",
+        "thread-3",
+    ]
+    # only comments made in the range, and threads with at least one of them
+    assert await export(since="2023-01-02", until="2023-01-04") == [
+        ("thread-2", ["imported @simon #note2"]),
+        ("thread-3", ["imported @simon #note3"]),
+    ]
+
+    # bounds are compared in UTC, whatever form they're given in
+    assert await export(
+        since="2023-01-03T00:00:00", until="2023-01-04T02:00:00+02:00"
+    ) == [("thread-3", ["imported @simon #note3"])]
+    assert await export(until="2023-01-01T23:00:00-01:00") == [
+        ("thread-1", ["imported @simon #note1"])
+    ]
+    with pytest.raises(ValueError):
+        await export(since="garbage")
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/export?since=garbage", cookies=cookies
+    )
+    assert response.status_code == 400
+    assert response.json()["message"].startswith("since:")
+
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/export?database=data&table=places", cookies=cookies
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson; charset=utf-8"
+    assert [json.loads(line) for line in response.text.splitlines()] == [exported[1]]
+
+    response = await datasette.client.get("/-/datasette-comments/api/export")
+    assert response.status_code == 403
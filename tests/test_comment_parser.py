@@ -1,6 +1,7 @@
 from datasette_comments.comment_parser import (
     valid_url,
     parse,
+    parse_many,
     ParseResult,
     Token,
     RenderNode,
@@ -89,3 +90,28 @@ first is empty"""
         asdict(RenderNode("raw", "\n")),
         asdict(RenderNode("linebreak", "")),
     ]
+
+
+def test_parse_leading_linebreak_quirk():
+    # the raw node after a leading line break keeps that line break
+    assert parse("\nab\ncd").rendered == [
+        {"node_type": "linebreak", "value": ""},
+        {"node_type": "raw", "value": "\nab"},
+        {"node_type": "linebreak", "value": ""},
+        {"node_type": "raw", "value": "cd"},
+    ]
+
+
+def test_parse_many():
+    sources = ["see https://example.com", "@alex\n#tag", ""]
+    results = parse_many(sources)
+    assert results == [parse(source) for source in sources]
+    assert results[0].urls == [Token(4, 23, "https://example.com")]
+    assert results[1].rendered == [
+        {"node_type": "raw", "value": ""},
+        {"node_type": "mention", "value": "@alex"},
+        {"node_type": "linebreak", "value": ""},
+        {"node_type": "tag", "value": "#tag"},
+        {"node_type": "raw", "value": ""},
+    ]
+    assert not hasattr(results[0].tokens[0], "__dict__")
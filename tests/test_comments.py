@@ -1,4 +1,15 @@
+from datasette_comments import comment_parser, internal_db
+from datasette_comments import events, write_queue
+from datasette_comments import extra_body_script, should_inject_content_script
+from datasette_comments.router import can_read
+from datasette_comments.routes import api
+from datasette.tracer import capture_traces
+from datasette.utils.asgi import Request
+from datasette import hookimpl
+from datasette.plugins import pm
 from datasette.app import Datasette
+import asyncio
+import json
 import pytest
 from ulid import ULID
 
@@ -136,6 +147,120 @@ async def test_autocomplete_mentions(datasette_with_plugin, prefix, expected):
     delattr(datasette_with_plugin, "_datasette_comments_users_accessed")
 
 
+@pytest.mark.asyncio
+async def test_autocomplete_mentions_index(monkeypatch):
+    extra_users = []
+
+    class ManyUsers:
+        __name__ = "ManyUsers"
+
+        @hookimpl
+        def datasette_comments_users(self, datasette):
+            users = [
+                {"id": f"u{i}", "username": f"user{i:05}", "name": f"Person {i}"}
+                for i in range(20_000)
+            ]
+            users.append({"id": "alex", "username": "asg017", "name": "Alex Garcia"})
+            users.extend(extra_users)
+            return users
+
+    resolved = []
+    authors_from_actor_ids = internal_db.authors_from_actor_ids
+
+    async def counting_authors_from_actor_ids(datasette, actor_ids):
+        resolved.append(list(actor_ids))
+        return await authors_from_actor_ids(datasette, actor_ids)
+
+    monkeypatch.setattr(api, "authors_from_actor_ids", counting_authors_from_actor_ids)
+    pm.register(ManyUsers(), name="many_users")
+    try:
+        datasette = make_datasette()
+        cookies = cookie_for_actor(datasette, "alex")
+
+        async def suggestions(query):
+            response = await datasette.client.get(
+                "/-/datasette-comments/api/autocomplete/mentions?" + query,
+                cookies=cookies,
+            )
+            return [item["username"] for item in response.json()["suggestions"]]
+
+        assert await suggestions("prefix=user1") == [f"user1{i:04}" for i in range(10)]
+        assert resolved == [[f"u{10000 + i}" for i in range(10)]]
+        assert await suggestions("prefix=USER0000&limit=3") == [
+            "user00000",
+            "user00001",
+            "user00002",
+        ]
+        # names match by any word, and each user is suggested once
+        assert await suggestions("prefix=gar") == ["asg017"]
+        assert await suggestions("prefix=a") == ["asg017"]
+        assert await suggestions("prefix=nobody") == []
+        response = await datasette.client.get(
+            "/-/datasette-comments/api/autocomplete/mentions?prefix=a&limit=x",
+            cookies=cookies,
+        )
+        assert response.status_code == 400
+        # new users show up once authors are invalidated
+        extra_users.append({"id": "zed", "username": "zed", "name": "Zed"})
+        assert await suggestions("prefix=zed") == []
+        internal_db.invalidate_authors(datasette)
+        assert await suggestions("prefix=zed") == ["zed"]
+    finally:
+        pm.unregister(name="many_users")
+
+
+@pytest.mark.asyncio
+async def test_users_search_hook():
+    calls = []
+
+    class Directory:
+        __name__ = "Directory"
+
+        @hookimpl
+        def datasette_comments_users_search(self, prefix, username, limit):
+            calls.append((prefix, username, limit))
+            users = [
+                {"id": "alex", "username": "asg017", "name": "Alex Garcia"},
+                {"id": "ana", "username": "ana", "name": "Ana"},
+            ]
+
+            async def inner():
+                if username is not None:
+                    return [user for user in users if user["username"] == username]
+                return [user for user in users if user["username"].startswith(prefix)][
+                    :limit
+                ]
+
+            return inner
+
+    pm.register(Directory(), name="directory")
+    try:
+        datasette = make_datasette()
+        cookies = cookie_for_actor(datasette, "alex")
+        response = await datasette.client.get(
+            "/-/datasette-comments/api/autocomplete/mentions?prefix=a&limit=5",
+            cookies=cookies,
+        )
+        assert [s["username"] for s in response.json()["suggestions"]] == [
+            "asg017",
+            "ana",
+        ]
+        assert calls == [("a", None, 5)]
+
+        await datasette.client.post(
+            "/-/datasette-comments/api/thread/new",
+            json={"type": "database", "database": "db", "comment": "hi"},
+            cookies=cookies,
+        )
+        response = await datasette.client.get(
+            "/-/datasette-comments/api/activity_search?author=asg017", cookies=cookies
+        )
+        assert [row["author_actor_id"] for row in response.json()["data"]] == ["alex"]
+        assert calls[-1] == (None, "asg017", 1)
+    finally:
+        pm.unregister(name="directory")
+
+
 # --- New tests for expanded API coverage ---
 
 
@@ -476,6 +601,39 @@ async def test_content_script_injection():
     assert "content_script" in response.text
 
 
+@pytest.mark.asyncio
+async def test_permission_checks_memoized_per_request(monkeypatch):
+    datasette = make_datasette(**{"datasette-comments-readonly": {"id": ["reader"]}})
+    await datasette.invoke_startup()
+    checks = []
+    allowed = datasette.allowed
+
+    async def counting_allowed(*, action, actor, **kwargs):
+        checks.append(action)
+        return await allowed(action=action, actor=actor, **kwargs)
+
+    monkeypatch.setattr(datasette, "allowed", counting_allowed)
+
+    request = Request.fake("/db/table")
+    request.scope["actor"] = {"id": "reader"}
+    # what a page render does: each of the three hooks checks permissions
+    for _ in range(3):
+        assert await should_inject_content_script(datasette, request, "table")
+    script = await extra_body_script(
+        None, "db", "table", [], "table", request, datasette
+    )
+    assert '"readonly_viewer": true' in script
+    assert checks == ["datasette-comments-access", "datasette-comments-readonly"]
+
+    # a new request starts fresh
+    checks.clear()
+    request = Request.fake("/-/datasette-comments/api/thread/comments/x")
+    request.scope["actor"] = {"id": "reader"}
+    assert await can_read(datasette, request)
+    assert await can_read(datasette, request)
+    assert len(checks) == 2
+
+
 @pytest.mark.asyncio
 async def test_activity_page_vite_entry():
     """Test that the activity page uses vite_entry for its JS/CSS."""
@@ -489,3 +647,735 @@ async def test_activity_page_vite_entry():
     assert response.status_code == 200
     # Should include vite-built activity JS
     assert "activity" in response.text
+
+
+@pytest.mark.asyncio
+async def test_activity_search_full_text():
+    datasette = make_datasette()
+    cookies = cookie_for_actor(datasette, "alex")
+
+    for comment in (
+        "migrations look fine to me, migration done",
+        "the migration script is broken",
+        "unrelated note",
+    ):
+        await datasette.client.post(
+            "/-/datasette-comments/api/thread/new",
+            json={"type": "database", "database": "testdb", "comment": comment},
+            cookies=cookies,
+        )
+
+    # partially-typed last word still matches
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search?searchComments=migr",
+        cookies=cookies,
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert len(data) == 2
+    assert {part["value"] for part in data[0]["snippet"] if part["highlight"]} <= {
+        "migration",
+        "migrations",
+    }
+
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search?searchComments=migration&sort=relevance",
+        cookies=cookies,
+    )
+    data = response.json()["data"]
+    assert [row["contents"] for row in data] == [
+        "migrations look fine to me, migration done",
+        "the migration script is broken",
+    ]
+
+    # FTS syntax in user input is escaped, not an error
+    response = await datasette.client.get(
+        '/-/datasette-comments/api/activity_search?searchComments=broken" OR',
+        cookies=cookies,
+    )
+    assert response.status_code == 200
+    assert [row["contents"] for row in response.json()["data"]] == []
+
+    # no search means no snippet
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search", cookies=cookies
+    )
+    assert all(row["snippet"] is None for row in response.json()["data"])
+
+    # matches follow the comments when their implicit rowids change, as
+    # VACUUM may do, and edits and deletes keep the index in sync
+    internal = datasette.get_internal_database()
+    await internal.execute_write_script(
+        """
+        update datasette_comments_comments set rowid = 1000 - rowid;
+        update datasette_comments_comments set contents = 'the fix is broken'
+          where contents = 'unrelated note';
+        delete from datasette_comments_comments
+          where contents = 'migrations look fine to me, migration done';
+        """
+    )
+
+    async def search(query):
+        response = await datasette.client.get(
+            f"/-/datasette-comments/api/activity_search?searchComments={query}",
+            cookies=cookies,
+        )
+        return [row["contents"] for row in response.json()["data"]]
+
+    assert await search("migration") == ["the migration script is broken"]
+    assert sorted(await search("broken")) == [
+        "the fix is broken",
+        "the migration script is broken",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_activity_search_multiple_tags():
+    datasette = make_datasette()
+    cookies = cookie_for_actor(datasette, "alex")
+
+    for comment in ("#a #b @simonw", "#a only", "#b #c", "#a #b again #a"):
+        await datasette.client.post(
+            "/-/datasette-comments/api/thread/new",
+            json={"type": "database", "database": "testdb", "comment": comment},
+            cookies=cookies,
+        )
+
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search?containsTag=a&containsTag=b",
+        cookies=cookies,
+    )
+    assert response.status_code == 200
+    assert sorted(row["contents"] for row in response.json()["data"]) == [
+        "#a #b @simonw",
+        "#a #b again #a",
+    ]
+
+    db = datasette.get_internal_database()
+    tags = await db.execute(
+        "select tag, count(*) as n from datasette_comments_comment_tags"
+        " group by tag order by tag"
+    )
+    assert [(row["tag"], row["n"]) for row in tags] == [("a", 3), ("b", 3), ("c", 1)]
+
+
+@pytest.mark.asyncio
+async def test_activity_pagination():
+    datasette = make_datasette()
+    cookies = cookie_for_actor(datasette, "alex")
+    await datasette.invoke_startup()
+
+    # many comments sharing a created_at, so ties have to be broken by id
+    def seed(conn):
+        conn.execute(
+            "insert into datasette_comments_threads(id, target_type, target_database)"
+            " values ('thread', 'database', 'testdb')"
+        )
+        conn.executemany(
+            "insert into datasette_comments_comments"
+            "(id, thread_id, created_at, author_actor_id, contents, hashtags, mentions)"
+            " values (?, 'thread', ?, 'alex', ?, '[]', '[]')",
+            [
+                (str(ULID()).lower(), f"2024-01-0{1 + i // 100} 00:00:00", str(i))
+                for i in range(250)
+            ],
+        )
+
+    await datasette.get_internal_database().execute_write_fn(seed, block=True)
+
+    for path, params in (
+        ("/-/datasette-comments/api/activity_search", {}),
+        ("/-/datasette-comments/api/profile_activity", {"actorId": "alex"}),
+    ):
+        seen = []
+        pages = 0
+        while True:
+            response = await datasette.client.get(path, params=params, cookies=cookies)
+            assert response.status_code == 200
+            body = response.json()
+            seen.extend(row["id"] for row in body["data"])
+            pages += 1
+            if body["next_cursor"] is None:
+                break
+            params = {**params, "cursor": body["next_cursor"]}
+        assert pages == 3
+        assert len(seen) == len(set(seen)) == 250
+
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search?cursor=nope", cookies=cookies
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_thread_stats():
+    datasette = make_datasette(
+        **{"datasette-comments-access": {"id": ["alex", "simon"]}}
+    )
+    alex = cookie_for_actor(datasette, "alex")
+    simon = cookie_for_actor(datasette, "simon")
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={
+            "type": "row",
+            "database": "mydb",
+            "table": "mytable",
+            "rowids": "1",
+            "comment": "first",
+        },
+        cookies=alex,
+    )
+    thread_id = response.json()["thread_id"]
+    for cookies in (simon, alex):
+        await datasette.client.post(
+            "/-/datasette-comments/api/thread/comment/add",
+            json={"thread_id": thread_id, "contents": "reply"},
+            cookies=cookies,
+        )
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/threads/table_view",
+        json={"database": "mydb", "table": "mytable", "rowids": ["1"]},
+        cookies=alex,
+    )
+    stats = response.json()["data"]["row_threads"][0]["stats"]
+    assert stats["comment_count"] == 3
+    assert stats["last_author_actor_id"] == "alex"
+    assert stats["participant_actor_ids"] == ["alex", "simon"]
+    assert stats["last_comment_at"] is not None
+
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search", cookies=alex
+    )
+    assert all(
+        row["thread_id"] == thread_id and row["thread_stats"] == stats
+        for row in response.json()["data"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_thread_comments_reaction_summaries():
+    datasette = make_datasette(
+        **{"datasette-comments-access": {"id": ["alex", "simon"]}}
+    )
+    alex = cookie_for_actor(datasette, "alex")
+    simon = cookie_for_actor(datasette, "simon")
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={"type": "database", "database": "testdb", "comment": "react to me"},
+        cookies=alex,
+    )
+    thread_id = response.json()["thread_id"]
+
+    async def reactions(cookies):
+        response = await datasette.client.get(
+            f"/-/datasette-comments/api/thread/comments/{thread_id}",
+            cookies=cookies,
+        )
+        return response.json()["data"][0]
+
+    comment_id = (await reactions(alex))["id"]
+    for cookies, reaction in ((alex, "👍"), (simon, "👍"), (simon, "🎉")):
+        await datasette.client.post(
+            "/-/datasette-comments/api/reaction/add",
+            json={"comment_id": comment_id, "reaction": reaction},
+            cookies=cookies,
+        )
+
+    assert (await reactions(alex))["reactions"] == [
+        {"reaction": "👍", "count": 2, "reacted_by_me": True},
+        {"reaction": "🎉", "count": 1, "reacted_by_me": False},
+    ]
+
+    await datasette.client.post(
+        "/-/datasette-comments/api/reaction/remove",
+        json={"comment_id": comment_id, "reaction": "🎉"},
+        cookies=simon,
+    )
+    assert (await reactions(simon))["reactions"] == [
+        {"reaction": "👍", "count": 2, "reacted_by_me": True},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_render_nodes_stored_and_rerendered():
+    datasette = make_datasette()
+    cookies = cookie_for_actor(datasette, "alex")
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={"type": "database", "database": "testdb", "comment": "hi @simon #yo"},
+        cookies=cookies,
+    )
+    thread_id = response.json()["thread_id"]
+    expected = [
+        {"node_type": "raw", "value": "hi "},
+        {"node_type": "mention", "value": "@simon"},
+        {"node_type": "raw", "value": " "},
+        {"node_type": "tag", "value": "#yo"},
+        {"node_type": "raw", "value": ""},
+    ]
+    db = datasette.get_internal_database()
+
+    async def stored():
+        row = (
+            await db.execute(
+                "select render_nodes, render_version from datasette_comments_comments"
+            )
+        ).first()
+        return json.loads(row["render_nodes"]), row["render_version"]
+
+    async def render_nodes():
+        response = await datasette.client.get(
+            f"/-/datasette-comments/api/thread/comments/{thread_id}", cookies=cookies
+        )
+        return response.json()["data"][0]["render_nodes"]
+
+    assert await stored() == (expected, comment_parser.PARSER_VERSION)
+
+    # comments rendered by an older parser are re-rendered when read
+    await db.execute_write(
+        "update datasette_comments_comments set render_nodes = '[]', render_version = 0"
+    )
+    assert await render_nodes() == expected
+    await db.execute_write("select 1")  # wait for the queued update
+    assert await stored() == (expected, comment_parser.PARSER_VERSION)
+    assert await render_nodes() == expected
+
+
+@pytest.mark.asyncio
+async def test_etags_and_not_modified(monkeypatch):
+    datasette = make_datasette(
+        **{"datasette-comments-access": {"id": ["alex", "simon"]}}
+    )
+    alex = cookie_for_actor(datasette, "alex")
+    simon = cookie_for_actor(datasette, "simon")
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={"type": "table", "database": "db", "table": "t", "comment": "hi"},
+        cookies=alex,
+    )
+    thread_id = response.json()["thread_id"]
+    path = f"/-/datasette-comments/api/thread/comments/{thread_id}"
+
+    response = await datasette.client.get(path, cookies=alex)
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert "created_duration_seconds" not in response.json()["data"][0]
+
+    traces = []
+    with capture_traces(traces):
+        response = await datasette.client.get(
+            path, cookies=alex, headers={"if-none-match": etag}
+        )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    # answered from the version counter alone
+    assert not any(
+        "datasette_comments_comments" in trace.get("sql", "") for trace in traces
+    )
+
+    # responses include reacted_by_me, so they're per actor
+    response = await datasette.client.get(
+        path, cookies=simon, headers={"if-none-match": etag}
+    )
+    assert response.status_code == 200
+
+    await datasette.client.post(
+        "/-/datasette-comments/api/thread/comment/add",
+        json={"thread_id": thread_id, "contents": "again"},
+        cookies=alex,
+    )
+    response = await datasette.client.get(
+        path, cookies=alex, headers={"if-none-match": etag}
+    )
+    assert response.status_code == 200
+    assert len(response.json()["data"]) == 2
+
+    # POST endpoints key on the request body too
+    body = {"database": "db", "table": "t", "rowids": []}
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/threads/table_view", json=body, cookies=alex
+    )
+    etag = response.headers["etag"]
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/threads/table_view",
+        json=body,
+        cookies=alex,
+        headers={"if-none-match": etag},
+    )
+    assert response.status_code == 304
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/threads/table_view",
+        json={**body, "table": "other"},
+        cookies=alex,
+        headers={"if-none-match": etag},
+    )
+    assert response.status_code == 200
+
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search", cookies=alex
+    )
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search",
+        cookies=alex,
+        headers={"if-none-match": response.headers["etag"]},
+    )
+    assert response.status_code == 304
+
+    # or once cached authors expire, as their profiles may have changed
+    cache = internal_db.author_cache(datasette)
+    expired = (cache.period() + 1) * cache.ttl
+    monkeypatch.setattr(internal_db.time, "monotonic", lambda: expired)
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search",
+        cookies=alex,
+        headers={"if-none-match": response.headers["etag"]},
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_etags_follow_profiles_with_author_cache_disabled(monkeypatch):
+    datasette = Datasette(
+        memory=True,
+        config={
+            "permissions": {
+                "datasette-comments-access": {"id": ["alex"]},
+                "profile_access": {"id": ["alex"]},
+            },
+            "plugins": {"datasette-comments": {"author_cache_ttl": 0}},
+        },
+    )
+    await datasette.invoke_startup()
+    alex = cookie_for_actor(datasette, "alex")
+    await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={"type": "database", "database": "db", "comment": "hi"},
+        cookies=alex,
+    )
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search", cookies=alex
+    )
+    etag = response.headers["etag"]
+    assert response.json()["data"][0]["author"]["name"] == "alex"
+
+    response = await datasette.client.post(
+        "/-/api/user-profile/update",
+        json={"display_name": "Alex Garcia"},
+        cookies=alex,
+    )
+    assert response.status_code == 200
+
+    # nothing is cached, but ETags still change every default TTL, so a
+    # client never keeps a stale name for longer than that
+    now = internal_db.time.monotonic()
+    later = now + internal_db.AUTHOR_CACHE_TTL
+    monkeypatch.setattr(internal_db.time, "monotonic", lambda: later)
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/activity_search",
+        cookies=alex,
+        headers={"if-none-match": etag},
+    )
+    assert response.status_code == 200
+    assert response.json()["data"][0]["author"]["name"] == "Alex Garcia"
+
+
+@pytest.mark.asyncio
+async def test_threads_comments_batch():
+    datasette = make_datasette()
+    cookies = cookie_for_actor(datasette, "alex")
+
+    thread_ids = []
+    for i in range(3):
+        response = await datasette.client.post(
+            "/-/datasette-comments/api/thread/new",
+            json={"type": "database", "database": "testdb", "comment": f"t{i}"},
+            cookies=cookies,
+        )
+        thread_ids.append(response.json()["thread_id"])
+    await datasette.client.post(
+        "/-/datasette-comments/api/thread/comment/add",
+        json={"thread_id": thread_ids[0], "contents": "reply #tag"},
+        cookies=cookies,
+    )
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/threads/comments",
+        json={"thread_ids": thread_ids + ["missing"]},
+        cookies=cookies,
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert set(data) == set(thread_ids + ["missing"])
+    assert [c["contents"] for c in data[thread_ids[0]]] == ["t0", "reply #tag"]
+    assert [c["contents"] for c in data[thread_ids[2]]] == ["t2"]
+    assert data["missing"] == []
+
+    # same shape as the single-thread endpoint
+    response = await datasette.client.get(
+        f"/-/datasette-comments/api/thread/comments/{thread_ids[0]}",
+        cookies=cookies,
+    )
+    assert response.json()["data"] == data[thread_ids[0]]
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/threads/comments",
+        json={"thread_ids": [str(i) for i in range(101)]},
+        cookies=cookies,
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_stream():
+    datasette = make_datasette()
+    await datasette.invoke_startup()
+    cookies = cookie_for_actor(datasette, "alex")
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/stream?database=data", cookies=cookies
+    )
+    assert response.status_code == 400
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/stream?database=data&table=people"
+    )
+    assert response.status_code == 403
+
+    messages = []
+    disconnect = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/-/datasette-comments/api/stream",
+        "raw_path": b"/-/datasette-comments/api/stream",
+        "query_string": b"database=data&table=people",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"cookie", f"ds_actor={cookies['ds_actor']}".encode()),
+        ],
+    }
+    stream = asyncio.ensure_future(datasette.app()(scope, receive, send))
+
+    async def post(path, body):
+        response = await datasette.client.post(
+            f"/-/datasette-comments/api/{path}", json=body, cookies=cookies
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    thread_id = (
+        await post(
+            "thread/new",
+            {
+                "type": "row",
+                "database": "data",
+                "table": "people",
+                "rowids": "1",
+                "comment": "hi",
+            },
+        )
+    )["thread_id"]
+    # threads on other tables aren't streamed
+    await post(
+        "thread/new",
+        {
+            "type": "row",
+            "database": "data",
+            "table": "other",
+            "rowids": "1",
+            "comment": "hi",
+        },
+    )
+    await post("thread/comment/add", {"thread_id": thread_id, "contents": "reply"})
+    comment_id = (
+        await datasette.client.get(
+            f"/-/datasette-comments/api/thread/comments/{thread_id}", cookies=cookies
+        )
+    ).json()["data"][0]["id"]
+    await post("reaction/add", {"comment_id": comment_id, "reaction": "👍"})
+    await post("reaction/remove", {"comment_id": comment_id, "reaction": "👍"})
+    await post("threads/mark_resolved", {"thread_id": thread_id})
+
+    for _ in range(100):
+        if sum(m.get("body", b"").count(b"\n\n") for m in messages) >= 6:
+            break
+        await asyncio.sleep(0.01)
+    disconnect.set()
+    await asyncio.wait_for(stream, 1)
+
+    assert messages[0]["status"] == 200
+    assert [b"content-type", b"text/event-stream; charset=utf-8"] in messages[0][
+        "headers"
+    ]
+    assert messages[-1] == {"type": "http.response.body", "body": b""}
+    received = [
+        json.loads(chunk.split(b"data: ")[1])
+        for message in messages[1:]
+        for chunk in message.get("body", b"").split(b"\n\n")
+        if chunk.startswith(b"event: ")
+    ]
+    assert [event["type"] for event in received] == [
+        "thread_created",
+        "comment_added",
+        "reaction_added",
+        "reaction_removed",
+        "thread_resolved",
+    ]
+    assert received[0]["rowids"] == "1"
+    assert {event["thread_id"] for event in received} == {thread_id}
+    assert received[2] == {
+        "type": "reaction_added",
+        "reaction": "👍",
+        "comment_id": comment_id,
+        "thread_id": thread_id,
+    }
+    # the subscription is gone once the client disconnects
+    assert not events.event_bus(datasette)
+
+
+def test_stream_subscription_overflow():
+    bus = events.EventBus()
+    subscription = bus.subscribe([events.thread_channel("a")], queue_size=2)
+    for i in range(3):
+        bus.publish(
+            [events.thread_channel("a"), events.thread_channel("b")],
+            {"type": "comment_added", "i": i},
+        )
+    assert subscription.queue.qsize() == 1
+    assert subscription.queue.get_nowait() == {"type": "resync"}
+
+
+@pytest.mark.asyncio
+async def test_writes_coalesced():
+    datasette = make_datasette()
+    await datasette.invoke_startup()
+    cookies = cookie_for_actor(datasette, "alex")
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={"type": "database", "database": "data", "comment": "hi"},
+        cookies=cookies,
+    )
+    thread_id = response.json()["thread_id"]
+    db = datasette.get_internal_database()
+    comment_id = (
+        await db.execute(
+            "select id from datasette_comments_comments where thread_id = ?",
+            (thread_id,),
+        )
+    ).single_value()
+
+    transactions = []
+    execute_write_fn = db.execute_write_fn
+
+    async def counting_execute_write_fn(fn, **kwargs):
+        transactions.append(fn)
+        return await execute_write_fn(fn, **kwargs)
+
+    db.execute_write_fn = counting_execute_write_fn
+
+    responses = await asyncio.gather(
+        *[
+            datasette.client.post(
+                "/-/datasette-comments/api/reaction/add",
+                json={"comment_id": comment_id, "reaction": reaction},
+                cookies=cookies,
+            )
+            for reaction in "👍👀🎉"
+        ],
+        datasette.client.post(
+            "/-/datasette-comments/api/thread/comment/add",
+            json={"thread_id": thread_id, "contents": "reply"},
+            cookies=cookies,
+        ),
+    )
+    assert [response.status_code for response in responses] == [200] * 4
+    assert len(transactions) == 1
+    assert (
+        await db.execute(
+            "select count(*) from datasette_comments_reactions where comment_id = ?",
+            (comment_id,),
+        )
+    ).single_value() == 3
+
+    # a failing write is rolled back on its own, and gets its own error
+    results = await asyncio.gather(
+        write_queue.batched_write(
+            datasette,
+            "update datasette_comments_threads set resolved_at = 'now' where id = ?",
+            (thread_id,),
+        ),
+        write_queue.batched_write(datasette, "insert into missing values (1)"),
+        return_exceptions=True,
+    )
+    assert results[0] == 1
+    assert "no such table" in str(results[1])
+    assert len(transactions) == 2
+    assert (
+        await db.execute(
+            "select resolved_at from datasette_comments_threads where id = ?",
+            (thread_id,),
+        )
+    ).single_value() == "now"
+
+
+@pytest.mark.asyncio
+async def test_nonblocking_reactions():
+    datasette = Datasette(
+        memory=True,
+        config={
+            "permissions": {"datasette-comments-access": {"id": ["alex"]}},
+            "plugins": {
+                "datasette-comments": {
+                    "nonblocking_reactions": True,
+                    "write_batch_delay": 0.05,
+                }
+            },
+        },
+    )
+    await datasette.invoke_startup()
+    cookies = cookie_for_actor(datasette, "alex")
+    subscription = events.event_bus(datasette).subscribe([events.thread_channel("t")])
+    await datasette.get_internal_database().execute_write_script(
+        """
+        insert into datasette_comments_threads(
+          id, creator_actor_id, target_type, target_database
+        ) values ('t', 'alex', 'database', 'data');
+        insert into datasette_comments_comments(
+          id, thread_id, author_actor_id, contents
+        ) values ('c', 't', 'alex', 'hi');
+        """
+    )
+
+    async def reactions():
+        return (
+            await datasette.client.get(
+                "/-/datasette-comments/api/reactions/c", cookies=cookies
+            )
+        ).json()
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/reaction/add",
+        json={"comment_id": "c", "reaction": "👍"},
+        cookies=cookies,
+    )
+    assert response.json() == {"ok": True}
+    # acknowledged before it was committed
+    assert await reactions() == []
+    assert await subscription.get(1) == {
+        "type": "reaction_added",
+        "reaction": "👍",
+        "comment_id": "c",
+        "thread_id": "t",
+    }
+    assert await reactions() == [{"reactor_actor_id": "alex", "reaction": "👍"}]
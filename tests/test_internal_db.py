@@ -0,0 +1,549 @@
+from datasette.app import Datasette
+from datasette.database import Database
+from datasette_user_profiles.routes.pages import UserProfile
+from datasette_comments import internal_db, write_queue
+from datasette.tracer import capture_traces
+import asyncio
+import json
+import pytest
+import sqlite3
+import threading
+
+from test_comments import cookie_for_actor, make_datasette
+
+
+@pytest.mark.asyncio
+async def test_authors_from_actor_ids_bulk(monkeypatch):
+    datasette = make_datasette()
+    await datasette.invoke_startup()
+    db = datasette.get_internal_database()
+    await db.execute_write(
+        "insert into datasette_user_profiles(actor_id, display_name) values ('alex', 'Alex Garcia')"
+    )
+    await db.execute_write(
+        "insert into datasette_user_profile_photos(actor_id, photo) values ('alex', x'00')"
+    )
+
+    loads = []
+    load_authors = internal_db._load_authors
+
+    async def counting_load_authors(datasette, actor_ids):
+        loads.append(list(actor_ids))
+        await asyncio.sleep(0.01)
+        return await load_authors(datasette, actor_ids)
+
+    monkeypatch.setattr(internal_db, "_load_authors", counting_load_authors)
+
+    first, second = await asyncio.gather(
+        internal_db.authors_from_actor_ids(datasette, ["alex", "simon", "alex", None]),
+        internal_db.authors_from_actor_ids(datasette, ["simon"]),
+    )
+    # one lookup, shared by the concurrent request for the same actor
+    assert loads == [["alex", "simon"]]
+    assert first["alex"].model_dump() == {
+        "actor_id": "alex",
+        "name": "Alex Garcia",
+        "profile_photo_url": "/-/profile/pic/alex",
+        "username": "alex",
+    }
+    assert first["simon"] == second["simon"]
+    assert second["simon"].name == "simon"
+    assert internal_db._pending_authors == {}
+
+
+@pytest.mark.asyncio
+async def test_authors_from_actor_ids_fallback(monkeypatch):
+    datasette = make_datasette()
+    await datasette.invoke_startup()
+    await datasette.get_internal_database().execute_write(
+        "alter table datasette_user_profile_photos rename to renamed_photos"
+    )
+
+    async def get_profile(datasette, actor_id):
+        return UserProfile(actor_id=actor_id, display_name=actor_id.upper())
+
+    monkeypatch.setattr(internal_db, "get_profile", get_profile)
+    authors = await internal_db.authors_from_actor_ids(datasette, ["a", "b"])
+    assert {actor_id: author.name for actor_id, author in authors.items()} == {
+        "a": "A",
+        "b": "B",
+    }
+
+
+def test_author_cache_lru_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(internal_db.time, "monotonic", lambda: now[0])
+    cache = internal_db.AuthorCache(ttl=10, max_size=2)
+    authors = {
+        actor_id: internal_db._author(actor_id, None, False)
+        for actor_id in ("a", "b", "c")
+    }
+
+    cache.set_many({"a": authors["a"], "b": authors["b"]}, cache.generation)
+    assert cache.get("a") == authors["a"]
+    # "b" is now least recently used, so it's evicted to make room for "c"
+    cache.set_many({"c": authors["c"]}, cache.generation)
+    assert cache.get("b") is None
+    assert cache.get("c") == authors["c"]
+
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 2,
+        "hit_rate": 0.5,
+        "size": 1,
+        "max_size": 2,
+        "ttl": 10,
+    }
+
+    # results loaded before an invalidation are not stored
+    generation = cache.generation
+    cache.invalidate(["c"])
+    cache.set_many({"a": authors["a"]}, generation)
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_authors_cached_until_invalidated():
+    datasette = Datasette(
+        memory=True,
+        config={
+            "permissions": {
+                "profile_access": {"id": ["alex"]},
+                "debug-menu": {"id": ["root"]},
+            },
+            "plugins": {"datasette-comments": {"author_cache_size": 10}},
+        },
+    )
+    await datasette.invoke_startup()
+    cache = internal_db.author_cache(datasette)
+    assert cache.max_size == 10
+
+    author = await internal_db.author_from_profile(datasette, "alex")
+    assert author.name == "alex"
+    assert await internal_db.author_from_profile(datasette, "alex") == author
+    await internal_db.author_from_profile(datasette, "simon")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    response = await datasette.client.post(
+        "/-/api/user-profile/update",
+        json={"display_name": "Alex Garcia"},
+        cookies=cookie_for_actor(datasette, "alex"),
+    )
+    assert response.status_code == 200
+    # still cached until the profile's owner is invalidated
+    assert (await internal_db.author_from_profile(datasette, "alex")).name == "alex"
+    internal_db.invalidate_authors(datasette, ["alex"])
+    author = await internal_db.author_from_profile(datasette, "alex")
+    assert author.name == "Alex Garcia"
+    assert (cache.hits, cache.misses) == (2, 3)
+    await internal_db.author_from_profile(datasette, "simon")
+    assert (cache.hits, cache.misses) == (3, 3)
+
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/cache_stats",
+        cookies=cookie_for_actor(datasette, "root"),
+    )
+    assert response.status_code == 200
+    assert response.json()["authors"] == cache.stats()
+    assert set(response.json()["labels"]) >= {"hits", "misses", "size"}
+    response = await datasette.client.get(
+        "/-/datasette-comments/api/cache_stats",
+        cookies=cookie_for_actor(datasette, "alex"),
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_resolve_target_labels_one_query_per_table():
+    datasette = Datasette(
+        config={
+            "databases": {
+                "two": {"tables": {"pairs": {"label_column": "title"}}},
+            }
+        }
+    )
+    one = datasette.add_database(Database(datasette, memory_name="labels_one"), "one")
+    two = datasette.add_database(Database(datasette, memory_name="labels_two"), "two")
+    await one.execute_write_script(
+        """
+        create table people(id integer primary key, name text);
+        insert into people values (1, 'Alex'), (2, 'Simon');
+        """
+    )
+    await two.execute_write_script(
+        """
+        create table pairs(a text, b integer, title text, primary key (a, b));
+        insert into pairs values ('x', 1, 'First'), ('x', 2, 'Second');
+        """
+    )
+
+    def target(database, table, rowids):
+        return (database, table, None if rowids is None else json.dumps(rowids))
+
+    targets = [
+        target("one", "people", ["1"]),
+        target("one", "people", ["2"]),
+        target("one", "people", ["3"]),
+        target("one", "people", None),
+        target("two", "pairs", ["x", "2"]),
+        target("two", "pairs", ["x", "1"]),
+        target("two", "pairs", ["x"]),
+        target("missing", "table", ["1"]),
+    ]
+    traces = []
+    with capture_traces(traces):
+        labels = await internal_db.resolve_target_labels(datasette, targets)
+
+    assert labels == {
+        targets[0]: "Alex",
+        targets[1]: "Simon",
+        targets[4]: "Second",
+        targets[5]: "First",
+    }
+    label_queries = [
+        trace["sql"]
+        for trace in traces
+        if trace["type"] == "sql" and "json_each(:keys)" in trace["sql"]
+    ]
+    assert len(label_queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_table_metadata_cache():
+    datasette = Datasette()
+    db = datasette.add_database(Database(datasette, memory_name="metadata"), "data")
+    await db.execute_write_script(
+        """
+        create table people(id integer primary key, name text);
+        create table events(a integer, b integer, c integer);
+        """
+    )
+    cache = internal_db.table_metadata_cache(datasette)
+
+    async def metadata(database, table):
+        version = await internal_db.get_schema_version(datasette, database)
+        return await internal_db.get_table_metadata(datasette, database, table, version)
+
+    assert await metadata("data", "people") == ("name", ["id"])
+    assert await metadata("data", "people") == ("name", ["id"])
+    # no label column, missing table and missing database are all cached
+    for _ in range(2):
+        assert await metadata("data", "events") == (None, [])
+        assert await metadata("data", "missing") == (None, [])
+        assert await metadata("detached", "people") == (None, [])
+    assert (cache.hits, cache.misses) == (4, 4)
+
+    # a schema change invalidates what was cached before it
+    await db.execute_write("create table titled(id integer primary key, title text)")
+    assert await metadata("data", "titled") == ("title", ["id"])
+    assert await metadata("data", "people") == ("name", ["id"])
+    assert cache.stats()["misses"] == 6
+    assert cache.stats()["hit_rate"] == 0.4
+
+
+@pytest.mark.asyncio
+async def test_target_labels_stored_and_refreshed():
+    datasette = make_datasette()
+    db = datasette.add_database(Database(datasette, memory_name="stored"), "data")
+    await db.execute_write_script(
+        """
+        create table people(id integer primary key, name text);
+        insert into people values (1, 'Alex');
+        """
+    )
+    cookies = cookie_for_actor(datasette, "alex")
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={
+            "type": "row",
+            "database": "data",
+            "table": "people",
+            "rowids": "1",
+            "comment": "hi",
+        },
+        cookies=cookies,
+    )
+    assert response.status_code == 200
+
+    async def activity_labels():
+        traces = []
+        with capture_traces(traces):
+            response = await datasette.client.get(
+                "/-/datasette-comments/api/activity_search", cookies=cookies
+            )
+        # served from the stored label, without querying the user's database
+        assert not any("people" in trace.get("sql", "") for trace in traces)
+        return [row["target_label"] for row in response.json()["data"]]
+
+    assert await activity_labels() == ["Alex"]
+    # the first activity request refreshed labels straight away
+    await internal_db._label_refreshes[datasette]["task"]
+
+    await db.execute_write("update people set name = 'Alex Garcia'")
+    assert await activity_labels() == ["Alex"]
+    assert await internal_db.refresh_target_labels(datasette) == 1
+    assert await internal_db.refresh_target_labels(datasette) == 0
+    assert await activity_labels() == ["Alex Garcia"]
+
+    # the last known label is kept once the database is gone
+    datasette.remove_database("data")
+    assert await internal_db.refresh_target_labels(datasette) == 0
+    assert await activity_labels() == ["Alex Garcia"]
+
+
+@pytest.mark.asyncio
+async def test_target_labels_refreshed_in_batches():
+    datasette = make_datasette()
+    await datasette.invoke_startup()
+    db = datasette.add_database(Database(datasette, memory_name="batches"), "data")
+    await db.execute_write_script(
+        """
+        create table people(id integer primary key, name text);
+        insert into people values (1, 'Alex'), (2, 'Simon'), (3, 'Cleo');
+        """
+    )
+    internal = datasette.get_internal_database()
+    # threads from before labels were stored
+    await internal.execute_write_many(
+        """
+        insert into datasette_comments_threads(
+          id, creator_actor_id, target_type, target_database, target_table,
+          target_row_ids
+        )
+        values (?, 'alex', 'row', 'data', 'people', ?)
+        """,
+        [(f"thread-{i}", json.dumps([str(i)])) for i in (1, 2, 3)],
+    )
+
+    async def labels():
+        rows = await internal.execute(
+            "select target_label from datasette_comments_threads order by id"
+        )
+        return [row["target_label"] for row in rows]
+
+    # unlabelled threads are filled in first, batch_size at a time
+    assert await internal_db.refresh_target_labels(datasette, batch_size=2) == 2
+    assert await labels() == ["Alex", "Simon", None]
+    assert await internal_db.refresh_target_labels(datasette, batch_size=2) == 1
+    assert await labels() == ["Alex", "Simon", "Cleo"]
+
+    # labelled threads are rechecked batch_size at a time, wrapping around
+    await db.execute_write("update people set name = upper(name)")
+    assert await internal_db.refresh_target_labels(datasette, batch_size=2) == 2
+    assert await labels() == ["ALEX", "SIMON", "Cleo"]
+    assert await internal_db.refresh_target_labels(datasette, batch_size=2) == 1
+    assert await labels() == ["ALEX", "SIMON", "CLEO"]
+
+    # the first activity request backfills a missing label without waiting
+    # for label_refresh_interval
+    await internal.execute_write(
+        "update datasette_comments_threads set target_label = null"
+    )
+    internal_db._label_refreshes.pop(datasette, None)
+    internal_db.schedule_target_label_refresh(datasette)
+    await internal_db._label_refreshes[datasette]["task"]
+    assert await labels() == ["ALEX", "SIMON", "CLEO"]
+
+    # threads whose label can't be found don't hold up newer ones
+    await internal.execute_write_many(
+        """
+        insert into datasette_comments_threads(
+          id, creator_actor_id, target_type, target_database, target_table,
+          target_row_ids
+        )
+        values (?, 'alex', 'row', 'data', ?, '["1"]')
+        """,
+        [("thread-00", "missing"), ("thread-01", "missing"), ("thread-9", "people")],
+    )
+    assert await internal_db.refresh_target_labels(datasette, batch_size=2) == 0
+    assert await internal_db.refresh_target_labels(datasette, batch_size=2) == 1
+    assert await labels() == [None, None, "ALEX", "SIMON", "CLEO", "ALEX"]
+
+
+@pytest.mark.asyncio
+async def test_target_label_refresh_failures_logged(monkeypatch, caplog):
+    datasette = make_datasette()
+
+    async def refresh_target_labels(datasette):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(internal_db, "refresh_target_labels", refresh_target_labels)
+    internal_db.schedule_target_label_refresh(datasette)
+    task = internal_db._label_refreshes[datasette]["task"]
+    await asyncio.wait([task])
+    await asyncio.sleep(0)
+    assert "label refresh failed" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_dedicated_comments_database(tmp_path):
+    path = tmp_path / "comments.db"
+    datasette = Datasette(
+        memory=True,
+        config={
+            "permissions": {"datasette-comments-access": {"id": ["alex"]}},
+            "plugins": {
+                "datasette-comments": {
+                    "database_path": str(path),
+                    "database_cache_size_kb": 4096,
+                }
+            },
+        },
+    )
+    await datasette.invoke_startup()
+    db = internal_db.comments_database(datasette)
+    assert isinstance(db, internal_db.CommentsDatabase)
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={"type": "database", "database": "data", "comment": "hi #there"},
+        cookies=cookie_for_actor(datasette, "alex"),
+    )
+    assert response.status_code == 200
+    thread_id = response.json()["thread_id"]
+    response = await datasette.client.get(
+        f"/-/datasette-comments/api/thread/comments/{thread_id}",
+        cookies=cookie_for_actor(datasette, "alex"),
+    )
+    assert [comment["contents"] for comment in response.json()["data"]] == ["hi #there"]
+
+    # the comments tables live in the file, not the internal database
+    assert "datasette_comments_threads" in await db.table_names()
+    assert "datasette_comments_threads" not in (
+        await datasette.get_internal_database().table_names()
+    )
+    assert path.exists()
+
+    # pragmas on both read and write connections
+    pragmas = "select * from pragma_journal_mode, pragma_synchronous, pragma_cache_size"
+    expected = ("wal", 1, -4096)
+    assert tuple((await db.execute(pragmas)).first()) == expected
+    assert (
+        tuple(await db.execute_write_fn(lambda conn: conn.execute(pragmas).fetchone()))
+        == expected
+    )
+
+
+@pytest.mark.asyncio
+async def test_read_pool(tmp_path):
+    def make(**config):
+        return Datasette(
+            memory=True,
+            config={
+                "permissions": {"datasette-comments-access": {"id": ["alex"]}},
+                "plugins": {"datasette-comments": config},
+            },
+        )
+
+    # characters that mean something in a URI are escaped
+    path = tmp_path / "a?b#c%20" / "comments.db"
+    path.parent.mkdir()
+    datasette = make(database_path=str(path), read_pool_size=2)
+    await datasette.invoke_startup()
+    cookies = cookie_for_actor(datasette, "alex")
+    pool = internal_db.read_database(datasette)
+    assert isinstance(pool, internal_db.ReadPool)
+    assert pool.size == 2
+    assert internal_db.read_database(datasette) is pool
+
+    response = await datasette.client.post(
+        "/-/datasette-comments/api/thread/new",
+        json={"type": "database", "database": "data", "comment": "hi"},
+        cookies=cookies,
+    )
+    thread_id = response.json()["thread_id"]
+    assert path.exists()
+
+    # hold a write transaction open on the write thread
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold_write(conn):
+        conn.execute("update datasette_comments_threads set resolved_at = 'x'")
+        started.set()
+        release.wait(5)
+
+    db = internal_db.comments_database(datasette)
+    write = asyncio.ensure_future(db.execute_write_fn(hold_write))
+    await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+    try:
+        # reads go ahead on the pool's own connections meanwhile
+        response = await asyncio.wait_for(
+            datasette.client.get(
+                f"/-/datasette-comments/api/thread/comments/{thread_id}",
+                cookies=cookies,
+            ),
+            2,
+        )
+        assert [comment["contents"] for comment in response.json()["data"]] == ["hi"]
+        threads = await pool.execute(
+            "select resolved_at from datasette_comments_threads"
+        )
+        assert threads.single_value() is None
+    finally:
+        release.set()
+        await write
+    thread_name = await asyncio.get_running_loop().run_in_executor(
+        pool._executor, lambda: threading.current_thread().name
+    )
+    assert thread_name.startswith("datasette-comments-read")
+    with pytest.raises(sqlite3.OperationalError):
+        await pool.execute("delete from datasette_comments_threads")
+
+    # closing the comments database closes the pool's connections too
+    connections = list(pool._connections)
+    assert connections
+    db.close()
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("select 1")
+    assert pool._connections == []
+
+    # 0 reads through Datasette's own query threads
+    datasette = make(database_path=str(path), read_pool_size=0)
+    assert internal_db.read_database(datasette) is internal_db.comments_database(
+        datasette
+    )
+    # as does the internal database, whose shared cache locks out other
+    # connections while a write is in progress
+    datasette = make(read_pool_size=2)
+    assert internal_db.read_database(datasette) is datasette.get_internal_database()
+
+
+@pytest.mark.asyncio
+async def test_read_pool_sees_committed_writes(tmp_path):
+    datasette = Datasette(
+        memory=True,
+        config={
+            "plugins": {
+                "datasette-comments": {
+                    "database_path": str(tmp_path / "comments.db"),
+                    "read_pool_size": 2,
+                }
+            }
+        },
+    )
+    await datasette.invoke_startup()
+    pool = internal_db.read_database(datasette)
+    assert isinstance(pool, internal_db.ReadPool)
+
+    async def count():
+        results = await pool.execute("select count(*) from datasette_comments_threads")
+        return results.single_value()
+
+    # open the pooled connections before writing, so they have to see new
+    # commits rather than a fresh snapshot
+    assert await asyncio.gather(count(), count(), count()) == [0, 0, 0]
+    for i in range(3):
+        await write_queue.batched_write(
+            datasette,
+            "insert into datasette_comments_threads(id, target_type, target_database)"
+            " values (?, 'database', 'data')",
+            [f"thread-{i}"],
+        )
+        assert await asyncio.gather(count(), count()) == [i + 1, i + 1]
+
+    internal_db.comments_database(datasette).close()
+    assert pool._connections == []
@@ -0,0 +1,129 @@
+from datasette.tracer import capture_traces
+from datasette_comments.internal_db import encode_cursor
+import pytest
+import pytest_asyncio
+import re
+
+from test_comments import cookie_for_actor, make_datasette
+
+# json_each() is a table-valued function over the request's own parameters,
+# so scanning it is expected. Anything else means a missing index.
+FULL_SCAN = re.compile(r"^SCAN (?!json_each\b)")
+
+
+@pytest_asyncio.fixture
+async def seeded():
+    datasette = make_datasette()
+    cookies = cookie_for_actor(datasette, "alex")
+
+    for body in (
+        {"type": "table", "database": "mydb", "table": "mytable", "comment": "t"},
+        {
+            "type": "row",
+            "database": "mydb",
+            "table": "mytable",
+            "rowids": "1",
+            "comment": "r #tag",
+        },
+    ):
+        response = await datasette.client.post(
+            "/-/datasette-comments/api/thread/new", json=body, cookies=cookies
+        )
+        thread_id = response.json()["thread_id"]
+
+    response = await datasette.client.get(
+        f"/-/datasette-comments/api/thread/comments/{thread_id}", cookies=cookies
+    )
+    comment_id = response.json()["data"][0]["id"]
+    await datasette.client.post(
+        "/-/datasette-comments/api/reaction/add",
+        json={"comment_id": comment_id, "reaction": "👍"},
+        cookies=cookies,
+    )
+    return datasette, cookies, {"thread_id": thread_id, "comment_id": comment_id}
+
+
+def fill(value, ids):
+    """Substitute the seeded {thread_id}/{comment_id} into a path or JSON body."""
+    if isinstance(value, str):
+        return value.format(**ids)
+    if isinstance(value, list):
+        return [fill(item, ids) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, ids) for key, item in value.items()}
+    return value
+
+
+async def comment_queries(datasette, method, path, **kwargs):
+    """Every (sql, params) pair a request ran against the comments tables."""
+    traces = []
+    with capture_traces(traces):
+        response = await datasette.client.request(method, path, **kwargs)
+    assert response.status_code == 200
+    return [
+        (trace["sql"], trace.get("params"))
+        for trace in traces
+        if trace["type"] == "sql" and "datasette_comments_" in trace["sql"]
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "method,path,body",
+    [
+        (
+            "POST",
+            "/-/datasette-comments/api/threads/table_view",
+            {"database": "mydb", "table": "mytable", "rowids": ["1", "2"]},
+        ),
+        (
+            "POST",
+            "/-/datasette-comments/api/threads/row_view",
+            {"database": "mydb", "table": "mytable", "rowids": "1"},
+        ),
+        ("GET", "/-/datasette-comments/api/thread/comments/{thread_id}", None),
+        (
+            "POST",
+            "/-/datasette-comments/api/threads/comments",
+            {"thread_ids": ["{thread_id}", "missing"]},
+        ),
+        ("GET", "/-/datasette-comments/api/reactions/{comment_id}", None),
+    ],
+)
+async def test_thread_lookups_never_full_scan(seeded, method, path, body):
+    datasette, cookies, ids = seeded
+    queries = await comment_queries(
+        datasette, method, fill(path, ids), json=fill(body, ids), cookies=cookies
+    )
+    assert queries, "expected the route to query the comments tables"
+
+    db = datasette.get_internal_database()
+    for sql, params in queries:
+        plan = await db.execute(f"explain query plan {sql}", params)
+        scans = [row["detail"] for row in plan if FULL_SCAN.match(row["detail"])]
+        assert scans == [], f"{scans} in plan for:\n{sql}"
+
+
+@pytest.mark.asyncio
+async def test_profile_activity_pages_from_indexes(seeded):
+    datasette, cookies, _ = seeded
+    cursor = encode_cursor("9999-01-01 00:00:00", "z")
+    queries = await comment_queries(
+        datasette,
+        "GET",
+        f"/-/datasette-comments/api/profile_activity?actorId=alex&cursor={cursor}",
+        cookies=cookies,
+    )
+    assert len(queries) == 2
+
+    # each page reads its rows in order from an index, rather than sorting
+    # all of the actor's comments or reactions
+    db = datasette.get_internal_database()
+    for sql, params in queries:
+        plan = await db.execute(f"explain query plan {sql}", params)
+        details = [row["detail"] for row in plan]
+        assert not [
+            detail
+            for detail in details
+            if FULL_SCAN.match(detail) or "TEMP B-TREE" in detail
+        ], f"{details} in plan for:\n{sql}"